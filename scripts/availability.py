@@ -0,0 +1,281 @@
+"""
+URL 历史可用性存储
+
+working.csv 每轮覆盖、skipped.log 每轮清空，记不住 "某 URL 已经连续 20 天失败" 或 "隔天抽风"。
+这里按 URL 保存最近 WINDOW_DAYS 天的检测结果：
+    probed  u64 位图，第 i 位 = last_day 之前第 i 天检测过
+    ok      u64 位图，第 i 位 = 该天至少一次检测成功
+    sketch  检测成功时的耗时分桶计数（LATENCY_BOUNDS，u16 × 8）
+新的一天到来时位图左移，超出窗口的天数自然丢弃。
+
+持久化分两部分：
+    availability.db    压缩后的二进制基表（头部 + 逐条记录，小端），唯一入库的文件
+    availability.log   运行中追加的结果（日号\\tok\\t耗时\\turl），中断后重跑时重放；
+                       分片各写各的日志，由 --merge-shards 并入
+close() 时压缩：重放后整体写回基表、删除日志；窗口内无检测的 URL 删除，
+超过 MAX_URLS 时丢弃最久未检测的，计数过大的耗时分桶减半（老化）。
+只按源地址（merge_total.csv 中的 URL）记录，跳转后的地址常带一次性 token，不作为键。
+
+评分：
+    reliability  按天指数衰减加权的可用率（半衰期 HALF_LIFE_DAYS），未检测过为 None
+    dead_streak  自上次成功后第一次失败起算的日历天数（不按检测次数计，降频复查不会让它变小）
+    flaps        窗口内可用/不可用切换次数
+"""
+import os
+import time
+import struct
+import threading
+import metrics
+
+# ==============================
+# 配置区
+# ==============================
+MIDDLE_DIR = os.path.join("output", "middle")
+STORE_FILE = os.path.join(MIDDLE_DIR, "availability.db")
+LOG_FILE = os.path.join(MIDDLE_DIR, "availability.log")
+
+WINDOW_DAYS = 64
+MASK = (1 << WINDOW_DAYS) - 1
+HALF_LIFE_DAYS = 7
+DECAY = 0.5 ** (1 / HALF_LIFE_DAYS)
+LATENCY_BOUNDS = (0.1, 0.25, 0.5, 1, 2, 4, 8)    # 最后一桶为 > 8s
+SKETCH_MAX = 1000                                 # 压缩时任一桶超过该值则全部减半
+MAX_URLS = 200000
+
+# 连续失败 DEAD_DAYS 天的 URL 视为长期失效，检测时跳过，但每 RECHECK_DAYS 天仍复查一次
+DEAD_DAYS = int(os.environ.get("IPTV_DEAD_DAYS", 14))
+RECHECK_DAYS = 7
+# 没有历史的 URL 排序时按该可用率对待（排在稳定源之后、常失败源之前）
+UNKNOWN_RELIABILITY = 0.5
+
+MAGIC = b"IPTVAVDB"
+VERSION = 1
+HEADER = struct.Struct("<8sHHII")                # magic | 版本 | 窗口天数 | 记录数 | 保留
+RECORD = struct.Struct("<HIQQ8H")                # url 长度 | last_day | probed | ok | sketch
+
+
+class AvailabilityError(ValueError):
+    """基表损坏或版本不符"""
+
+
+def today():
+    return int(time.time() // 86400)
+
+def latency_bucket(elapsed):
+    for i, bound in enumerate(LATENCY_BOUNDS):
+        if elapsed <= bound:
+            return i
+    return len(LATENCY_BOUNDS)
+
+def _bits(mask):
+    """从低到高产出置位的位序号"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class AvailabilityStore:
+    def __init__(self, path=STORE_FILE, log_path=LOG_FILE):
+        self.path = path
+        self.log_path = log_path
+        self.records = {}    # url -> [last_day, probed, ok, sketch(list)]
+        self._pending = []
+        self._lock = threading.Lock()
+
+    # ---------- 持久化 ----------
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                self._read_base()
+            except (OSError, AvailabilityError, struct.error) as e:
+                print(f"⚠️ 可用性历史不可用，重新积累: {e}")
+                self.records = {}
+        if os.path.exists(self.log_path):
+            self.replay(self.log_path)
+        return self
+
+    def _read_base(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        magic, version, window, count, _ = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION or window != WINDOW_DAYS:
+            raise AvailabilityError(f"{self.path} 格式不符")
+        pos = HEADER.size
+        records = {}
+        for _ in range(count):
+            url_len, last_day, probed, ok, *sketch = RECORD.unpack_from(data, pos)
+            pos += RECORD.size
+            url = data[pos:pos + url_len].decode("utf-8")
+            pos += url_len
+            records[url] = [last_day, probed, ok, sketch]
+        self.records = records
+
+    def replay(self, path):
+        """重放结果日志（中断时可能写了半行，跳过）"""
+        n = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t", 3)
+                if len(parts) != 4:
+                    continue
+                try:
+                    day, ok, elapsed = int(parts[0]), parts[1] == "1", float(parts[2])
+                except ValueError:
+                    continue
+                self._apply(parts[3], day, ok, elapsed)
+                n += 1
+        return n
+
+    def absorb(self, path):
+        """并入另一份结果日志（分片）：重放、追加到本日志后删除"""
+        n = self.replay(path)
+        self.flush()
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with open(path, encoding="utf-8") as src, open(self.log_path, "a", encoding="utf-8") as dst:
+            dst.write(src.read())
+        os.remove(path)
+        return n
+
+    def flush(self):
+        """把本轮新结果追加到日志"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write("".join(pending))
+
+    def compact(self, now=None):
+        """重写基表并清空日志；删除窗口内无检测的 URL，超出 MAX_URLS 时丢弃最久未检测的"""
+        self.flush()
+        now = today() if now is None else now
+        with self._lock:
+            kept = []
+            for url, rec in self.records.items():
+                shift = now - rec[0]
+                if shift >= WINDOW_DAYS:
+                    continue
+                if shift > 0:
+                    rec[0], rec[1], rec[2] = now, (rec[1] << shift) & MASK, (rec[2] << shift) & MASK
+                if not rec[1]:
+                    continue
+                if max(rec[3]) > SKETCH_MAX:
+                    rec[3] = [c // 2 for c in rec[3]]
+                kept.append((url, rec))
+            if len(kept) > MAX_URLS:
+                # 最近一次检测越早（最低置位越高）越先丢弃
+                kept.sort(key=lambda item: (item[1][1] & -item[1][1]).bit_length())
+                kept = kept[:MAX_URLS]
+            dropped = len(self.records) - len(kept)
+            self.records = dict(kept)
+            chunks = [HEADER.pack(MAGIC, VERSION, WINDOW_DAYS, len(kept), 0)]
+            for url, (last_day, probed, ok, sketch) in kept:
+                raw = url.encode("utf-8")
+                chunks.append(RECORD.pack(len(raw), last_day, probed, ok, *sketch))
+                chunks.append(raw)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(chunks))
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        metrics.incr("availability_dropped", dropped)
+        print(f"🗜️ 可用性历史压缩: {len(kept)} 条 URL（删除 {dropped} 条）→ {self.path}")
+
+    def close(self):
+        """写出本轮结果并压缩进基表（日志不留到下一轮，也不入库）"""
+        self.flush()
+        if os.path.exists(self.log_path):
+            self.compact()
+
+    # ---------- 记录 ----------
+    def _apply(self, url, day, ok, elapsed):
+        rec = self.records.get(url)
+        if rec is None:
+            rec = self.records[url] = [day, 0, 0, [0] * (len(LATENCY_BOUNDS) + 1)]
+        shift = day - rec[0]
+        if shift > 0:
+            rec[0], rec[1], rec[2] = day, (rec[1] << shift) & MASK, (rec[2] << shift) & MASK
+            shift = 0
+        bit = 1 << -shift
+        if -shift >= WINDOW_DAYS:
+            return
+        rec[1] |= bit
+        if ok:
+            rec[2] |= bit
+            b = latency_bucket(elapsed)
+            rec[3][b] = min(rec[3][b] + 1, 0xFFFF)
+
+    def record(self, url, ok, elapsed, day=None):
+        day = today() if day is None else day
+        with self._lock:
+            self._apply(url, day, ok, elapsed)
+            self._pending.append(f"{day}\t{int(bool(ok))}\t{elapsed}\t{url}\n")
+
+    # ---------- 评分 ----------
+    def _aligned(self, url, now):
+        """(probed, ok) 对齐到 now（第 0 位 = now 当天）"""
+        rec = self.records.get(url)
+        if rec is None:
+            return 0, 0
+        shift = now - rec[0]
+        if shift >= WINDOW_DAYS:
+            return 0, 0
+        if shift >= 0:
+            return (rec[1] << shift) & MASK, (rec[2] << shift) & MASK
+        return rec[1] >> -shift, rec[2] >> -shift
+
+    def rank_key(self, url):
+        """排序键（越小越靠前）：按可用率降序，没有历史的按 UNKNOWN_RELIABILITY"""
+        score = self.reliability(url)
+        return -(UNKNOWN_RELIABILITY if score is None else score)
+
+    def reliability(self, url, now=None):
+        probed, ok = self._aligned(url, today() if now is None else now)
+        if not probed:
+            return None
+        num = den = 0.0
+        for i in _bits(probed):
+            w = DECAY ** i
+            den += w
+            if ok >> i & 1:
+                num += w
+        return num / den
+
+    def dead_streak(self, url, now=None):
+        probed, ok = self._aligned(url, today() if now is None else now)
+        failed = probed & ~ok
+        if ok:
+            # 只看最近一次成功之后的失败
+            failed &= (ok & -ok) - 1
+        return failed.bit_length()
+
+    def days_since_probe(self, url, now=None):
+        probed, _ = self._aligned(url, today() if now is None else now)
+        return (probed & -probed).bit_length() - 1 if probed else None
+
+    def flaps(self, url, now=None):
+        probed, ok = self._aligned(url, today() if now is None else now)
+        states = [ok >> i & 1 for i in _bits(probed)]
+        return sum(1 for a, b in zip(states, states[1:]) if a != b)
+
+    def latency_p50(self, url):
+        rec = self.records.get(url)
+        if rec is None or not any(rec[3]):
+            return None
+        half = sum(rec[3]) / 2
+        seen = 0
+        for i, count in enumerate(rec[3]):
+            seen += count
+            if seen >= half:
+                return LATENCY_BOUNDS[i] if i < len(LATENCY_BOUNDS) else float("inf")
+
+    def is_chronic_dead(self, url, dead_days=DEAD_DAYS, now=None):
+        """连续失败至少 dead_days 天，且距上次检测不足 RECHECK_DAYS 天"""
+        if dead_days <= 0:
+            return False
+        now = today() if now is None else now
+        since = self.days_since_probe(url, now)
+        return since is not None and since < RECHECK_DAYS and self.dead_streak(url, now) >= dead_days
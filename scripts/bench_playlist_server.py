@@ -0,0 +1,207 @@
+"""
+播放列表服务器压测
+
+启动（或连接已运行的）playlist_server，用 aiohttp 客户端按场景占比并发请求一段时间，
+统计每个场景的请求数、QPS、延迟分位数和平均传输字节（不自动解压，统计的是线上字节数）。
+
+场景:
+    full        原始播放列表，不接受压缩
+    gzip        Accept-Encoding: gzip
+    br          Accept-Encoding: br, gzip（服务器未装 brotli 时退化为 gzip）
+    revalidate  带上次的 ETag（If-None-Match），预期 304
+    filter      ?group=<第一个分组>&max_sources=2
+    icon        播放列表中第一个服务器上存在的本地图标
+
+用法:
+    python scripts/bench_playlist_server.py --duration 10 --concurrency 50
+    python scripts/bench_playlist_server.py --url http://127.0.0.1:8080 --mix full=1,gzip=4,revalidate=10
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+from urllib.parse import quote
+import aiohttp
+import profiling
+
+# ==============================
+# 配置区
+# ==============================
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = "full=1,gzip=3,br=3,revalidate=10,filter=3,icon=5"
+DEFAULT_PLAYLIST = "total.m3u"
+STARTUP_TIMEOUT = 10
+LOGO_PROBES = 50             # 最多尝试多少个不同图标路径
+LOGO_RE = re.compile(r'tvg-logo="(?!https?://)/?([^"]+)"')
+GROUP_RE = re.compile(r'group-title="([^"]*)"')
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# ==============================
+# 场景
+# ==============================
+async def discover(session, base, playlist):
+    """取一次播放列表，确定各场景的请求 (路径, 请求头)"""
+    async with session.get(f"{base}/{playlist}", headers={"Accept-Encoding": "identity"}) as r:
+        r.raise_for_status()
+        text = (await r.read()).decode("utf-8", "replace")
+        etag = r.headers.get("ETag", "")
+    group = next(iter(GROUP_RE.findall(text)), "")
+    async with session.get(f"{base}/{playlist}", headers={"Accept-Encoding": "gzip"}) as r:
+        gzip_etag = r.headers.get("ETag", "")
+    # 第一个服务器上实际存在的本地图标
+    logo = None
+    for candidate in list(dict.fromkeys(LOGO_RE.findall(text)))[:LOGO_PROBES]:
+        async with session.get(f"{base}/{quote(candidate)}") as r:
+            await r.read()
+            if r.status == 200:
+                logo = candidate
+                break
+    scenarios = {
+        "full": (f"/{playlist}", {"Accept-Encoding": "identity"}),
+        "gzip": (f"/{playlist}", {"Accept-Encoding": "gzip"}),
+        "br": (f"/{playlist}", {"Accept-Encoding": "br, gzip"}),
+        "revalidate": (f"/{playlist}", {"Accept-Encoding": "gzip", "If-None-Match": gzip_etag or etag}),
+        "filter": (f"/{playlist}?group={quote(group)}&max_sources=2", {"Accept-Encoding": "gzip"}),
+    }
+    if logo:
+        scenarios["icon"] = (f"/{quote(logo)}", {})
+    return scenarios
+
+async def run_load(base, playlist, mix, duration, concurrency, seed):
+    stats = {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, auto_decompress=False) as session:
+        scenarios = await discover(session, base, playlist)
+        kinds = [k for k in mix if k in scenarios and mix[k] > 0]
+        weights = [mix[k] for k in kinds]
+        for k in mix:
+            if k not in scenarios:
+                print(f"⚠️ 场景不可用，跳过: {k}")
+        for k in kinds:
+            stats[k] = {"latencies": [], "bytes": 0, "status": {}, "errors": 0}
+        deadline = time.perf_counter() + duration
+
+        async def worker(i):
+            rng = random.Random(seed + i)
+            while time.perf_counter() < deadline:
+                kind = rng.choices(kinds, weights)[0]
+                path, headers = scenarios[kind]
+                st = stats[kind]
+                start = time.perf_counter()
+                try:
+                    async with session.get(base + path, headers=headers) as r:
+                        body = await r.read()
+                        st["status"][r.status] = st["status"].get(r.status, 0) + 1
+                except aiohttp.ClientError:
+                    st["errors"] += 1
+                    continue
+                st["latencies"].append(time.perf_counter() - start)
+                st["bytes"] += len(body)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        wall = time.perf_counter() - t0
+
+    results = {}
+    for kind, st in stats.items():
+        n = len(st["latencies"])
+        results[kind] = {
+            "requests": n,
+            "qps": round(n / wall, 1),
+            "p50_ms": round(percentile(st["latencies"], 0.5) * 1000, 2),
+            "p99_ms": round(percentile(st["latencies"], 0.99) * 1000, 2),
+            "avg_bytes": round(st["bytes"] / n) if n else 0,
+            "status": {str(k): v for k, v in sorted(st["status"].items())},
+            "errors": st["errors"],
+        }
+    return wall, results
+
+def print_report(wall, results):
+    total = sum(r["requests"] for r in results.values())
+    print(f"\n{'场景':<12}{'请求数':>10}{'QPS':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'平均字节':>12}  状态码")
+    for kind, r in results.items():
+        print(f"{kind:<12}{r['requests']:>10}{r['qps']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['avg_bytes']:>12}  {r['status']}{'  错误 ' + str(r['errors']) if r['errors'] else ''}")
+    print(f"{'合计':<12}{total:>10}{round(total / wall, 1):>10}")
+
+
+# ==============================
+# 主程序
+# ==============================
+def wait_ready(base, proc):
+    deadline = time.time() + STARTUP_TIMEOUT
+    host, port = base.split("//", 1)[1].split(":")
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务器启动失败，返回码 {proc.returncode}")
+        try:
+            with socket.create_connection((host, int(port)), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("等待服务器启动超时")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="播放列表服务器压测")
+    parser.add_argument("--url", default=None, help="已运行的服务器地址；不指定时在本地启动一个")
+    parser.add_argument("--playlist", default=DEFAULT_PLAYLIST)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="场景占比")
+    parser.add_argument("--duration", type=float, default=10.0, help="压测时长（秒）")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发连接数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report", default=None, help="结果 JSON 输出路径")
+    args = parser.parse_args(argv)
+
+    proc = None
+    base = args.url.rstrip("/") if args.url else None
+    if base is None:
+        port = free_port()
+        base = f"http://127.0.0.1:{port}"
+        proc = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, "playlist_server.py"),
+                                 "--host", "127.0.0.1", "--port", str(port)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        wait_ready(base, proc)
+    print(f"📡 压测 {base}/{args.playlist}：{args.duration:g}s，并发 {args.concurrency}")
+    try:
+        wall, results = asyncio.run(run_load(base, args.playlist, parse_mix(args.mix),
+                                             args.duration, args.concurrency, args.seed))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    print_report(wall, results)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"url": base, "playlist": args.playlist, "duration": round(wall, 3),
+                       "concurrency": args.concurrency, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"📁 压测结果: {args.report}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(profiling.run(main, "bench_playlist_server"))
@@ -0,0 +1,257 @@
+"""
+离线基准测试
+
+在临时工作目录中生成合成数据（network_sources/*.m3u、merge_total.csv、find_*.csv、
+working.m3u、my_sum.csv、manual/sum_cvs CSV），启动本地假 IPTV 服务器，
+依次以子进程运行各阶段脚本，汇总墙钟时间、吞吐量以及各脚本写出的 metrics JSON。
+
+用法:
+    python scripts/benchmark.py --sizes 1000,10000 --latency uniform:0.005,0.05
+    python scripts/benchmark.py --sizes 100000 --stages merge,extract,csv_to_m3u
+    python scripts/benchmark.py --sizes 10000 --stages tester --shards 4   # 4 个分片进程并行 + 合并
+"""
+import os
+import sys
+import csv
+import re
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from fake_iptv_server import start_server
+import profiling
+
+# ==============================
+# 配置区
+# ==============================
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = "1000,10000,100000"
+
+# 阶段名 -> (脚本, metrics 名)
+STAGES = {
+    "merge": ("merge_local_sources.py", "merge_local_sources"),
+    "tester": ("test_adaptive_async_batch.py", "test_adaptive_async_batch"),
+    "extract": ("extract_channels.py", "extract_channels"),
+    "csv_to_m3u": ("csv_to_m3u.py", "csv_to_m3u"),
+}
+DEFAULT_STAGES = "merge,tester,extract,csv_to_m3u"
+
+# 合成 URL 类型占比（对应假服务器路由）
+DEFAULT_MIX = "hls=55,ts=7,relay=3,slow=3,hang=0.5,404=10,redirect=10,html=11.5"
+
+REGIONS = {
+    "hk": ("香港", ["翡翠台", "明珠台", "无线新闻", "tvb+", "凤凰卫视", "凤凰资讯", "有线新闻", "viutv"]),
+    "tw": ("台湾", ["中视", "华视", "台视", "民视", "tvbs", "tvbs新闻", "东森新闻", "三立新闻", "公视"]),
+    "mo": ("澳门", ["澳视澳门", "澳门资讯", "澳门莲花"]),
+    "intl": ("国际", ["cnn", "bbcworldnews", "nhkworld", "dw", "france24", "aljazeera", "cgtn"]),
+}
+BASE_NAMES = [f"CCTV{i}" for i in range(1, 18)] + [
+    "湖南卫视", "浙江卫视", "东方卫视", "江苏卫视", "北京卫视", "山东卫视", "广东卫视", "深圳卫视",
+] + [n for _, names in REGIONS.values() for n in names]
+VARIANTS = ["", " HD", " (720p)", " [SD]", "高清", " 1080p", "-台"]
+GROUPS = ["央视频道", "卫视频道", "台湾频道", "香港频道", "澳门频道", "国际频道", "地方频道"]
+SOURCES = ["电信组播", "济南联通", "上海移动", "电信单播", "青岛联通", "济南移动"]
+
+
+# ==============================
+# 合成数据
+# ==============================
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+def make_url(base, kind, i):
+    return {
+        "hls": f"{base}/hls/{i}.m3u8",
+        "ts": f"{base}/ts/{i}.ts",
+        "relay": f"{base}/relay/{i}",
+        "slow": f"{base}/slow/{i}.m3u8",
+        "hang": f"{base}/hang/{i}",
+        "404": f"{base}/404/{i}",
+        "redirect": f"{base}/redirect/2/hls/{i}.m3u8",
+        "html": f"{base}/html/{i}",
+    }[kind]
+
+def synth_rows(n, base_urls, mix, rng):
+    """生成 n 条 (显示名, url) ，URL 轮流指向各假服务器（不同端口 = 不同主机）"""
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    rows = []
+    for i in range(n):
+        name = rng.choice(BASE_NAMES) + rng.choice(VARIANTS)
+        rows.append((name, make_url(base_urls[i % len(base_urls)], rng.choices(kinds, weights)[0], i)))
+    return rows
+
+def _write_csv(path, header, rows, encoding="utf-8"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="", encoding=encoding) as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+def synth_standard_name(name):
+    """近似 merge_local_sources.normalize_channel_name（不导入以免在当前目录建 output/）"""
+    return re.sub(r"[\s\[\]（）()【】\-_\.]", "", name).lower()
+
+def generate_workdir(workdir, n, base_urls, mix, seed):
+    rng = random.Random(seed)
+    rows = synth_rows(n, base_urls, mix, rng)
+    base_url = base_urls[0]
+
+    # 网络源 M3U（分三个文件）
+    src_dir = os.path.join(workdir, "input", "network", "network_sources")
+    os.makedirs(src_dir, exist_ok=True)
+    for part in range(3):
+        with open(os.path.join(src_dir, f"bench_{part}.m3u"), "w", encoding="utf-8") as f:
+            f.write("#EXTM3U\n")
+            for name, url in rows[part::3]:
+                f.write(f'#EXTINF:-1 tvg-name="{name}" tvg-logo="",{name}\n{url}\n')
+
+    # merge_total.csv（与 merge 阶段产出同结构，可单独跑 tester）
+    _write_csv(os.path.join(workdir, "output", "merge_total.csv"),
+               ["standard_name", "url", "source", "original_name", "logo"],
+               [(synth_standard_name(name), url, "网络源", name, "") for name, url in rows],
+               encoding="utf-8-sig")
+
+    # working.m3u（extract 阶段输入，与 tester 输出同格式）
+    with open(os.path.join(workdir, "output", "working.m3u"), "w", encoding="utf-8") as f:
+        f.write("#EXTM3U\n")
+        for name, url in rows:
+            f.write(f"#EXTINF:-1,{name}\n{url}\n")
+
+    # find_*.csv / manual / sum_cvs
+    for key, (region, names) in REGIONS.items():
+        _write_csv(os.path.join(workdir, "input", "network", "find", f"find_{key}.csv"),
+                   None, [[name] for name in names])
+        _write_csv(os.path.join(workdir, "input", "network", "manual", f"network_{key}_manual.csv"),
+                   None, [(name, region, f"{base_url}/hls/m{key}{j}.m3u8", "手动")
+                          for j, name in enumerate(names)])
+        sampled = rng.sample(rows, min(len(rows), n // 10))
+        _write_csv(os.path.join(workdir, "output", "sum_cvs", f"find_{key}_sum.csv"),
+                   ["tvg-name", "地区", "URL", "来源", "原始tvg-name"],
+                   [(rng.choice(names), region, url, "手动/查找源", original) for original, url in sampled],
+                   encoding="utf-8-sig")
+
+    # my_sum.csv（固定源）
+    _write_csv(os.path.join(workdir, "input", "mysource", "my_sum.csv"), None,
+               [(rng.choice(BASE_NAMES), rng.choice(GROUPS), url, rng.choice(SOURCES))
+                for _, url in rows[: max(1, n // 2)]])
+    os.makedirs(os.path.join(workdir, "output", "log"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "png"), exist_ok=True)
+
+
+# ==============================
+# 运行阶段
+# ==============================
+def run_stage(stage, workdir, env, shards=1):
+    script, metrics_name = STAGES[stage]
+    log_path = os.path.join(workdir, f"bench_{stage}.log")
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, script)]
+    t0 = time.perf_counter()
+    with open(log_path, "w", encoding="utf-8") as log:
+        if stage == "tester" and shards > 1:
+            # 模拟 workflow matrix：N 个分片进程并行，全部结束后合并
+            procs = []
+            for i in range(1, shards + 1):
+                shard_log = open(os.path.join(workdir, f"bench_{stage}_shard{i}.log"), "w", encoding="utf-8")
+                procs.append((subprocess.Popen(cmd + ["--shard", f"{i}/{shards}"], cwd=workdir, env=env,
+                                               stdout=shard_log, stderr=subprocess.STDOUT), shard_log))
+            failed = 0
+            for p, shard_log in procs:
+                failed |= p.wait()
+                shard_log.close()
+            proc = subprocess.run(cmd + ["--merge-shards"], cwd=workdir, env=env,
+                                  stdout=log, stderr=subprocess.STDOUT)
+            proc.returncode |= failed
+        else:
+            proc = subprocess.run(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - t0
+    metrics_path = os.path.join(workdir, "output", "log", f"metrics_{metrics_name}.json")
+    run_metrics = None
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding="utf-8") as f:
+            run_metrics = json.load(f)
+    return {"stage": stage, "returncode": proc.returncode, "wall_seconds": round(wall, 3),
+            "log": log_path, "metrics": run_metrics}
+
+def print_report(results):
+    print(f"\n{'规模':>8} {'阶段':<12}{'墙钟(s)':>10}{'条/秒':>12}{'返回码':>8}")
+    for r in results:
+        rate = round(r["rows"] / r["wall_seconds"], 1) if r["wall_seconds"] else "-"
+        print(f"{r['rows']:>8} {r['stage']:<12}{r['wall_seconds']:>10.3f}{rate:>12}{r['returncode']:>8}")
+        stages = (r["metrics"] or {}).get("stages", {})
+        for path, st in sorted(stages.items()):
+            print(f"{'':>8}   └ {path:<32}{st['seconds']:>10.3f}s")
+
+
+# ==============================
+# 主程序
+# ==============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="IPTV 管道离线基准测试")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="合成行数，逗号分隔")
+    parser.add_argument("--stages", default=DEFAULT_STAGES, help="要运行的阶段，逗号分隔")
+    parser.add_argument("--latency", default="uniform:0.005,0.05", help="假服务器延迟分布")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="URL 类型占比")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=3.0, help="tester 单条超时（秒）")
+    parser.add_argument("--threads", type=int, default=100, help="tester 线程数")
+    parser.add_argument("--servers", type=int, default=4, help="假服务器个数（不同端口，模拟多个主机）")
+    parser.add_argument("--shards", type=int, default=1, help="tester 分片进程数（>1 时并行运行后合并）")
+    parser.add_argument("--workdir", default=None, help="工作目录（默认临时目录）")
+    parser.add_argument("--keep", action="store_true", help="保留工作目录")
+    parser.add_argument("--report", default=None, help="结果 JSON 输出路径")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    stages = [s for s in args.stages.split(",") if s]
+    for s in stages:
+        if s not in STAGES:
+            parser.error(f"未知阶段: {s}")
+    mix = parse_mix(args.mix)
+
+    servers = [start_server(latency=args.latency, seed=args.seed + k, hang_seconds=args.timeout * 4)
+               for k in range(max(1, args.servers))]
+    base_urls = [server.base_url for server in servers]
+    print(f"📡 假服务器: {', '.join(base_urls)}")
+    env = dict(os.environ, IPTV_THREADS=str(args.threads), IPTV_TIMEOUT=str(args.timeout),
+               PYTHONPATH=SCRIPTS_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+    results = []
+    root = args.workdir or tempfile.mkdtemp(prefix="iptv_bench_")
+    try:
+        for n in sizes:
+            workdir = os.path.join(root, f"n{n}")
+            shutil.rmtree(workdir, ignore_errors=True)
+            t0 = time.perf_counter()
+            generate_workdir(workdir, n, base_urls, mix, args.seed)
+            print(f"🧪 生成 {n} 行合成数据: {time.perf_counter() - t0:.2f}s → {workdir}")
+            for stage in stages:
+                before = sum(server.requests for server in servers)
+                result = run_stage(stage, workdir, env, args.shards)
+                result.update(rows=n, server_requests=sum(server.requests for server in servers) - before)
+                results.append(result)
+                print(f"  ⏱ {stage}: {result['wall_seconds']}s (返回码 {result['returncode']})")
+    finally:
+        for server in servers:
+            server.shutdown()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print_report(results)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"latency": args.latency, "mix": mix, "seed": args.seed, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"📁 基准结果: {args.report}")
+    return 0 if all(r["returncode"] == 0 for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(profiling.run(main, "benchmark"))
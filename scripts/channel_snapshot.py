@@ -0,0 +1,264 @@
+"""
+频道表二进制快照
+
+与中间 CSV（merge_total.csv / working.csv 等）一起写出的列式二进制文件，
+下游优先加载比 CSV 新的快照，省去 CSV 解析和逐格 strip。
+
+文件布局（小端）：
+    头部 32 字节: magic "IPTVSNAP" | 版本 u16 | 列数 u16 | 行数 u32 | 正文 crc32 u32 | 保留 u32 | 正文长度 u64
+    正文，按列依次：
+        列头 12 字节: 类型 u8(0=字符串, 1=分类) | 保留 u8 | 列名长度 u16 | 字符串数 u32 | 字符串区长度 u32
+        列名 utf-8（4 字节对齐）
+        偏移表 u32 × (字符串数 + 1)
+        字符串区 utf-8（4 字节对齐）
+        分类列额外跟 编码表 u32 × 行数
+所有区块 4 字节对齐，加载时直接 mmap + memoryview.cast，字符串按需解码。
+"""
+import os
+import sys
+import csv
+import mmap
+import zlib
+import struct
+from array import array
+from channel_table import ChannelTable, StringPool
+import metrics
+
+# ==============================
+# 配置区
+# ==============================
+SNAPSHOT_EXT = ".snap"
+MAGIC = b"IPTVSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIIQ")
+COLUMN_HEADER = struct.Struct("<BBHII")
+KIND_STRING = 0
+KIND_CATEGORICAL = 1
+
+# 环境变量 IPTV_SNAPSHOT=0 可关闭快照读写
+ENABLED = os.environ.get("IPTV_SNAPSHOT", "1") != "0"
+_NATIVE_LE = sys.byteorder == "little"
+
+
+class SnapshotError(ValueError):
+    """快照损坏、版本不符或格式错误"""
+
+
+# ==============================
+# 工具函数
+# ==============================
+def snapshot_path(csv_path):
+    return os.path.splitext(csv_path)[0] + SNAPSHOT_EXT
+
+def _pad(n):
+    return (-n) % 4
+
+def _u32_bytes(values):
+    arr = array("I", values)
+    if not _NATIVE_LE:
+        arr.byteswap()
+    return arr.tobytes()
+
+def _pack_strings(values):
+    """字符串列表 -> (偏移表字节, 字符串区字节)"""
+    offsets = [0]
+    chunks = []
+    pos = 0
+    for v in values:
+        b = v.encode("utf-8")
+        chunks.append(b)
+        pos += len(b)
+        offsets.append(pos)
+    return _u32_bytes(offsets), b"".join(chunks)
+
+
+class PackedStrings:
+    """快照中的字符串列：只读序列，按下标解码"""
+    __slots__ = ("_offsets", "_blob")
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def __iter__(self):
+        offsets, blob = self._offsets, self._blob
+        for i in range(len(offsets) - 1):
+            yield str(blob[offsets[i]:offsets[i + 1]], "utf-8")
+
+
+def _u32_view(buf, start, count):
+    view = buf[start:start + count * 4]
+    if _NATIVE_LE:
+        return view.cast("I")
+    arr = array("I", bytes(view))
+    arr.byteswap()
+    return arr
+
+
+# ==============================
+# 写快照
+# ==============================
+def write_snapshot(table, path):
+    """把 ChannelTable 写成快照（临时文件 + os.replace 原子替换）"""
+    nrows = len(table)
+    parts = []
+    for col in table.columns:
+        name = col.encode("utf-8")
+        if table.is_categorical(col):
+            pool = table.pool(col)
+            strings = pool.values
+            codes = table.codes(col)
+            kind = KIND_CATEGORICAL
+        else:
+            strings = table.column(col)
+            codes = None
+            kind = KIND_STRING
+        offsets, blob = _pack_strings(strings)
+        parts.append(COLUMN_HEADER.pack(kind, 0, len(name), len(strings), len(blob)))
+        parts.append(name + b"\0" * _pad(len(name)))
+        parts.append(offsets)
+        parts.append(blob + b"\0" * _pad(len(blob)))
+        if codes is not None:
+            parts.append(_u32_bytes(codes))
+    body = b"".join(parts)
+    header = HEADER.pack(MAGIC, VERSION, len(table.columns), nrows,
+                         zlib.crc32(body), 0, len(body))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+# ==============================
+# 读快照
+# ==============================
+def load_snapshot(path, verify=True):
+    """
+    mmap 加载快照，返回只读 ChannelTable（列数据直接引用映射内存）
+    需要修改时先 take()/select() 派生新表；用完调用 close()（或 with）释放映射
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            raise SnapshotError(f"快照过短: {path}")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    views = [memoryview(mm)]
+
+    def close():
+        # 引用映射内存的视图全部释放后 mmap 才能关闭
+        for view in reversed(views):
+            if isinstance(view, memoryview):
+                view.release()
+        mm.close()
+
+    try:
+        columns, data, pools = _read_columns(views[0], size, path, verify, views.append)
+    except BaseException:
+        close()
+        raise
+    return ChannelTable.from_columns(columns, data, pools, close=close)
+
+def _read_columns(buf, size, path, verify, keep):
+    """解析快照正文；keep 收集引用 buf 的视图，关闭时统一释放"""
+    magic, version, ncols, nrows, crc, _, body_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise SnapshotError(f"不是频道快照: {path}")
+    if version != VERSION:
+        raise SnapshotError(f"快照版本 {version} 不受支持（当前 {VERSION}）: {path}")
+    if HEADER.size + body_len != size:
+        raise SnapshotError(f"快照长度不符: {path}")
+    if verify and zlib.crc32(buf[HEADER.size:]) != crc:
+        raise SnapshotError(f"快照校验失败: {path}")
+
+    columns, data, pools = [], {}, {}
+    pos = HEADER.size
+    for _ in range(ncols):
+        kind, _, name_len, count, blob_len = COLUMN_HEADER.unpack_from(buf, pos)
+        pos += COLUMN_HEADER.size
+        name = str(buf[pos:pos + name_len], "utf-8")
+        pos += name_len + _pad(name_len)
+        offsets = _u32_view(buf, pos, count + 1)
+        keep(offsets)
+        pos += (count + 1) * 4
+        blob = buf[pos:pos + blob_len]
+        keep(blob)
+        strings = PackedStrings(offsets, blob)
+        pos += blob_len + _pad(blob_len)
+
+        columns.append(name)
+        if kind == KIND_CATEGORICAL:
+            pool = StringPool()
+            for value in strings:
+                pool.code(value)
+            pools[name] = pool
+            data[name] = _u32_view(buf, pos, nrows)
+            keep(data[name])
+            pos += nrows * 4
+        elif kind == KIND_STRING:
+            data[name] = strings
+        else:
+            raise SnapshotError(f"未知列类型 {kind}: {path}")
+    if pos != size:
+        raise SnapshotError(f"快照结构不完整: {path}")
+    return columns, data, pools
+
+
+# ==============================
+# CSV + 快照 组合读写
+# ==============================
+def read_csv_table(csv_path, categorical=()):
+    """解析 UTF-8(-BOM) CSV，首行为列名，每格去首尾空白"""
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return ChannelTable(())
+        columns = [h.strip() for h in header]
+        table = ChannelTable(columns, categorical)
+        width = len(columns)
+        for row in reader:
+            if not row:
+                continue
+            row = [cell.strip() for cell in row[:width]]
+            row += [""] * (width - len(row))
+            table.append(row)
+    return table
+
+def load_table(csv_path, categorical=()):
+    """
+    读取中间频道表：快照存在且不比 CSV 旧时直接加载快照，否则解析 CSV
+    返回的表用完后 close()（或 with），快照表借此释放 mmap
+    """
+    snap = snapshot_path(csv_path)
+    if ENABLED and os.path.exists(snap):
+        if not os.path.exists(csv_path) or os.path.getmtime(snap) >= os.path.getmtime(csv_path):
+            try:
+                table = load_snapshot(snap)
+                metrics.cache("snapshot", True)
+                print(f"⚡ 使用快照 {snap}: {len(table)} 条")
+                return table
+            except (OSError, SnapshotError) as e:
+                print(f"⚠️ 快照不可用，改读 CSV: {e}")
+    metrics.cache("snapshot", False)
+    return read_csv_table(csv_path, categorical)
+
+def save_table(table, csv_path):
+    """CSV 写完后在旁边写快照；关闭或失败时不影响 CSV"""
+    if not ENABLED:
+        return
+    try:
+        write_snapshot(table, snapshot_path(csv_path))
+    except OSError as e:
+        print(f"⚠️ 写快照失败 {csv_path}: {e}")
@@ -0,0 +1,304 @@
+"""
+紧凑列式频道表
+
+merge / 检测 / 生成 M3U 各阶段共用的频道容器：
+- 每列单独存储，分类列（分组、来源、logo 等高重复字符串）只存 uint32 编码，
+  原始字符串在 StringPool 中只保存一份
+- 行以 __slots__ 的 ChannelRow 视图访问，兼容 ch["url"] 这种 dict 写法
+- 提供按列过滤、分组、排序，分类列上的谓词/排序键只对不重复值计算一次
+"""
+from array import array
+
+# ==============================
+# 常用列定义
+# ==============================
+# merge_total.csv 的列顺序
+MERGE_COLUMNS = ("standard_name", "url", "source", "original_name", "logo")
+MERGE_CATEGORICAL = ("source", "logo")
+
+
+# ==============================
+# 字符串池
+# ==============================
+class StringPool:
+    """字符串 <-> 编码 的双向映射，只增不减，可在多个表之间共享"""
+    __slots__ = ("_index", "values")
+
+    def __init__(self):
+        self._index = {}
+        self.values = []
+
+    def code(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = len(self.values)
+            self._index[value] = code
+            self.values.append(value)
+        return code
+
+    def find(self, value):
+        """查找已有编码，不存在返回 None（不会新增）"""
+        return self._index.get(value)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+# ==============================
+# 行视图
+# ==============================
+class ChannelRow:
+    """表中一行的轻量视图，不复制数据"""
+    __slots__ = ("_table", "_i")
+
+    def __init__(self, table, i):
+        self._table = table
+        self._i = i
+
+    @property
+    def index(self):
+        return self._i
+
+    def __getitem__(self, column):
+        return self._table.get(self._i, column)
+
+    def __setitem__(self, column, value):
+        self._table.set(self._i, column, value)
+
+    def get(self, column, default=None):
+        if column not in self._table._cols:
+            return default
+        return self._table.get(self._i, column)
+
+    def keys(self):
+        return self._table.columns
+
+    def as_tuple(self):
+        return self._table.record(self._i)
+
+    def as_dict(self):
+        return dict(zip(self._table.columns, self._table.record(self._i)))
+
+    def __repr__(self):
+        return f"ChannelRow({self.as_dict()!r})"
+
+
+# ==============================
+# 频道表
+# ==============================
+class ChannelTable:
+    """
+    列式频道表
+    columns: 列名顺序
+    categorical: 需要编码存储的列
+    pools: 可选，复用其他表的字符串池（take/filter 派生表时共享）
+    """
+    __slots__ = ("columns", "_cols", "_pools", "_close")
+
+    def __init__(self, columns, categorical=(), pools=None):
+        self.columns = tuple(columns)
+        self._close = None
+        pools = pools or {}
+        self._pools = {}
+        self._cols = {}
+        for col in self.columns:
+            if col in categorical or col in pools:
+                self._pools[col] = pools[col] if col in pools else StringPool()
+                self._cols[col] = array("I")
+            else:
+                self._cols[col] = []
+
+    @classmethod
+    def from_rows(cls, rows, columns, categorical=()):
+        table = cls(columns, categorical)
+        for row in rows:
+            table.append(row)
+        return table
+
+    @classmethod
+    def from_columns(cls, columns, data, pools, close=None):
+        """
+        直接用现成的列数据建表（不复制），用于快照加载
+        data: {列名: 序列}，分类列为编码序列；pools: {分类列名: StringPool}
+        close: 列数据引用外部资源（mmap）时的释放函数，由 close() 调用
+        """
+        table = cls(columns, pools=pools)
+        for col in table.columns:
+            table._cols[col] = data[col]
+        table._close = close
+        return table
+
+    def close(self):
+        """
+        释放列数据引用的外部资源；普通表无操作
+        关闭后本表及 select() 派生的表不能再访问（take()/filter() 派生的表是拷贝，不受影响）
+        """
+        if self._close is not None:
+            close, self._close = self._close, None
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def select(self, columns):
+        """只保留部分列的新表，共享列数据与字符串池"""
+        table = ChannelTable(columns, pools={c: self._pools[c] for c in columns if c in self._pools})
+        for col in table.columns:
+            table._cols[col] = self._cols[col]
+        return table
+
+    def empty_like(self):
+        """同结构、共享字符串池的空表"""
+        return ChannelTable(self.columns, pools=self._pools)
+
+    # ---------- 基本访问 ----------
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self._cols[self.columns[0]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ChannelRow(self, i)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return ChannelRow(self, i)
+
+    def is_categorical(self, column):
+        return column in self._pools
+
+    def get(self, i, column):
+        pool = self._pools.get(column)
+        if pool is not None:
+            return pool.values[self._cols[column][i]]
+        return self._cols[column][i]
+
+    def set(self, i, column, value):
+        pool = self._pools.get(column)
+        self._cols[column][i] = pool.code(value) if pool is not None else value
+
+    def record(self, i):
+        """返回第 i 行的元组（列顺序）"""
+        return tuple(self.get(i, col) for col in self.columns)
+
+    def column(self, column):
+        """整列解码为字符串列表"""
+        pool = self._pools.get(column)
+        if pool is not None:
+            values = pool.values
+            return [values[c] for c in self._cols[column]]
+        return list(self._cols[column])
+
+    def codes(self, column):
+        return self._cols[column]
+
+    def pool(self, column):
+        return self._pools[column]
+
+    # ---------- 追加 ----------
+    def append(self, row):
+        """row 可以是按列顺序的序列，也可以是 dict（缺失列填空字符串）"""
+        if isinstance(row, dict):
+            row = [row.get(col, "") for col in self.columns]
+        for col, value in zip(self.columns, row):
+            pool = self._pools.get(col)
+            self._cols[col].append(pool.code(value) if pool is not None else value)
+
+    def extend(self, other):
+        """追加另一张同列表的全部行；共享池时直接拷贝编码"""
+        for col in self.columns:
+            pool = self._pools.get(col)
+            src = other._cols[col]
+            if pool is None:
+                self._cols[col].extend(other.column(col))
+            elif other._pools.get(col) is pool:
+                self._cols[col].extend(src)
+            else:
+                self._cols[col].extend(pool.code(v) for v in other.column(col))
+
+    # ---------- 派生 ----------
+    def take(self, indices):
+        """按索引取子表（共享字符串池）"""
+        out = self.empty_like()
+        for col in self.columns:
+            src = self._cols[col]
+            dst = out._cols[col]
+            if isinstance(dst, array):
+                dst.extend(src[i] for i in indices)
+            else:
+                dst.extend([src[i] for i in indices])
+        return out
+
+    def filter(self, predicate):
+        """predicate(row) 为真的行组成的新表"""
+        return self.take([i for i in range(len(self)) if predicate(ChannelRow(self, i))])
+
+    def where(self, column, predicate, indices=None):
+        """
+        按单列过滤，返回命中的行索引
+        分类列上 predicate 只对每个不重复值调用一次
+        """
+        indices = range(len(self)) if indices is None else indices
+        data = self._cols[column]
+        pool = self._pools.get(column)
+        if pool is None:
+            return [i for i in indices if predicate(data[i])]
+        verdict = {}
+        hits = []
+        for i in indices:
+            code = data[i]
+            ok = verdict.get(code)
+            if ok is None:
+                ok = verdict[code] = bool(predicate(pool.values[code]))
+            if ok:
+                hits.append(i)
+        return hits
+
+    def group_by(self, column, indices=None):
+        """按列分组，返回 {值: [行索引]}，保持首次出现顺序"""
+        indices = range(len(self)) if indices is None else indices
+        data = self._cols[column]
+        pool = self._pools.get(column)
+        groups = {}
+        for i in indices:
+            groups.setdefault(data[i], []).append(i)
+        if pool is None:
+            return groups
+        return {pool.values[code]: rows for code, rows in groups.items()}
+
+    def argsort(self, column, key=None, indices=None, reverse=False):
+        """
+        按列排序，返回行索引（稳定排序）
+        key 作用于列值；分类列上每个不重复值只计算一次
+        """
+        indices = range(len(self)) if indices is None else indices
+        data = self._cols[column]
+        pool = self._pools.get(column)
+        if pool is None:
+            if key is None:
+                return sorted(indices, key=data.__getitem__, reverse=reverse)
+            return sorted(indices, key=lambda i: key(data[i]), reverse=reverse)
+        cache = {}
+
+        def code_key(i):
+            code = data[i]
+            k = cache.get(code, cache)
+            if k is cache:
+                value = pool.values[code]
+                k = cache[code] = key(value) if key else value
+            return k
+
+        return sorted(indices, key=code_key, reverse=reverse)
+
+    def sort(self, column, key=None, reverse=False):
+        return self.take(self.argsort(column, key=key, reverse=reverse))
@@ -0,0 +1,263 @@
+"""
+裸流容器嗅探（纯 Python）
+
+HEAD 判断不了的源（.ts / .flv / 组播转发等 content-type 不规范的地址）原来只能交给 ffprobe，
+每条都要起一个子进程，最长等满 TIMEOUT。这里只读流的前几百 KB，直接解析容器头确认有视频流和编码：
+    MPEG-TS  PAT -> PMT，看 PMT 中的 stream_type（支持 188/192/204 字节包）
+    FLV      文件头 + tag，取第一个视频 tag 的 CodecID（含 Enhanced RTMP 的 FourCC）
+    MP4      ftyp / moov -> trak -> mdia -> hdlr('vide') + stsd 首个样本描述
+认不出的内容（HLS 播放列表、moov 在文件尾的 MP4 等）返回 None，由调用方回退到 ffprobe。
+
+用法:
+    status, container, codec = sniff(data)           # 随数据增多反复调用，直到 status != SNIFF_MORE
+    ok, container, codec, reason = judge(data)   # ok 为 None 表示无法判断
+"""
+import struct
+
+# ==============================
+# 配置区
+# ==============================
+SNIFF_BYTES = 384 * 1024     # 最多读取的字节数
+SNIFF_CHUNK = 16 * 1024      # 每次读取块大小
+
+SNIFF_VIDEO = "video"        # 确认有视频流
+SNIFF_NO_VIDEO = "no_video"  # 容器完整解析，没有视频流
+SNIFF_MORE = "more"          # 已识别或数据太少，需要更多数据
+SNIFF_UNKNOWN = "unknown"    # 不是能解析的容器
+
+TS_SYNC = 0x47
+TS_PACKET_SIZES = (188, 192, 204)
+TS_SYNC_CHECK = 4            # 连续多少个包都有同步字节才认定为 TS
+TS_VIDEO_TYPES = {
+    0x01: "mpeg1", 0x02: "mpeg2", 0x10: "mpeg4", 0x1B: "h264",
+    0x24: "hevc", 0x42: "avs", 0xD2: "avs2", 0xD4: "avs3", 0xEA: "vc1",
+}
+
+FLV_MAX_TAGS = 32            # 头部声明无视频时，看多少个 tag 仍无视频即判定
+FLV_VIDEO_TAG = 9
+FLV_CODECS = {2: "h263", 3: "screen", 4: "vp6", 5: "vp6a", 6: "screen2", 7: "h264", 12: "hevc", 13: "av1"}
+
+MP4_TOP_BOXES = {b"ftyp", b"styp", b"moov", b"moof", b"mdat", b"free", b"skip", b"wide", b"sidx"}
+MP4_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+FOURCC_CODECS = {
+    b"avc1": "h264", b"avc3": "h264", b"hvc1": "hevc", b"hev1": "hevc",
+    b"av01": "av1", b"vp09": "vp9", b"vp08": "vp8", b"mp4v": "mpeg4",
+}
+
+# HEAD 响应中视为直播流的 content-type 片段（quick_check 用；放在这里是因为本模块没有第三方依赖）
+STREAM_CONTENT_TYPES = [
+    "video/", "mpegurl", "x-mpegurl",
+    "application/vnd.apple.mpegurl",
+    "application/x-mpegurl",
+    "application/octet-stream"
+]
+
+
+# ==============================
+# MPEG-TS
+# ==============================
+def _ts_packet_size(data):
+    """返回 (起始偏移, 包长)，不是 TS 返回 None"""
+    for size in TS_PACKET_SIZES:
+        # 192 字节包的同步字节在 4 字节时间戳之后
+        lead = 4 if size == 192 else 0
+        for start in range(lead, min(size, len(data)) + lead):
+            if all(start + k * size < len(data) and data[start + k * size] == TS_SYNC
+                   for k in range(TS_SYNC_CHECK)):
+                return start, size
+    return None
+
+def _ts_payloads(data, start, size):
+    """逐包产出 (pid, pusi, payload)；start 指向第一个同步字节"""
+    for pos in range(start, len(data) - 187, size):
+        if data[pos] != TS_SYNC:
+            continue
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        if b1 & 0x80:  # transport_error_indicator
+            continue
+        afc = (b3 >> 4) & 0x03
+        if not afc & 0x01:
+            continue
+        offset = pos + 4
+        if afc & 0x02:
+            offset += 1 + data[offset]
+        end = pos + 188
+        if offset < end:
+            yield ((b1 & 0x1F) << 8) | b2, bool(b1 & 0x40), data[offset:end]
+
+def _sections(data, start, size, pids):
+    """拼接指定 PID 上的 PSI 段，产出 (pid, 完整段)"""
+    buffers = {}
+    for pid, pusi, payload in _ts_payloads(data, start, size):
+        if pid not in pids():
+            continue
+        if pusi:
+            pointer = payload[0]
+            buffers[pid] = bytearray(payload[1 + pointer:])
+        elif pid in buffers:
+            buffers[pid] += payload
+        else:
+            continue
+        buf = buffers[pid]
+        if len(buf) >= 3 and buf[0] != 0xFF:
+            length = 3 + (((buf[1] & 0x0F) << 8) | buf[2])
+            if len(buf) >= length:
+                yield pid, bytes(buf[:length])
+                del buffers[pid]
+
+def sniff_ts(data):
+    found = _ts_packet_size(data)
+    if found is None:
+        return SNIFF_UNKNOWN, None, None
+    start, size = found
+    pmt_pids = set()
+    parsed = set()
+    has_pmt = False
+    for pid, section in _sections(data, start, size, lambda: pmt_pids | {0}):
+        table_id = section[0]
+        body_end = len(section) - 4  # 去掉 CRC
+        if pid == 0 and table_id == 0x00:
+            for pos in range(8, body_end - 3, 4):
+                program, pmt_pid = struct.unpack_from(">HH", section, pos)
+                if program != 0:
+                    pmt_pids.add(pmt_pid & 0x1FFF)
+        elif table_id == 0x02 and pid not in parsed:
+            parsed.add(pid)
+            has_pmt = True
+            pos = 12 + (struct.unpack_from(">H", section, 10)[0] & 0x0FFF)
+            while pos + 5 <= body_end:
+                stream_type = section[pos]
+                es_info = struct.unpack_from(">H", section, pos + 3)[0] & 0x0FFF
+                if stream_type in TS_VIDEO_TYPES:
+                    return SNIFF_VIDEO, "ts", TS_VIDEO_TYPES[stream_type]
+                pos += 5 + es_info
+            if pmt_pids and pmt_pids <= parsed:
+                return SNIFF_NO_VIDEO, "ts", None
+    if has_pmt and pmt_pids <= parsed:
+        return SNIFF_NO_VIDEO, "ts", None
+    return SNIFF_MORE, "ts", None
+
+
+# ==============================
+# FLV
+# ==============================
+def sniff_flv(data):
+    if len(data) < 9:
+        return SNIFF_MORE, "flv", None
+    flags = data[4]
+    pos = struct.unpack_from(">I", data, 5)[0] + 4  # 跳过 PreviousTagSize0
+    tags = 0
+    while pos + 12 <= len(data):
+        tag_type = data[pos] & 0x1F
+        tag_size = (data[pos + 1] << 16) | (data[pos + 2] << 8) | data[pos + 3]
+        body = pos + 11
+        if tag_type == FLV_VIDEO_TAG and tag_size > 0:
+            first = data[body]
+            if first & 0x80:  # Enhanced RTMP: 后跟 FourCC
+                if body + 5 > len(data):
+                    break
+                fourcc = bytes(data[body + 1:body + 5])
+                return SNIFF_VIDEO, "flv", FOURCC_CODECS.get(fourcc, fourcc.decode("latin-1"))
+            codec_id = first & 0x0F
+            return SNIFF_VIDEO, "flv", FLV_CODECS.get(codec_id, f"flv_{codec_id}")
+        tags += 1
+        if not flags & 0x01 and tags >= FLV_MAX_TAGS:
+            return SNIFF_NO_VIDEO, "flv", None
+        pos = body + tag_size + 4
+    return SNIFF_MORE, "flv", None
+
+
+# ==============================
+# MP4
+# ==============================
+def _boxes(data, start, end):
+    """产出 (类型, 内容起点, 内容终点, 是否完整)"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, min(pos + size, end), pos + size <= end
+        pos += size
+
+def _mp4_tracks(data, start, end):
+    """在 moov 中收集各 trak 的 (handler, 样本 FourCC)"""
+    tracks = []
+    for box_type, body, body_end, _ in _boxes(data, start, end):
+        if box_type == b"trak":
+            info = {}
+            _mp4_walk(data, body, body_end, info)
+            tracks.append((info.get("handler"), info.get("fourcc")))
+    return tracks
+
+def _mp4_walk(data, start, end, info):
+    for box_type, body, body_end, _ in _boxes(data, start, end):
+        if box_type in MP4_CONTAINERS:
+            _mp4_walk(data, body, body_end, info)
+        elif box_type == b"hdlr" and body + 12 <= body_end:
+            info["handler"] = bytes(data[body + 8:body + 12])
+        elif box_type == b"stsd" and body + 16 <= body_end:
+            info.setdefault("fourcc", bytes(data[body + 12:body + 16]))
+
+def sniff_mp4(data):
+    for box_type, body, body_end, complete in _boxes(data, 0, len(data)):
+        if box_type == b"moov":
+            for handler, fourcc in _mp4_tracks(data, body, body_end):
+                if handler == b"vide":
+                    codec = FOURCC_CODECS.get(fourcc) if fourcc else None
+                    return SNIFF_VIDEO, "mp4", codec or (fourcc or b"?").decode("latin-1")
+            return (SNIFF_NO_VIDEO if complete else SNIFF_MORE), "mp4", None
+        if not complete:
+            break
+    return SNIFF_MORE, "mp4", None
+
+
+# ==============================
+# 入口
+# ==============================
+def sniff(data):
+    """
+    data 为流开头的字节（bytes / bytearray / memoryview）
+    返回 (状态, 容器, 编码)；状态为 SNIFF_* 之一，容器/编码未知时为 None
+    """
+    if len(data) < 8:
+        return SNIFF_MORE, None, None
+    try:
+        if data[:3] == b"FLV":
+            return sniff_flv(data)
+        if bytes(data[4:8]) in MP4_TOP_BOXES:
+            return sniff_mp4(data)
+        if len(data) < 188 * TS_SYNC_CHECK + 4:
+            # TS 需要几个完整包才能确认同步；开头已对齐的先当作 TS 继续读
+            return (SNIFF_MORE, "ts", None) if data[0] == TS_SYNC else (SNIFF_MORE, None, None)
+        return sniff_ts(data)
+    except (struct.error, IndexError):
+        return SNIFF_MORE, None, None
+
+def judge(data):
+    """
+    读完（或读够）后的结论: (ok, 容器, 编码, 失败原因)
+    只有内容本身确认不是媒体（容器无视频流、HTML/JSON 正文）时 ok 为 False；
+    ok 为 None 表示无法判断（如 HLS 播放列表、数据不足、空响应），应回退到 ffprobe。
+    不看 content-type：组播转发常把裸 TS 标成 text/plain
+    """
+    status, container, codec = sniff(data)
+    if status == SNIFF_VIDEO:
+        return True, container, codec, None
+    if status == SNIFF_NO_VIDEO:
+        return False, container, None, "NO_VIDEO_STREAM"
+    head = bytes(data[:64]).lstrip().lower()
+    if head.startswith(b"#extm3u"):
+        return None, "hls", None, None
+    if head.startswith((b"<", b"{")):
+        return False, None, None, "NOT_MEDIA"
+    return None, container, None, None
@@ -1,19 +1,31 @@
 import os
 import csv
 import re
-from collections import defaultdict
+import json
+from channel_table import ChannelTable
+from channel_snapshot import load_table
+from deep_probe import DEEP_COLUMNS, parse_deep, smoothness_key
+from availability import AvailabilityStore
+import metrics
+import profiling
 
 # ==============================
 # 文件夹和图标配置
 # ==============================
 icon_dir = "png"
 default_icon = os.path.join(icon_dir, "default.png")
+icon_manifest = os.path.join(icon_dir, "opt", "manifest.json")   # optimize_icons.py 生成
+icon_variant = "md"                                              # 播放列表引用的图标变体
+ICONS = {}                                                       # 频道名 -> 优化图标路径（main 中加载）
 output_dir = "output"
 os.makedirs(output_dir, exist_ok=True)
 
 fixed_csv = ["input/mysource/my_sum.csv"]
 fixed_folder = "input/network/manual"
 extra_folder = "output/sum_cvs"
+working_csv = "output/working.csv"   # 深度检测结果（吞吐/码率/卡顿）来源
+source_url_column = "源地址"           # working.csv 中跳转前的地址，可用性历史按它记录
+UNMEASURED_KEY = smoothness_key(None)
 
 # ==============================
 # 分组优先级
@@ -43,11 +55,16 @@ GROUP_MAP = {
     "intl": "国际频道"
 }
 
+# 频道表列；name/group/source 重复度高，按分类列编码存储
+CHANNEL_COLUMNS = ("name", "group", "url", "source")
+CHANNEL_CATEGORICAL = ("name", "group", "source")
+
 # ==============================
 # 读取 CSV
 # ==============================
-def read_csv_files(paths, manual_group_map=None):
-    channels = []
+def read_csv_files(paths, manual_group_map=None, channels=None):
+    if channels is None:
+        channels = ChannelTable(CHANNEL_COLUMNS, CHANNEL_CATEGORICAL)
     for path in paths:
         if not os.path.exists(path):
             print(f"⚠️ 路径不存在: {path}")
@@ -55,7 +72,7 @@ def read_csv_files(paths, manual_group_map=None):
         if os.path.isdir(path):
             for file in os.listdir(path):
                 if file.endswith(".csv"):
-                    channels += read_csv_files([os.path.join(path, file)], manual_group_map)
+                    read_csv_files([os.path.join(path, file)], manual_group_map, channels)
         else:
             with open(path, encoding="utf-8") as f:
                 sample = f.read(1024)
@@ -78,13 +95,9 @@ def read_csv_files(paths, manual_group_map=None):
                     # 映射分组名称（小写兼容）
                     group_key_raw = group.strip().lower()
                     group = GROUP_MAP.get(group_key_raw, group.strip())
-                    channels.append({
-                        "name": name.strip(),
-                        "group": group,
-                        "url": url.strip(),
-                        "source": source.strip()
-                    })
+                    channels.append((name.strip(), group, url.strip(), source.strip()))
                     count += 1
+                metrics.incr("rows_parsed", count)
                 print(f"📄 读取 {path} 共 {count} 条数据")
     return channels
 
@@ -102,44 +115,121 @@ def group_key(group):
         return group_order.index(group)
     return len(group_order)
 
+def load_icon_manifest(path=icon_manifest, variant=icon_variant):
+    """优化图标清单中的 频道名 -> 变体文件；没有清单时返回空（回退到原图）"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        blobs = manifest["blobs"]
+        icons = {name: blobs[digest][variant] for name, digest in manifest["channels"].items()
+                 if variant in blobs.get(digest, {})}
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ 图标清单不可用，使用原图: {e}")
+        return {}
+    print(f"🖼️ 读取优化图标 {len(icons)} 个")
+    return icons
+
+def resolve_logo(name):
+    """频道图标路径：优先优化后的变体，其次原图，都没有时用默认图标（每个频道名查一次文件系统）"""
+    if ICONS:
+        # 没有图标清单时不计优化图标命中率
+        logo_path = ICONS.get(name)
+        if logo_path is not None and os.path.exists(logo_path):
+            metrics.cache("logo_optimized", True)
+            return logo_path
+        metrics.cache("logo_optimized", False)
+    logo_path = os.path.join(icon_dir, f"{name}.png")
+    has_logo = os.path.exists(logo_path)
+    metrics.cache("logo_file", has_logo)
+    if has_logo:
+        return logo_path
+    return ICONS.get("default", default_icon)
+
 def source_priority(source, order):
     try:
         return order.index(source)
     except ValueError:
         return len(order)
 
+def load_smoothness(path=working_csv):
+    """working.csv 中深度检测过的 url -> 排序键（越小越流畅）；没有深度检测列时返回空"""
+    if not os.path.exists(path):
+        return {}
+    with load_table(path, categorical=("", "source", "logo")) as table:
+        if not all(col in table.columns for col in DEEP_COLUMNS):
+            return {}
+        smoothness = {}
+        for url, *cells in zip(table.column("url"), *(table.column(col) for col in DEEP_COLUMNS)):
+            result = parse_deep(cells)
+            if result is not None:
+                smoothness[url] = smoothness_key(result)
+    print(f"🔬 读取深度检测结果 {len(smoothness)} 条")
+    return smoothness
+
+def load_source_urls(path=working_csv):
+    """working.csv 中 跳转后 url -> 源地址；补充源里的是跳转后的地址，查可用性历史要换回源地址"""
+    if not os.path.exists(path):
+        return {}
+    with load_table(path, categorical=("", "source", "logo")) as table:
+        if source_url_column not in table.columns:
+            return {}
+        return {url: src for url, src in zip(table.column("url"), table.column(source_url_column))
+                if src and src != url}
+
 # ==============================
 # M3U 生成函数
 # ==============================
-def write_m3u(channels_dict, output_file, source_order=None, exclude_sources=None):
+def write_m3u(channels, output_file, source_order=None, exclude_sources=None, smoothness=None, history=None,
+              source_urls=None, fixed_rows=0):
+    """
+    channels: ChannelTable（列见 CHANNEL_COLUMNS），前 fixed_rows 行为固定源（my_sum.csv / manual）
+    smoothness: load_smoothness() 的结果；history: AvailabilityStore；source_urls: load_source_urls() 的结果
+    同一频道内依次按 源优先级、固定源在补充源之前、流畅度、历史可用率 排序
+    （固定源大多没有检测记录，只在同一层内按流畅度和历史调整，不会被补充源挤到后面）
+    """
     total = 0
     exclude_sources = exclude_sources or []
+    source_urls = source_urls or {}
+    groups = channels.group_by("group")
     with open(output_file, "w", encoding="utf-8") as f:
         f.write("#EXTM3U\n")
-        for group, name_dict in sorted(channels_dict.items(), key=lambda x: group_key(x[0])):
-            for name, sources in sorted(name_dict.items(), key=lambda x: natural_key(x[0])):
-                filtered_sources = [s for s in sources if s["source"] not in exclude_sources]
+        for group in sorted(groups, key=group_key):
+            name_dict = channels.group_by("name", groups[group])
+            for name in sorted(name_dict, key=natural_key):
+                filtered_rows = channels.where("source", lambda s: s not in exclude_sources, name_dict[name])
 
                 # 去重 URL
                 seen_urls = set()
-                unique_sources = []
-                for s in filtered_sources:
-                    if s["url"] not in seen_urls:
-                        unique_sources.append(s)
-                        seen_urls.add(s["url"])
+                unique_rows = []
+                for i in filtered_rows:
+                    url = channels.get(i, "url")
+                    if url not in seen_urls:
+                        unique_rows.append(i)
+                        seen_urls.add(url)
 
+                if history is not None and history.records:
+                    unique_rows = channels.argsort(
+                        "url", key=lambda u: history.rank_key(source_urls.get(u, u)), indices=unique_rows)
+                if smoothness:
+                    unique_rows = channels.argsort(
+                        "url", key=lambda u: smoothness.get(u, UNMEASURED_KEY), indices=unique_rows)
+                if fixed_rows:
+                    unique_rows = sorted(unique_rows, key=lambda i: i >= fixed_rows)
                 if source_order:
-                    unique_sources.sort(key=lambda s: source_priority(s["source"], source_order))
-                for s in unique_sources:
-                    logo_path = os.path.join(icon_dir, f"{name}.png")
-                    logo = logo_path if os.path.exists(logo_path) else default_icon
-                    extinf = f'#EXTINF:-1 tvg-name="{name}" tvg-logo="{logo}" group-title="{s["group"]}",{name}'
-                    f.write(f"{extinf}\n{s['url']}\n")
+                    unique_rows = channels.argsort(
+                        "source", key=lambda s: source_priority(s, source_order), indices=unique_rows)
+                logo = resolve_logo(name)
+                for i in unique_rows:
+                    extinf = f'#EXTINF:-1 tvg-name="{name}" tvg-logo="{logo}" group-title="{group}",{name}'
+                    f.write(f"{extinf}\n{channels.get(i, 'url')}\n")
                     total += 1
     print(f"✅ 已生成 {output_file}，共 {total} 条频道")
     # 输出分组统计
-    for group, name_dict in channels_dict.items():
-        print(f"📺 {group}: {len(name_dict)} 个频道")
+    for group, rows in groups.items():
+        print(f"📺 {group}: {len(channels.group_by('name', rows))} 个频道")
+    return total
 
 # ==============================
 # 主程序
@@ -154,7 +244,9 @@ def main():
     }
 
     # 固定源
-    fixed_channels = read_csv_files(fixed_csv + [fixed_folder], manual_group_map)
+    with metrics.stage("read_fixed") as st:
+        fixed_channels = read_csv_files(fixed_csv + [fixed_folder], manual_group_map)
+        st.add(len(fixed_channels))
 
     # 建立固定源频道名 -> 分组映射（用于统一分组）
     name_to_group = {ch["name"]: ch["group"] for ch in fixed_channels}
@@ -163,27 +255,48 @@ def main():
     fixed_names = [re.escape(ch["name"]) for ch in fixed_channels]
     fixed_pattern = re.compile("|".join(fixed_names), re.I) if fixed_names else re.compile("$^")
 
-    # 补充源
-    extra_channels = read_csv_files([extra_folder])
+    # 补充源（与固定源共享字符串池，合并时直接拷贝编码）
+    with metrics.stage("read_extra") as st:
+        extra_channels = read_csv_files([extra_folder], channels=fixed_channels.empty_like())
+        st.add(len(extra_channels))
 
-    # 补充源只保留固定源已有的频道
-    extra_filtered = [ch for ch in extra_channels if fixed_pattern.search(ch["name"])]
+    # 补充源只保留固定源已有的频道（每个不重复频道名只匹配一次）
+    with metrics.stage("filter_extra") as st:
+        extra_filtered = extra_channels.take(extra_channels.where("name", fixed_pattern.search))
+        st.add(len(extra_channels))
 
     # 合并频道（补充源分组统一为固定源分组）
-    combined = defaultdict(lambda: defaultdict(list))
-    for ch in fixed_channels:
-        combined[ch["group"]][ch["name"]].append(ch)
     for ch in extra_filtered:
-        correct_group = name_to_group.get(ch["name"], ch["group"])
-        ch["group"] = correct_group
-        combined[ch["group"]][ch["name"]].append(ch)
+        ch["group"] = name_to_group.get(ch["name"], ch["group"])
+    combined = fixed_channels.empty_like()
+    combined.extend(fixed_channels)
+    combined.extend(extra_filtered)
+
+    with metrics.stage("load_smoothness"):
+        smoothness = load_smoothness()
+    with metrics.stage("load_availability"):
+        history = AvailabilityStore().load()
+        source_urls = load_source_urls()
+    print(f"📈 读取可用性历史 {len(history.records)} 条")
+    with metrics.stage("load_icons"):
+        ICONS.update(load_icon_manifest())
 
     # 生成 M3U 文件
-    write_m3u(combined, os.path.join(output_dir, "total.m3u"))
-    write_m3u(combined, os.path.join(output_dir, "dxl.m3u"), source_order=dxl_priority, exclude_sources=["济南移动"])
-    write_m3u(combined, os.path.join(output_dir, "sjmz.m3u"), source_order=sjmz_priority)
+    with metrics.stage("write_m3u"):
+        with metrics.stage("total.m3u") as st:
+            st.add(write_m3u(combined, os.path.join(output_dir, "total.m3u"), smoothness=smoothness, history=history, source_urls=source_urls,
+                             fixed_rows=len(fixed_channels)))
+        with metrics.stage("dxl.m3u") as st:
+            st.add(write_m3u(combined, os.path.join(output_dir, "dxl.m3u"), source_order=dxl_priority, exclude_sources=["济南移动"], smoothness=smoothness, history=history, source_urls=source_urls,
+                             fixed_rows=len(fixed_channels)))
+        with metrics.stage("sjmz.m3u") as st:
+            st.add(write_m3u(combined, os.path.join(output_dir, "sjmz.m3u"), source_order=sjmz_priority, smoothness=smoothness, history=history, source_urls=source_urls,
+                             fixed_rows=len(fixed_channels)))
 
     print("✅ 所有 M3U 文件生成完成！")
 
 if __name__ == "__main__":
-    main()
+    metrics.start_run("csv_to_m3u")
+    profiling.run(main, "csv_to_m3u")
+    metrics.finish_run()
+
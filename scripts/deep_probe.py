@@ -0,0 +1,255 @@
+"""
+深度检测：实际下载几秒内容，测量吞吐与卡顿
+
+quick_check 只测到 HEAD 首个响应的延迟，说明不了能否流畅播放。深度检测对可用流：
+    HLS   主播放列表选最高码率的变体（BANDWIDTH 即标称码率），从直播边缘下载约 N 秒的分片；
+          某个分片下载耗时超过其时长记一次卡顿
+    裸流  (TS/FLV 等) 连续读取 N 秒，两次收到数据的间隔超过 STALL_GAP 记一次卡顿；
+          标称码率未知，只记吞吐
+全局限制：并发数（线程池大小）和总带宽（令牌桶，所有线程共享）。限速等待的时间不计入卡顿判断。
+
+结果写入 working.csv 的 DEEP_COLUMNS 列，csv_to_m3u 用 smoothness_key 把最流畅的源排在前面。
+
+用法:
+    results = run_deep_probe(urls, seconds=10, concurrency=8, bandwidth_mbps=50)
+    # url -> (吞吐 kbps, 码率 kbps 或 None, 卡顿次数)，下载失败为 (0, None, None)
+"""
+import os
+import re
+import time
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+import metrics
+
+# ==============================
+# 配置区
+# ==============================
+DEEP_SECONDS = float(os.environ.get("IPTV_DEEP_SECONDS", 0))          # 0 = 不做深度检测
+DEEP_CONCURRENCY = int(os.environ.get("IPTV_DEEP_CONCURRENCY", 8))
+DEEP_BANDWIDTH = float(os.environ.get("IPTV_DEEP_BANDWIDTH", 50))     # 总带宽上限 Mbit/s，0 = 不限
+DEEP_COLUMNS = ("吞吐kbps", "码率kbps", "卡顿")
+
+READ_CHUNK = 64 * 1024
+PLAYLIST_MAX_BYTES = 1024 * 1024
+STALL_GAP = 1.0             # 裸流两次收到数据的最大间隔（秒）
+RATIO_CAP = 4.0             # 吞吐/码率超过该倍数不再区分
+UNMEASURED_STALLS = 0.5     # 未测量的源排在零卡顿与有卡顿之间
+
+ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+# ==============================
+# 全局带宽限制
+# ==============================
+class BandwidthLimiter:
+    """令牌桶（允许 1 秒突发）；先收数据后扣令牌，欠账时让当前线程睡到还清"""
+    def __init__(self, mbps):
+        self.rate = mbps * 1e6 / 8
+        self._tokens = self.rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n):
+        """返回本次等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate) - n
+            self._last = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+# ==============================
+# HLS
+# ==============================
+def _attrs(line):
+    return {k: v.strip('"') for k, v in ATTR_RE.findall(line.split(":", 1)[1])}
+
+def parse_master(text, base_url):
+    """[(BANDWIDTH, 变体 URL)]"""
+    variants = []
+    pending = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            pending = int(_attrs(line).get("BANDWIDTH", 0) or 0)
+        elif line and not line.startswith("#") and pending is not None:
+            variants.append((pending, urljoin(base_url, line)))
+            pending = None
+    return variants
+
+def parse_media(text, base_url):
+    """[(时长, 分片 URL)]"""
+    segments = []
+    duration = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            try:
+                duration = float(line[8:].split(",", 1)[0])
+            except ValueError:
+                duration = 0.0
+        elif line and not line.startswith("#") and duration is not None:
+            segments.append((duration, urljoin(base_url, line)))
+            duration = None
+    return segments
+
+def _get_text(url, timeout, headers):
+    r = requests.get(url, headers=headers, timeout=timeout)
+    r.raise_for_status()
+    return r.text[:PLAYLIST_MAX_BYTES], r.url
+
+def _download(url, limiter, timeout, headers):
+    """下载一个分片，返回 (字节数, 去掉限速等待后的网络耗时)"""
+    start = time.monotonic()
+    waited = 0.0
+    size = 0
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(READ_CHUNK):
+            size += len(chunk)
+            waited += limiter.consume(len(chunk))
+    return size, time.monotonic() - start - waited
+
+def probe_hls(text, base_url, seconds, limiter, timeout, headers):
+    bitrate = None
+    variants = parse_master(text, base_url)
+    if variants:
+        bandwidth, variant_url = max(variants)
+        bitrate = bandwidth / 1000 or None
+        text, base_url = _get_text(variant_url, timeout, headers)
+    segments = parse_media(text, base_url)
+    if not segments:
+        raise ValueError("播放列表中没有分片")
+    # 从直播边缘往前取够 seconds 秒的分片，再按播放顺序下载
+    chosen, media = [], 0.0
+    for duration, seg_url in reversed(segments):
+        chosen.append((duration, seg_url))
+        media += duration
+        if media >= seconds:
+            break
+    chosen.reverse()
+    total_bytes, total_time, stalls = 0, 0.0, 0
+    for duration, seg_url in chosen:
+        size, spent = _download(seg_url, limiter, timeout, headers)
+        total_bytes += size
+        total_time += spent
+        if duration and spent > duration:
+            stalls += 1
+    throughput = total_bytes * 8 / 1000 / max(total_time, 1e-3)
+    if bitrate is None and media:
+        # 没有标称码率时用实际内容码率
+        bitrate = total_bytes * 8 / 1000 / media
+    return throughput, bitrate, stalls
+
+
+# ==============================
+# 裸流
+# ==============================
+def probe_raw(chunks, first, seconds, limiter):
+    """chunks 为响应的块迭代器，first 为已读出的第一块"""
+    start = time.monotonic()
+    waited = limiter.consume(len(first))
+    total_bytes = len(first)
+    stalls = 0
+    last = time.monotonic()
+    for chunk in chunks:
+        now = time.monotonic()
+        if now - last > STALL_GAP:
+            stalls += 1
+        total_bytes += len(chunk)
+        waited += limiter.consume(len(chunk))
+        last = time.monotonic()
+        if last - start >= seconds:
+            break
+    spent = time.monotonic() - start - waited
+    return total_bytes * 8 / 1000 / max(spent, 1e-3), None, stalls
+
+
+def deep_probe(url, seconds, limiter, timeout, headers=None):
+    """返回 (吞吐 kbps, 码率 kbps 或 None, 卡顿次数)"""
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        chunks = r.iter_content(READ_CHUNK)
+        first = next(chunks, b"")
+        if first.lstrip()[:7].upper() == b"#EXTM3U":
+            body = first + b"".join(chunks)
+            text = body[:PLAYLIST_MAX_BYTES].decode(r.encoding or "utf-8", "replace")
+            base_url = r.url
+        else:
+            return probe_raw(chunks, first, seconds, limiter)
+    return probe_hls(text, base_url, seconds, limiter, timeout, headers)
+
+
+def run_deep_probe(urls, seconds=DEEP_SECONDS, concurrency=DEEP_CONCURRENCY, bandwidth_mbps=DEEP_BANDWIDTH,
+                   timeout=15, headers=None, deadline=None):
+    """
+    并发深度检测，返回 url -> (吞吐, 码率, 卡顿)；失败为 (0, None, None)
+    deadline 为 time.monotonic() 截止时间，来不及完整测完的 URL 不再开始
+    """
+    limiter = BandwidthLimiter(bandwidth_mbps)
+    start_by = deadline - seconds - timeout if deadline is not None else None
+    results = {}
+
+    def task(url):
+        if start_by is not None and time.monotonic() > start_by:
+            return url, None
+        try:
+            return url, deep_probe(url, seconds, limiter, timeout, headers)
+        except Exception as e:
+            metrics.host_error(url, f"DEEP_{type(e).__name__}")
+            return url, (0.0, None, None)
+
+    cap = f"带宽上限 {bandwidth_mbps:g} Mbit/s" if bandwidth_mbps > 0 else "带宽不限"
+    print(f"🔬 深度检测 {len(urls)} 条流，每条约 {seconds:g}s，并发 {concurrency}，{cap}")
+    with metrics.stage("deep_probe") as st, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in as_completed([executor.submit(task, u) for u in urls]):
+            url, result = future.result()
+            if result is None:
+                metrics.incr("deep_skipped_deadline")
+                continue
+            results[url] = result
+            st.add(1)
+            if not result[0]:
+                metrics.incr("deep_failed")
+            elif result[2]:
+                metrics.incr("deep_stalled")
+    smooth = sum(1 for tp, _, stalls in results.values() if tp and not stalls)
+    print(f"🔬 深度检测完成: {len(results)} 条，零卡顿 {smooth} 条")
+    return results
+
+
+# ==============================
+# working.csv 列读写与排序
+# ==============================
+def format_deep(result):
+    """(吞吐, 码率, 卡顿) -> 三个 CSV 单元格"""
+    if result is None:
+        return ("", "", "")
+    throughput, bitrate, stalls = result
+    return (str(round(throughput)),
+            "" if bitrate is None else str(round(bitrate)),
+            "" if stalls is None else str(stalls))
+
+def parse_deep(cells):
+    """三个 CSV 单元格 -> (吞吐, 码率, 卡顿)；未测量返回 None"""
+    throughput, bitrate, stalls = (c.strip() for c in cells)
+    if not throughput:
+        return None
+    return (float(throughput), float(bitrate) if bitrate else None, int(stalls) if stalls else None)
+
+def smoothness_key(result):
+    """越小越流畅：先比卡顿次数，再比吞吐/码率余量；未测量的排在零卡顿与有卡顿之间，失败的最后"""
+    if result is None:
+        return (UNMEASURED_STALLS, -1.0)
+    throughput, bitrate, stalls = result
+    if not throughput:
+        return (float("inf"), 0.0)
+    ratio = min(throughput / bitrate, RATIO_CAP) if bitrate else 1.0
+    return (stalls or 0, -ratio)
@@ -12,6 +12,8 @@ import random
 import logging
 from urllib.parse import urlparse, unquote
 import requests
+import metrics
+import profiling
 
 # ==============================
 # 配置
@@ -39,14 +41,16 @@ USER_AGENTS = [
 # ==============================
 # 日志设置
 # ==============================
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding="utf-8"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+def setup_logging():
+    # 只在作为脚本运行时配置，被 filter_rules 导入取文件名规则时不创建日志文件
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.FileHandler(LOG_FILE, encoding="utf-8"),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
 
 # ==============================
 # 工具函数
@@ -106,8 +110,10 @@ def download_url(url: str, out_path: str) -> (bool, str):
                 if not looks_like_m3u(head):
                     logging.warning("Content does not look like M3U")
                 os.replace(temp_path, out_path)
+                metrics.incr("bytes_downloaded", size)
                 return True, "OK"
         except Exception as e:
+            metrics.host_error(url, type(e).__name__)
             wait = BACKOFF_BASE ** (attempt - 1)
             logging.warning(f"Attempt {attempt} failed for {url}: {e}. Backoff {wait}s")
             time.sleep(wait + random.random())
@@ -123,6 +129,7 @@ def ensure_dirs():
 # 主程序
 # ==============================
 def main():
+    setup_logging()
     ensure_dirs()
     if not os.path.exists(SOURCE_LIST):
         logging.error(f"Source list not found: {SOURCE_LIST}")
@@ -141,30 +148,37 @@ def main():
     # 下载每个 URL
     downloaded_files = []
     failed = []
-    for url in urls:
-        try:
-            fname = guess_filename_from_url(url)
-            out_path = os.path.join(OUTPUT_DIR, fname)
-            success, msg = download_url(url, out_path)
-            if success:
-                logging.info(f"Saved: {out_path} ({msg})")
-                downloaded_files.append(fname)
-            else:
-                logging.error(f"Failed: {url} -> {msg}")
-                failed.append((url, msg))
-        except Exception as e:
-            logging.exception(f"Unhandled error for {url}: {e}")
-            failed.append((url, str(e)))
-
-    # 清理未在源列表里的旧文件
-    for f in os.listdir(OUTPUT_DIR):
-        if f not in downloaded_files:
-            path = os.path.join(OUTPUT_DIR, f)
+    with metrics.stage("download") as st:
+        for url in urls:
+            t0 = time.time()
             try:
-                os.remove(path)
-                logging.info(f"Removed old file: {path}")
+                fname = guess_filename_from_url(url)
+                out_path = os.path.join(OUTPUT_DIR, fname)
+                success, msg = download_url(url, out_path)
+                if success:
+                    logging.info(f"Saved: {out_path} ({msg})")
+                    downloaded_files.append(fname)
+                else:
+                    logging.error(f"Failed: {url} -> {msg}")
+                    failed.append((url, msg))
             except Exception as e:
-                logging.warning(f"Failed to remove {path}: {e}")
+                logging.exception(f"Unhandled error for {url}: {e}")
+                failed.append((url, str(e)))
+            metrics.observe("download_url", time.time() - t0)
+            st.add()
+    metrics.incr("downloaded", len(downloaded_files))
+    metrics.incr("failed", len(failed))
+
+    # 清理未在源列表里的旧文件
+    with metrics.stage("cleanup"):
+        for f in os.listdir(OUTPUT_DIR):
+            if f not in downloaded_files:
+                path = os.path.join(OUTPUT_DIR, f)
+                try:
+                    os.remove(path)
+                    logging.info(f"Removed old file: {path}")
+                except Exception as e:
+                    logging.warning(f"Failed to remove {path}: {e}")
 
     # 写失败日志
     if failed:
@@ -177,4 +191,6 @@ def main():
     logging.info(f"Done. Total URLs: {total}. Failed: {len(failed)}.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    metrics.start_run("download_network_m3u")
+    profiling.run(main, "download_network_m3u")
+    metrics.finish_run()
@@ -5,6 +5,8 @@ import time
 import random
 import requests
 from aiohttp import ClientTimeout
+import metrics
+import profiling
 
 # ==============================
 # 配置区
@@ -50,11 +52,14 @@ async def fetch(session, url):
                     text = await resp.text()
                     with open(filename, "w", encoding="utf-8") as f:
                         f.write(text)
+                    metrics.incr("bytes_downloaded", len(text.encode("utf-8")))
                     print(f"✅ 下载成功: {url} → {filename}")
                     return
                 else:
+                    metrics.host_error(url, f"HTTP_{resp.status}")
                     print(f"⚠️ [{resp.status}] 无法下载: {url} (尝试 {attempt}/{MAX_RETRIES})")
         except Exception as e:
+            metrics.host_error(url, type(e).__name__)
             print(f"⚠️ 异步错误 ({attempt}/{MAX_RETRIES}): {url} -> {e}")
         await asyncio.sleep(2)
 
@@ -67,13 +72,17 @@ async def fetch(session, url):
             if resp.status_code == 200 and "#EXTM3U" in resp.text:
                 with open(filename, "w", encoding="utf-8") as f:
                     f.write(resp.text)
+                metrics.incr("proxy_downloads")
                 print(f"✅ 代理下载成功: {proxy_url}")
                 return
             else:
+                metrics.host_error(proxy_url, f"HTTP_{resp.status_code}")
                 print(f"❌ 代理失败 ({resp.status_code}): {proxy_url}")
         except Exception as e:
+            metrics.host_error(proxy_url, type(e).__name__)
             print(f"❌ 代理异常: {proxy_url} -> {e}")
 
+    metrics.incr("failed")
     print(f"❌ 最终下载失败: {url}")
 
 
@@ -90,12 +99,17 @@ async def main():
 # 主入口
 # ==============================
 if __name__ == "__main__":
+    metrics.start_run("download_sources")
     start_time = time.time()
     print("📡 开始下载 M3U 源文件...\n")
 
     try:
-        asyncio.run(main())
+        with metrics.stage("download") as st:
+            profiling.run(asyncio.run, "download_sources", main())
+            st.add(len(SOURCE_LIST))
     except Exception as e:
         print(f"❌ 主任务异常: {e}")
 
     print(f"\n✅ 全部下载任务完成，用时 {time.time() - start_time:.1f} 秒。")
+    metrics.finish_run()
+
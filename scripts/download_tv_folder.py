@@ -1,6 +1,12 @@
 import requests
 import os
+import re
 import json
+import argparse
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+import profiling
 
 # ==============================
 # 配置区
@@ -12,69 +18,183 @@ BRANCH = "main"                   # 分支
 HEADERS = {"User-Agent": "Python"}
 HASH_FILE = os.path.join(OUTPUT_DIR, ".hashes.json")
 RETRY_TIMES = 3
+TIMEOUT = 15
+MAX_WORKERS = int(os.environ.get("ICON_WORKERS", 8))
+CHUNK_SIZE = 64 * 1024
+HASH_FLUSH_EVERY = 20             # 每下载完多少个文件写一次 .hashes.json（中断后从这里续传）
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# --playlist-only 时只下载这些播放列表中出现的频道图标
+PLAYLIST_FILES = [os.path.join("output", f) for f in ("total.m3u", "dxl.m3u", "sjmz.m3u")]
+TVG_NAME_RE = re.compile(r'tvg-name="([^"]*)"')
 
-# ==============================
-# 读取本地 hash
-# ==============================
-if os.path.exists(HASH_FILE):
-    with open(HASH_FILE, "r") as f:
-        local_hashes = json.load(f)
-else:
-    local_hashes = {}
-
-updated_hashes = local_hashes.copy()
 
 # ==============================
-# 获取 GitHub 文件列表
+# 工具函数
 # ==============================
-api_url = f"https://api.github.com/repos/{REPO}/git/trees/{BRANCH}?recursive=1"
-print(f"📡 获取 GitHub 文件列表: {api_url}")
-r = requests.get(api_url, headers=HEADERS)
-r.raise_for_status()
-tree = r.json().get("tree", [])
+def load_hashes():
+    if os.path.exists(HASH_FILE):
+        with open(HASH_FILE, "r") as f:
+            return json.load(f)
+    return {}
 
-# ==============================
-# 下载文件
-# ==============================
-for file in tree:
-    path, sha, type_ = file["path"], file["sha"], file["type"]
-    if type_ != "blob" or not path.startswith(FOLDER_IN_REPO + "/"):
-        continue
+def save_hashes(hashes):
+    """先写临时文件再替换，中断时不会留下半个 JSON"""
+    tmp_path = HASH_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(hashes, f, indent=2)
+    os.replace(tmp_path, HASH_FILE)
 
-    # 本地路径
-    rel_path = os.path.relpath(path, FOLDER_IN_REPO)
-    local_path = os.path.join(OUTPUT_DIR, rel_path)
+def load_playlist_names(paths=PLAYLIST_FILES):
+    """生成的播放列表中的频道名（tvg-name）"""
+    names = set()
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"⚠️ 播放列表不存在: {path}")
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#EXTINF"):
+                    m = TVG_NAME_RE.search(line)
+                    if m:
+                        names.add(m.group(1))
+    return names
 
-    # 文件已存在且 hash 相同，跳过
-    if local_hashes.get(path) == sha and os.path.exists(local_path):
-        print(f"✔ 已存在，跳过: {rel_path}")
-        continue
+def make_session(workers=MAX_WORKERS):
+    """连接池与并发数一致，所有下载线程复用连接"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    # 下载文件
+def download_file(session, raw_url, local_path):
+    """流式写入临时文件，完成后原子替换；返回字节数"""
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    tmp_path = local_path + ".tmp"
+    size = 0
+    try:
+        with session.get(raw_url, timeout=TIMEOUT, stream=True) as r:
+            r.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+        os.replace(tmp_path, local_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size
+
+def fetch_one(session, path, rel_path, local_path):
+    """带重试下载单个文件，成功返回字节数，失败返回 None"""
     raw_url = f"https://raw.githubusercontent.com/{REPO}/{BRANCH}/{path}"
-    success = False
     for attempt in range(RETRY_TIMES):
         try:
-            r_file = requests.get(raw_url, headers=HEADERS, timeout=15)
-            r_file.raise_for_status()
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            with open(local_path, "wb") as f:
-                f.write(r_file.content)
-            updated_hashes[path] = sha
-            print(f"⬇ 下载完成: {rel_path}")
-            success = True
-            break
+            with metrics.stage("download") as st:
+                size = download_file(session, raw_url, local_path)
+                st.add()
+            metrics.incr("bytes_downloaded", size)
+            return size
         except Exception as e:
+            metrics.host_error(raw_url, type(e).__name__)
             print(f"⚠️ 下载失败 {attempt+1}/{RETRY_TIMES}: {rel_path} ({e})")
-    if not success:
-        print(f"❌ 下载失败，跳过: {rel_path}")
+    return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="增量同步 fanmingming/live 的频道图标")
+    parser.add_argument("--playlist-only", action="store_true",
+                        help="只下载生成的播放列表（total/dxl/sjmz.m3u）中出现的频道图标")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="并发下载数")
+    return parser.parse_args(argv)
+
 
 # ==============================
-# 保存最新 hash
+# 主程序
 # ==============================
-with open(HASH_FILE, "w") as f:
-    json.dump(updated_hashes, f, indent=2)
+def main(argv=None):
+    args = parse_args(argv)
+    workers = max(1, args.workers)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # ==============================
+    # 读取本地 hash
+    # ==============================
+    local_hashes = load_hashes()
+    updated_hashes = local_hashes.copy()
+
+    wanted = None
+    if args.playlist_only:
+        wanted = load_playlist_names()
+        print(f"🎯 只同步播放列表中的 {len(wanted)} 个频道")
+
+    # ==============================
+    # 获取 GitHub 文件列表
+    # ==============================
+    session = make_session(workers)
+    api_url = f"https://api.github.com/repos/{REPO}/git/trees/{BRANCH}?recursive=1"
+    print(f"📡 获取 GitHub 文件列表: {api_url}")
+    with metrics.stage("fetch_tree") as st:
+        r = session.get(api_url, timeout=TIMEOUT)
+        r.raise_for_status()
+        tree = r.json().get("tree", [])
+        st.add(len(tree))
+
+    # ==============================
+    # 挑出需要下载的文件
+    # ==============================
+    todo = []
+    skipped = 0
+    for file in tree:
+        path, sha, type_ = file["path"], file["sha"], file["type"]
+        if type_ != "blob" or not path.startswith(FOLDER_IN_REPO + "/"):
+            continue
+
+        # 本地路径
+        rel_path = os.path.relpath(path, FOLDER_IN_REPO)
+        local_path = os.path.join(OUTPUT_DIR, rel_path)
+
+        if wanted is not None and os.path.splitext(os.path.basename(rel_path))[0] not in wanted:
+            metrics.incr("icon_not_in_playlist")
+            continue
+
+        # 文件已存在且 hash 相同，跳过
+        if local_hashes.get(path) == sha and os.path.exists(local_path):
+            metrics.cache("icon_hash", True)
+            skipped += 1
+            continue
+        metrics.cache("icon_hash", False)
+        todo.append((path, sha, rel_path, local_path))
+    print(f"✔ 已存在且未变化，跳过 {skipped} 个；需要下载 {len(todo)} 个")
+
+    # ==============================
+    # 并发下载（hash 清单增量写出，中断后重跑只下载剩余文件）
+    # ==============================
+    done = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_one, session, path, rel_path, local_path): (path, sha, rel_path)
+                       for path, sha, rel_path, local_path in todo}
+            for future in as_completed(futures):
+                path, sha, rel_path = futures[future]
+                if future.result() is None:
+                    failed += 1
+                    print(f"❌ 下载失败，跳过: {rel_path}")
+                    continue
+                print(f"⬇ 下载完成: {rel_path}")
+                updated_hashes[path] = sha
+                done += 1
+                if done % HASH_FLUSH_EVERY == 0:
+                    save_hashes(updated_hashes)
+    finally:
+        # ==============================
+        # 保存最新 hash
+        # ==============================
+        save_hashes(updated_hashes)
+
+    print(f"✅ 增量下载完成！下载 {done} 个，失败 {failed} 个")
 
-print("✅ 增量下载完成！")
+if __name__ == "__main__":
+    metrics.start_run("download_tv_folder")
+    profiling.run(main, "download_tv_folder")
+    metrics.finish_run()
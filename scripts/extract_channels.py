@@ -4,6 +4,9 @@ import unicodedata
 from opencc import OpenCC
 import os
 import difflib
+import time
+import metrics
+import profiling
 
 # ==============================
 # 配置区
@@ -11,6 +14,7 @@ import difflib
 M3U_FILE = "output/working.m3u"          # 输入 M3U
 FIND_DIR = "input/network/find"          # 搜索 CSV 目录
 OUTPUT_DIR = os.path.join("output", "sum_cvs")
+TIMING_SAMPLE = 64                       # 热点调用每 N 次计时一次，按比例估算总耗时
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # 简繁转换器（繁体 -> 简体）
@@ -38,6 +42,10 @@ def normalize_text(text):
     )
     return text.lower()
 
+def fuzzy_ratio(a, b):
+    """模糊匹配相似度（热点，单独成函数便于剖析定位）"""
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
 # ==============================
 # 提取频道函数
 # ==============================
@@ -53,6 +61,12 @@ def extract_channels(find_csv_path, region_name, output_file):
     matches_dict = {name: [] for name in search_names}
     seen_urls = set()  # 去重 URL
 
+    # 热点只计数，每 TIMING_SAMPLE 次抽样计时一次（逐次计时的开销会算进被测循环），结束后一次性上报
+    normalize_sampled = 0.0
+    fuzzy_sampled = 0.0
+    fuzzy_calls = 0
+    entries = 0
+
     # 读取 M3U 文件
     with open(M3U_FILE, "r", encoding="utf-8") as f:
         lines = f.readlines()
@@ -75,7 +89,13 @@ def extract_channels(find_csv_path, region_name, output_file):
             if not tvg_name_original and "," in info_line:
                 tvg_name_original = info_line.split(",")[-1].strip()
 
-            tvg_norm = normalize_text(tvg_name_original)
+            entries += 1
+            if entries % TIMING_SAMPLE:
+                tvg_norm = normalize_text(tvg_name_original)
+            else:
+                t0 = time.perf_counter()
+                tvg_norm = normalize_text(tvg_name_original)
+                normalize_sampled += time.perf_counter() - t0
 
             for idx, name_norm in enumerate(search_norm):
                 matched = False
@@ -92,7 +112,13 @@ def extract_channels(find_csv_path, region_name, output_file):
 
                 # 3️⃣ 模糊匹配（相似度 > 80%）
                 if not matched:
-                    ratio = difflib.SequenceMatcher(None, name_norm, tvg_norm).ratio()
+                    fuzzy_calls += 1
+                    if fuzzy_calls % TIMING_SAMPLE:
+                        ratio = fuzzy_ratio(name_norm, tvg_norm)
+                    else:
+                        t0 = time.perf_counter()
+                        ratio = fuzzy_ratio(name_norm, tvg_norm)
+                        fuzzy_sampled += time.perf_counter() - t0
                     if ratio > 0.8:
                         matched = True
 
@@ -110,6 +136,10 @@ def extract_channels(find_csv_path, region_name, output_file):
         else:
             i += 1
 
+    # 抽样耗时 × TIMING_SAMPLE 为估算值；整段匹配的实测耗时见外层 extract:<地区> 阶段
+    metrics.add_stage_time("normalize", normalize_sampled * TIMING_SAMPLE, items=entries, calls=entries)
+    metrics.add_stage_time("difflib", fuzzy_sampled * TIMING_SAMPLE, items=fuzzy_calls, calls=fuzzy_calls)
+
     # 写入 CSV
     output_path = os.path.join(OUTPUT_DIR, output_file)
     with open(output_path, "w", newline="", encoding="utf-8-sig") as f:
@@ -119,17 +149,24 @@ def extract_channels(find_csv_path, region_name, output_file):
             writer.writerows(matches_dict[name])
 
     total_matches = sum(len(v) for v in matches_dict.values())
+    metrics.incr(f"matches_{region_name}", total_matches)
     print(f"✅ {region_name} 匹配完成，共 {total_matches} 个频道，输出: {output_path}")
 
 
 # ==============================
 # 遍历文件夹并执行提取
 # ==============================
-if __name__ == "__main__":
+def main():
     for file in os.listdir(FIND_DIR):
         if file.endswith(".csv"):
             key = file.replace("find_", "").replace(".csv", "")
             region_name = REGION_MAP.get(key, key)
             output_file = f"find_{key}_sum.csv"
             csv_path = os.path.join(FIND_DIR, file)
-            extract_channels(csv_path, region_name, output_file)
\ No newline at end of file
+            with metrics.stage(f"extract:{key}"):
+                extract_channels(csv_path, region_name, output_file)
+
+if __name__ == "__main__":
+    metrics.start_run("extract_channels")
+    profiling.run(main, "extract_channels")
+    metrics.finish_run()
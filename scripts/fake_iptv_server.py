@@ -0,0 +1,254 @@
+"""
+本地假 IPTV 服务器（离线基准测试用）
+
+路由（<id> 任意字符串，仅用于区分 URL）：
+    /hls/<id>.m3u8          HLS 媒体播放列表（application/vnd.apple.mpegurl）
+    /seg/<id>/<n>.ts        合成 MPEG-TS 分片（含 PAT/PMT + H.264 视频 PID）
+    /ts/<id>.ts             裸 TS 流（同分片内容）
+    /relay/<id>             裸 TS 流，但 content-type 为 text/plain（模拟组播转发等不规范的服务器）
+    /slow/<id>.m3u8         额外延迟 SLOW_SECONDS 后返回播放列表
+    /hang/<id>              长时间不响应（HANG_SECONDS），模拟卡死
+    /404/<id>               404
+    /redirect/<n>/<rest>    302 跳转 n 次后到 /<rest>
+    /html/<id>              200 但 content-type 为 text/html（错误类型）
+
+每个请求在返回前按延迟分布休眠，分布写法：
+    fixed:0.05 | uniform:0.01,0.2 | exp:0.05 | lognormal:-3,0.5
+
+用法:
+    python scripts/fake_iptv_server.py --port 8765 --latency uniform:0.01,0.1
+"""
+import re
+import sys
+import time
+import random
+import struct
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import profiling
+
+# ==============================
+# 配置区
+# ==============================
+DEFAULT_PORT = 8765
+SLOW_SECONDS = 3.0
+HANG_SECONDS = 60.0
+SEGMENT_PACKETS = 512          # 每个 TS 分片的包数（188 字节/包）
+SEGMENT_DURATION = 4
+PLAYLIST_SEGMENTS = 3
+
+TS_PACKET = 188
+PMT_PID = 0x1000
+VIDEO_PID = 0x0100
+AUDIO_PID = 0x0101
+STREAM_TYPE_H264 = 0x1B
+STREAM_TYPE_AAC = 0x0F
+
+
+# ==============================
+# 延迟分布
+# ==============================
+class LatencyModel:
+    def __init__(self, spec="fixed:0", seed=None):
+        self.spec = spec
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        kind, _, args = spec.partition(":")
+        params = [float(x) for x in args.split(",") if x]
+        samplers = {
+            "fixed": lambda: params[0] if params else 0.0,
+            "uniform": lambda: self._rng.uniform(params[0], params[1]),
+            "exp": lambda: self._rng.expovariate(1 / params[0]) if params[0] > 0 else 0.0,
+            "lognormal": lambda: self._rng.lognormvariate(params[0], params[1]),
+        }
+        if kind not in samplers:
+            raise ValueError(f"未知延迟分布: {spec}")
+        self._sample = samplers[kind]
+
+    def sample(self):
+        with self._lock:
+            return max(0.0, self._sample())
+
+
+# ==============================
+# 合成 MPEG-TS
+# ==============================
+def crc32_mpeg2(data):
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc ^= b << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+            crc &= 0xFFFFFFFF
+    return crc
+
+def _psi_packet(pid, table_id, table_id_ext, body):
+    """单包 PSI 段（PAT/PMT），带 pointer_field 和 CRC"""
+    section_length = 5 + len(body) + 4
+    section = struct.pack(">BHHBBB", table_id, 0xB000 | section_length, table_id_ext,
+                          0xC1, 0x00, 0x00) + body
+    section += struct.pack(">I", crc32_mpeg2(section))
+    header = struct.pack(">BHB", 0x47, 0x4000 | pid, 0x10)
+    payload = b"\x00" + section
+    return header + payload + b"\xff" * (TS_PACKET - len(header) - len(payload))
+
+def build_pat():
+    return _psi_packet(0x0000, 0x00, 0x0001, struct.pack(">HH", 0x0001, 0xE000 | PMT_PID))
+
+def build_pmt():
+    body = struct.pack(">HH", 0xE000 | VIDEO_PID, 0xF000)
+    body += struct.pack(">BHH", STREAM_TYPE_H264, 0xE000 | VIDEO_PID, 0xF000)
+    body += struct.pack(">BHH", STREAM_TYPE_AAC, 0xE000 | AUDIO_PID, 0xF000)
+    return _psi_packet(PMT_PID, 0x02, 0x0001, body)
+
+def build_ts_segment(packets=SEGMENT_PACKETS):
+    out = [build_pat(), build_pmt()]
+    cc = 0
+    for i in range(packets - 2):
+        pid = VIDEO_PID if i % 4 else AUDIO_PID
+        pusi = 0x4000 if i % 32 == 0 else 0
+        header = struct.pack(">BHB", 0x47, pusi | pid, 0x10 | (cc & 0x0F))
+        cc += 1
+        if pusi:
+            stream_id = 0xE0 if pid == VIDEO_PID else 0xC0
+            payload = b"\x00\x00\x01" + bytes([stream_id]) + b"\x00\x00\x80\x00\x00"
+        else:
+            payload = b""
+        out.append(header + payload + bytes((i + j) & 0xFF for j in range(TS_PACKET - 4 - len(payload))))
+    return b"".join(out)
+
+SEGMENT_BYTES = build_ts_segment()
+
+
+def media_playlist(stream_id, seq=0):
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{SEGMENT_DURATION}",
+        f"#EXT-X-MEDIA-SEQUENCE:{seq}",
+    ]
+    for n in range(seq, seq + PLAYLIST_SEGMENTS):
+        lines.append(f"#EXTINF:{SEGMENT_DURATION}.0,")
+        lines.append(f"/seg/{stream_id}/{n}.ts")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# ==============================
+# 请求处理
+# ==============================
+ROUTE_RE = re.compile(r"^/(hls|seg|ts|relay|slow|hang|404|redirect|html)/(.+)$")
+
+class FakeIPTVHandler(BaseHTTPRequestHandler):
+    server_version = "FakeIPTV/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, ctype, body=b"", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD" and body:
+            self.wfile.write(body)
+
+    def _route(self):
+        time.sleep(self.server.latency.sample())
+        self.server.count_request()
+        path = self.path.split("?", 1)[0]
+        m = ROUTE_RE.match(path)
+        if not m:
+            return self._send(404, "text/plain", b"not found")
+        kind, rest = m.groups()
+
+        if kind == "hls":
+            return self._send(200, "application/vnd.apple.mpegurl", media_playlist(rest.rsplit(".", 1)[0]))
+        if kind in ("seg", "ts"):
+            return self._send(200, "video/mp2t", SEGMENT_BYTES)
+        if kind == "relay":
+            return self._send(200, "text/plain", SEGMENT_BYTES)
+        if kind == "slow":
+            time.sleep(SLOW_SECONDS)
+            return self._send(200, "application/vnd.apple.mpegurl", media_playlist(rest.rsplit(".", 1)[0]))
+        if kind == "hang":
+            time.sleep(self.server.hang_seconds)
+            self.close_connection = True
+            return None
+        if kind == "404":
+            return self._send(404, "text/plain", b"not found")
+        if kind == "html":
+            return self._send(200, "text/html; charset=utf-8", b"<html><body>blocked</body></html>")
+        if kind == "redirect":
+            hops, _, target = rest.partition("/")
+            hops = int(hops) if hops.isdigit() else 1
+            location = f"/redirect/{hops - 1}/{target}" if hops > 1 else f"/{target}"
+            return self._send(302, "text/plain", b"", {"Location": location})
+        return self._send(404, "text/plain", b"not found")
+
+    def do_GET(self):
+        self._route()
+
+    def do_HEAD(self):
+        self._route()
+
+
+class FakeIPTVServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr, latency=None, hang_seconds=HANG_SECONDS, verbose=False):
+        super().__init__(addr, FakeIPTVHandler)
+        self.latency = latency or LatencyModel()
+        self.hang_seconds = hang_seconds
+        self.verbose = verbose
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(host="127.0.0.1", port=0, latency="fixed:0", seed=None, hang_seconds=HANG_SECONDS):
+    """后台线程启动服务器，port=0 自动分配端口；返回 server（server.shutdown() 停止）"""
+    server = FakeIPTVServer((host, port), LatencyModel(latency, seed), hang_seconds)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ==============================
+# 主程序
+# ==============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地假 IPTV 服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", default="fixed:0", help="延迟分布，如 uniform:0.01,0.2")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--hang-seconds", type=float, default=HANG_SECONDS)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = FakeIPTVServer((args.host, args.port), LatencyModel(args.latency, args.seed),
+                            args.hang_seconds, args.verbose)
+    print(f"📡 假 IPTV 服务器已启动: {server.base_url} (延迟 {args.latency})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"🛑 已停止，共处理 {server.requests} 个请求")
+
+if __name__ == "__main__":
+    sys.exit(profiling.run(main, "fake_iptv_server"))
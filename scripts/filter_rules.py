@@ -0,0 +1,153 @@
+"""
+频道过滤规则引擎
+
+规则从 input/network/filter_rules.txt 读取（格式见该文件注释），全部 allow 模式、全部 block 模式
+各编译成一个合并正则，绝大多数行只做两次 search；只有合并正则命中时才按规则顺序
+逐条确认是哪条规则，结果与逐条 any(... in text) 相同。
+另外读取 input/network/abandonsource.txt，把已废弃上游播放列表对应的本地文件整体跳过。
+
+用法:
+    rules = load_rules()
+    reason = rules.check(standard_name, url)   # None 表示保留，否则为规则名
+    reason = rules.check_source(file_name)     # 源文件级规则
+    rules.report()                             # 打印并记录各规则命中条数
+"""
+import os
+import re
+from download_network_m3u import guess_filename_from_url
+import metrics
+
+# ==============================
+# 配置区
+# ==============================
+RULES_FILE = "input/network/filter_rules.txt"
+ABANDON_FILE = "input/network/abandonsource.txt"
+ACTIVE_FILE = "input/network/networksource.txt"
+ABANDONED_RULE = "ABANDONED_SOURCE"
+SECTION_RE = re.compile(r"^\[(allow|block):([^\]]+)\]$")
+
+
+class RuleError(ValueError):
+    """规则文件格式错误"""
+
+
+def _pattern(line):
+    """子串模式转小写后转义；re: 正则原样使用（被匹配文本已小写）"""
+    if line.startswith("re:"):
+        pattern = line[3:]
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise RuleError(f"正则无效 {pattern!r}: {e}")
+        return pattern
+    return re.escape(line.lower())
+
+def _url_list(path):
+    """读取每行一个 URL 的列表（忽略空行、# 注释和行尾注释）"""
+    urls = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    urls.append(line.split()[0])
+    return urls
+
+
+class RuleSet:
+    def __init__(self):
+        self.rules = []              # [(动作, 名称, [模式...])]，按文件顺序
+        self.abandoned_files = {}    # 文件名 -> 上游 URL
+        self.counts = {}
+        self._allow_re = None        # 全部 allow 模式合并
+        self._block_re = None        # 全部 block 模式合并
+        self._allow_rules = []       # [(名称, 单条规则正则)]，只在合并正则命中后用于定位规则
+        self._block_rules = []
+
+    # ---------- 加载 ----------
+    def load(self, path):
+        current = None
+        with open(path, encoding="utf-8") as f:
+            for lineno, raw in enumerate(f, 1):
+                line = raw.strip()
+                if not line or line.startswith("#"):
+                    continue
+                m = SECTION_RE.match(line)
+                if m:
+                    current = (m.group(1), m.group(2).strip(), [])
+                    self.rules.append(current)
+                elif current is None:
+                    raise RuleError(f"{path}:{lineno} 模式前缺少 [allow:名称] 或 [block:名称]")
+                else:
+                    current[2].append(_pattern(line))
+        self.compile()
+        return self
+
+    def load_abandoned(self, abandon_path=ABANDON_FILE, active_path=ACTIVE_FILE):
+        """abandonsource.txt 中、且不在 networksource.txt 中的上游播放列表"""
+        active = set(_url_list(active_path))
+        for url in _url_list(abandon_path):
+            if url not in active:
+                # 与 download_network_m3u 下载时的文件名一致
+                self.abandoned_files[guess_filename_from_url(url)] = url
+        return self
+
+    def compile(self):
+        for action in ("allow", "block"):
+            rules = [(name, "|".join(patterns)) for a, name, patterns in self.rules if a == action and patterns]
+            combined = re.compile("|".join(f"(?:{p})" for _, p in rules)) if rules else None
+            compiled = [(name, re.compile(p)) for name, p in rules]
+            if action == "allow":
+                self._allow_re, self._allow_rules = combined, compiled
+            else:
+                self._block_re, self._block_rules = combined, compiled
+
+    # ---------- 匹配 ----------
+    def _hit(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        return name
+
+    def match(self, text):
+        """text 已小写；返回 (动作, 规则名)，都未命中返回 (None, None)"""
+        if self._allow_re is not None and self._allow_re.search(text):
+            for name, rule_re in self._allow_rules:
+                if rule_re.search(text):
+                    return "allow", name
+        if self._block_re is not None and self._block_re.search(text):
+            for name, rule_re in self._block_rules:
+                if rule_re.search(text):
+                    return "block", name
+        return None, None
+
+    def check(self, title, url):
+        """返回跳过原因（规则名），保留返回 None；同时累计各规则命中数"""
+        action, name = self.match(f"{title} {url}".lower())
+        if action is None:
+            return None
+        self._hit(name)
+        return name if action == "block" else None
+
+    def check_source(self, file_name):
+        if file_name in self.abandoned_files:
+            return self._hit(ABANDONED_RULE)
+        return None
+
+    # ---------- 汇总 ----------
+    def report(self, title="过滤规则命中"):
+        if not self.counts:
+            print(f"🧹 {title}: 无")
+            return
+        print(f"🧹 {title}:")
+        for name, n in sorted(self.counts.items(), key=lambda kv: -kv[1]):
+            print(f"   {name:<20}{n:>8}")
+            metrics.incr(f"rule_{name}", n)
+
+
+def load_rules(path=RULES_FILE, abandon_path=ABANDON_FILE, active_path=ACTIVE_FILE):
+    rules = RuleSet()
+    if os.path.exists(path):
+        rules.load(path)
+    else:
+        print(f"⚠️ 未找到过滤规则文件 {path}，不做关键字过滤")
+        rules.compile()
+    return rules.load_abandoned(abandon_path, active_path)
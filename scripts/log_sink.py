@@ -0,0 +1,123 @@
+"""
+批量异步日志
+
+检测/过滤过程中每条被拒绝的 URL 都要记一笔，逐条 open/append/close 开销大且并发时可能交错。
+LogSink 把记录放进队列，由单个写线程成批写出，退出时自动刷盘。
+每条记录同时写两份：
+    <name>.log     原有的人读格式（reason -> title / url）
+    <name>.jsonl   结构化记录 {"ts", "reason", "title", "url", "elapsed", "stage"}，便于汇总统计
+
+用法:
+    sink = LogSink()
+    sink.open("skip", "output/log/skipped.log", lambda r: f"{r['reason']} -> {r['title']}\\n{r['url']}\\n")
+    sink.emit("skip", reason="LOW_RES", title=title, url=url, stage="filter")
+    sink.close()   # 或等 atexit
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+# ==============================
+# 配置区
+# ==============================
+STRUCTURED_EXT = ".jsonl"
+BATCH_MAX = 1000            # 写线程每次最多取出的记录数
+RECORD_FIELDS = ("reason", "title", "url", "elapsed", "stage")
+
+_STOP = object()
+_open_sinks = []
+
+
+def structured_path(path):
+    return os.path.splitext(path)[0] + STRUCTURED_EXT
+
+
+class LogSink:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._targets = {}       # name -> (文本文件, jsonl 文件, formatter)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def open(self, name, path, formatter):
+        """注册一个日志目标并清空旧文件；formatter(record) 返回文本行"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            if name in self._targets:
+                for f in self._targets[name][:2]:
+                    f.close()
+            self._targets[name] = (open(path, "w", encoding="utf-8"),
+                                   open(structured_path(path), "w", encoding="utf-8"),
+                                   formatter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self._thread.start()
+                _open_sinks.append(self)
+
+    def emit(self, name, **fields):
+        """任意线程调用，只入队不做 IO"""
+        record = {"ts": round(time.time(), 3)}
+        for key in RECORD_FIELDS:
+            record[key] = fields.get(key)
+        self._queue.put((name, record))
+
+    def _write(self, batch):
+        texts, lines = {}, {}
+        for name, record in batch:
+            target = self._targets.get(name)
+            if target is None:
+                continue
+            texts.setdefault(name, []).append(target[2](record))
+            lines.setdefault(name, []).append(json.dumps(record, ensure_ascii=False) + "\n")
+        for name in texts:
+            text_f, json_f, _ = self._targets[name]
+            text_f.write("".join(texts[name]))
+            json_f.write("".join(lines[name]))
+            text_f.flush()
+            json_f.flush()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            stop = item is _STOP
+            if not stop:
+                batch.append(item)
+            # 把已排队的记录一并取出，攒成一批写
+            while not stop and len(batch) < BATCH_MAX:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            with self._lock:
+                self._write(batch)
+            if stop:
+                return
+
+    def close(self):
+        """写完队列中剩余记录并关闭文件（可重复调用）"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+        with self._lock:
+            for text_f, json_f, _ in self._targets.values():
+                text_f.close()
+                json_f.close()
+            self._targets = {}
+        if self in _open_sinks:
+            _open_sinks.remove(self)
+
+
+@atexit.register
+def _close_all():
+    for sink in list(_open_sinks):
+        sink.close()
@@ -2,6 +2,11 @@ import os
 import re
 import csv
 import unicodedata
+from channel_table import ChannelTable, MERGE_COLUMNS, MERGE_CATEGORICAL
+from channel_snapshot import save_table
+from filter_rules import load_rules
+import metrics
+import profiling
 
 # ==============================
 # 配置区
@@ -18,6 +23,7 @@ os.makedirs(ICON_DIR, exist_ok=True)
 OUTPUT_M3U = os.path.join(OUTPUT_DIR, "merge_total.m3u")
 OUTPUT_CSV = os.path.join(OUTPUT_DIR, "merge_total.csv")
 SKIPPED_LOG = os.path.join(LOG_DIR, "skipped.log")
+SOURCE_LABEL = "网络源"
 
 # ==============================
 # 工具函数
@@ -36,11 +42,15 @@ def get_icon_path(standard_name, tvg_logo_url):
     # 不下载图标，直接返回 URL
     return tvg_logo_url or ""
 
+def new_channel_table():
+    """merge_total.csv 结构的空频道表"""
+    return ChannelTable(MERGE_COLUMNS, MERGE_CATEGORICAL)
+
 def read_m3u_file(file_path: str):
     """
-    读取 M3U 文件，返回频道列表，每项是 dict
+    读取 M3U 文件，返回 ChannelTable（列同 merge_total.csv）
     """
-    channels = []
+    channels = new_channel_table()
     try:
         with open(file_path, "r", encoding="utf-8") as f:
             lines = f.readlines()
@@ -63,14 +73,10 @@ def read_m3u_file(file_path: str):
                 else:
                     display_name = "未知频道"
 
-                icon_path = get_icon_path(normalize_channel_name(tvg_name or display_name), tvg_logo_url)
+                standard_name = normalize_channel_name(tvg_name or display_name)
+                icon_path = get_icon_path(standard_name, tvg_logo_url)
 
-                channels.append({
-                    "tvg_name": tvg_name,
-                    "display_name": display_name,
-                    "url": url_line,
-                    "logo": icon_path
-                })
+                channels.append((standard_name, url_line, SOURCE_LABEL, display_name, icon_path))
                 i += 2
             else:
                 i += 1
@@ -80,14 +86,14 @@ def read_m3u_file(file_path: str):
 
     except Exception as e:
         print(f"⚠️ 读取 {file_path} 失败: {e}")
-        return []
+        return new_channel_table()
 
 def read_txt_multi_section_csv(file_path: str):
     """
     读取多段标题的CSV格式TXT文件，跳过空行和包含 #genre# 的标题行
-    返回频道列表，每项是 dict
+    返回 ChannelTable（列同 merge_total.csv）
     """
-    channels = []
+    channels = new_channel_table()
     try:
         with open(file_path, "r", encoding="utf-8") as f:
             for line in f:
@@ -100,34 +106,37 @@ def read_txt_multi_section_csv(file_path: str):
                 display_name, url = parts[0].strip(), parts[1].strip()
                 if not url.startswith("http"):
                     continue
-                channels.append({
-                    "tvg_name": display_name,
-                    "display_name": display_name,
-                    "url": url,
-                    "logo": ""
-                })
+                channels.append((normalize_channel_name(display_name), url, SOURCE_LABEL, display_name, ""))
         print(f"📡 已加载 {os.path.basename(file_path)}: {len(channels)} 条频道")
         return channels
     except Exception as e:
         print(f"⚠️ 读取 {file_path} 失败: {e}")
-        return []
+        return new_channel_table()
 
-def write_output_files(channels):
+def write_output_files(channels, rules):
     seen_urls = set()
-    valid_channels = []
-    skipped_channels = []
+    valid_rows = []
+    skipped_rows = []
 
-    for ch in channels:
-        url = ch["url"]
+    names = channels.column("standard_name")
+    for i, url in enumerate(channels.column("url")):
         if not url.startswith("http"):
-            skipped_channels.append(ch)
+            skipped_rows.append(i)
             continue
         if url in seen_urls:
-            skipped_channels.append(ch)
+            skipped_rows.append(i)
             continue
         seen_urls.add(url)
-        valid_channels.append(ch)
+        if rules.check(names[i], url):
+            skipped_rows.append(i)
+            continue
+        valid_rows.append(i)
 
+    valid_channels = channels.take(valid_rows)
+    skipped_channels = channels.take(skipped_rows)
+
+    metrics.incr("rows_valid", len(valid_channels))
+    metrics.incr("rows_skipped", len(skipped_channels))
     print(f"\n✅ 过滤有效频道: {len(valid_channels)} 条，有效 URL 去重后")
     print(f"跳过无效或重复频道: {len(skipped_channels)} 条")
 
@@ -135,50 +144,64 @@ def write_output_files(channels):
     with open(OUTPUT_M3U, "w", encoding="utf-8") as f:
         f.write("#EXTM3U\n")
         for ch in valid_channels:
-            tvg_name_norm = normalize_channel_name(ch["tvg_name"] or ch["display_name"])
-            display_name = ch["display_name"]
-            url = ch["url"]
-            f.write(f'#EXTINF:-1 tvg-name="{tvg_name_norm}",{display_name}\n{url}\n')
+            f.write(f'#EXTINF:-1 tvg-name="{ch["standard_name"]}",{ch["original_name"]}\n{ch["url"]}\n')
 
     # 写 CSV（去掉第二列空列）
     with open(OUTPUT_CSV, "w", newline="", encoding="utf-8-sig") as f:
         writer = csv.writer(f)
-        writer.writerow(["standard_name", "url", "source", "original_name", "logo"])
-        for ch in valid_channels:
-            standard_name = normalize_channel_name(ch["tvg_name"] or ch["display_name"])
-            writer.writerow([standard_name, ch["url"], "网络源", ch["display_name"], ch.get("logo", "")])
+        writer.writerow(MERGE_COLUMNS)
+        for i in range(len(valid_channels)):
+            writer.writerow(valid_channels.record(i))
+    save_table(valid_channels, OUTPUT_CSV)
 
     # 写跳过日志
     with open(SKIPPED_LOG, "w", encoding="utf-8") as f:
         for ch in skipped_channels:
-            f.write(f"{ch['display_name']},{ch['url']}\n")
+            f.write(f"{ch['original_name']},{ch['url']}\n")
 
     print(f"📁 输出文件：{OUTPUT_M3U} 和 {OUTPUT_CSV}")
     print(f"📁 跳过日志：{SKIPPED_LOG}")
 
-def merge_all_sources():
-    all_channels = []
+def merge_all_sources(rules):
+    all_channels = new_channel_table()
     if not os.path.exists(SOURCE_DIR):
         print(f"⚠️ 源目录不存在: {SOURCE_DIR}")
-        return []
+        return all_channels
 
     print(f"📂 扫描目录: {SOURCE_DIR}")
     for file in os.listdir(SOURCE_DIR):
         file_path = os.path.join(SOURCE_DIR, file)
         if file.endswith(".m3u"):
-            chs = read_m3u_file(file_path)
+            reader = read_m3u_file
         elif file.endswith(".txt"):
-            chs = read_txt_multi_section_csv(file_path)
+            reader = read_txt_multi_section_csv
         else:
             continue
+        if rules.check_source(file):
+            print(f"🗑️ 跳过已废弃源: {file} ({rules.abandoned_files[file]})")
+            continue
+        with metrics.stage(f"read:{file}") as st:
+            chs = reader(file_path)
+            st.add(len(chs))
         all_channels.extend(chs)
 
     print(f"\n📊 合并所有频道，共 {len(all_channels)} 条")
     return all_channels
 
-if __name__ == "__main__":
-    channels = merge_all_sources()
+def main():
+    rules = load_rules()
+    with metrics.stage("merge_sources") as st:
+        channels = merge_all_sources(rules)
+        st.add(len(channels))
     if channels:
-        write_output_files(channels)
+        with metrics.stage("write_outputs") as st:
+            write_output_files(channels, rules)
+            st.add(len(channels))
     else:
-        print("⚠️ 没有读取到任何频道")
\ No newline at end of file
+        print("⚠️ 没有读取到任何频道")
+    rules.report()
+
+if __name__ == "__main__":
+    metrics.start_run("merge_local_sources")
+    profiling.run(main, "merge_local_sources")
+    metrics.finish_run()
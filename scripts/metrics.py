@@ -0,0 +1,351 @@
+"""
+运行指标：分阶段计时、计数、延迟直方图、按主机错误统计、缓存命中率
+
+用法（模块级单例，线程安全）：
+    import metrics
+    metrics.start_run("csv_to_m3u")
+    with metrics.stage("read_csv") as st:
+        ...
+        st.add(rows)                      # 该阶段处理条数，用于计算吞吐
+    metrics.observe("quick_check", 0.23)  # 累计耗时 / 直方图
+    metrics.add_stage_time("difflib", 1.2, items=5000)  # 本地累计后上报
+    metrics.incr("rows_skipped")
+    metrics.host_error(url, "timeout")
+    metrics.cache("snapshot", hit=True)
+    state = metrics.drain()               # 子进程：取出并清空计数，发回父进程 metrics.merge(state)
+    metrics.finish_run()                  # 写 output/log/metrics_<name>.json 并打印汇总表
+
+未调用 start_run 时会以脚本文件名自动建立一次运行，退出时自动 finish。
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# ==============================
+# 配置区
+# ==============================
+LOG_DIR = os.path.join("output", "log")
+# 直方图桶上界（秒），最后一个桶收纳更慢的值
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 15, 30]
+BUCKET_LABELS = [f"<={b}" for b in BUCKETS] + [f">{BUCKETS[-1]}"]
+TOP_HOSTS = 10
+
+
+# ==============================
+# 数据结构
+# ==============================
+class Histogram:
+    __slots__ = ("counts", "total", "n", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.total += value
+        self.n += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+        self.n += other.n
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    def quantile(self, q):
+        """按桶上界估算分位数"""
+        if not self.n:
+            return 0.0
+        target = q * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.n,
+            "sum": round(self.total, 4),
+            "avg": round(self.total / self.n, 4) if self.n else 0.0,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {label: c for label, c in zip(BUCKET_LABELS, self.counts) if c},
+        }
+
+
+class StageHandle:
+    """stage() 返回的句柄，用于累加处理条数"""
+    __slots__ = ("items",)
+
+    def __init__(self):
+        self.items = 0
+
+    def add(self, n=1):
+        self.items += n
+
+
+class RunMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stages = {}        # 路径 -> {"seconds", "calls", "items"}
+        self.counters = {}
+        self.histograms = {}
+        self.host_errors = {}   # host -> {reason: count}
+        self.caches = {}        # name -> [hit, miss]
+        self.finished = False
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _mem_carry(self):
+        carry = getattr(self._local, "mem_carry", None)
+        if carry is None:
+            carry = self._local.mem_carry = []
+        return carry
+
+    @contextmanager
+    def stage(self, name):
+        stack = self._stack()
+        stack.append(name)
+        path = "/".join(stack)
+        handle = StageHandle()
+        # tracemalloc 开启时（profiling --trace-memory）记录阶段内存增量与峰值：
+        # 进入子阶段前把父阶段已达到的峰值存进父帧，再 reset_peak 单独计量子阶段
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            carry = self._mem_carry()
+            mem0, peak_before = tracemalloc.get_traced_memory()
+            if carry:
+                carry[-1] = max(carry[-1], peak_before)
+            carry.append(0)
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield handle
+        finally:
+            elapsed = time.perf_counter() - t0
+            stack.pop()
+            mem = None
+            if tracing and tracemalloc.is_tracing():
+                mem1, peak = tracemalloc.get_traced_memory()
+                mem = (mem1 - mem0, max(peak, self._mem_carry().pop()))
+            with self._lock:
+                st = self.stages.setdefault(path, {"seconds": 0.0, "calls": 0, "items": 0})
+                st["seconds"] += elapsed
+                st["calls"] += 1
+                st["items"] += handle.items
+                if mem:
+                    st["mem_delta_kb"] = round(st.get("mem_delta_kb", 0) + mem[0] / 1024, 1)
+                    st["mem_peak_kb"] = round(max(st.get("mem_peak_kb", 0), mem[1] / 1024), 1)
+
+    def add_stage_time(self, name, seconds, items=0, calls=1):
+        """直接累加已测得的耗时（热点循环里本地累计后一次性上报）"""
+        path = "/".join(self._stack() + [name])
+        with self._lock:
+            st = self.stages.setdefault(path, {"seconds": 0.0, "calls": 0, "items": 0})
+            st["seconds"] += seconds
+            st["calls"] += calls
+            st["items"] += items
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.add(value)
+
+    def host_error(self, url, reason):
+        host = urlparse(url).hostname or url
+        with self._lock:
+            per_host = self.host_errors.setdefault(host, {})
+            per_host[reason] = per_host.get(reason, 0) + 1
+
+    def cache(self, name, hit):
+        with self._lock:
+            entry = self.caches.setdefault(name, [0, 0])
+            entry[0 if hit else 1] += 1
+
+    # ---------- 跨进程汇总 ----------
+    def drain(self):
+        """取出计数/直方图/主机错误/缓存并清空（阶段计时不含在内），结果可 pickle"""
+        with self._lock:
+            state = {"counters": self.counters, "histograms": self.histograms,
+                     "host_errors": self.host_errors, "caches": self.caches}
+            self.counters, self.histograms, self.host_errors, self.caches = {}, {}, {}, {}
+        return state
+
+    def merge(self, state):
+        """并入 drain() 取出的数据"""
+        with self._lock:
+            for name, n in state["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, hist in state["histograms"].items():
+                self.histograms.setdefault(name, Histogram()).merge(hist)
+            for host, reasons in state["host_errors"].items():
+                per_host = self.host_errors.setdefault(host, {})
+                for reason, n in reasons.items():
+                    per_host[reason] = per_host.get(reason, 0) + n
+            for name, (hit, miss) in state["caches"].items():
+                entry = self.caches.setdefault(name, [0, 0])
+                entry[0] += hit
+                entry[1] += miss
+
+    # ---------- 输出 ----------
+    def to_dict(self):
+        wall = time.perf_counter() - self._t0
+        with self._lock:
+            stages = {}
+            for path, st in self.stages.items():
+                rate = st["items"] / st["seconds"] if st["items"] and st["seconds"] > 0 else None
+                stages[path] = dict(st, seconds=round(st["seconds"], 4),
+                                    per_second=round(rate, 1) if rate else None)
+            hosts = sorted(self.host_errors.items(), key=lambda kv: -sum(kv[1].values()))
+            return {
+                "script": self.name,
+                "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+                "wall_seconds": round(wall, 3),
+                "stages": stages,
+                "counters": dict(self.counters),
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+                "host_errors": {host: dict(reasons) for host, reasons in hosts},
+                "caches": {k: {"hit": h, "miss": m, "hit_rate": round(h / (h + m), 4) if h + m else None}
+                           for k, (h, m) in self.caches.items()},
+            }
+
+    def summary(self, data):
+        lines = [f"\n📊 运行指标 [{self.name}] 总耗时 {data['wall_seconds']}s"]
+        if data["stages"]:
+            lines.append(f"{'阶段':<36}{'耗时(s)':>10}{'次数':>8}{'条数':>10}{'条/秒':>10}")
+            for path, st in sorted(data["stages"].items()):
+                rate = st["per_second"] if st["per_second"] is not None else "-"
+                line = f"{path:<36}{st['seconds']:>10.3f}{st['calls']:>8}{st['items']:>10}{rate:>10}"
+                if "mem_peak_kb" in st:
+                    line += f"  Δ{st['mem_delta_kb']:.0f}KiB 峰值{st['mem_peak_kb']:.0f}KiB"
+                lines.append(line)
+        if data["histograms"]:
+            lines.append(f"{'计时':<36}{'次数':>8}{'平均':>10}{'p50':>8}{'p95':>8}{'最大':>8}")
+            for name, h in data["histograms"].items():
+                lines.append(f"{name:<36}{h['count']:>8}{h['avg']:>10.3f}{h['p50']:>8}{h['p95']:>8}"
+                             f"{(h['max'] or 0):>8.2f}")
+        for name, value in data["counters"].items():
+            lines.append(f"🔢 {name}: {value}")
+        for name, c in data["caches"].items():
+            rate = f"{c['hit_rate']:.1%}" if c["hit_rate"] is not None else "-"
+            lines.append(f"💾 {name}: 命中 {c['hit']} / 未命中 {c['miss']} ({rate})")
+        for host, reasons in list(data["host_errors"].items())[:TOP_HOSTS]:
+            detail = ", ".join(f"{r}={n}" for r, n in reasons.items())
+            lines.append(f"🌐 {host}: {detail}")
+        return "\n".join(lines)
+
+    def finish(self, write=True):
+        if self.finished:
+            return None
+        self.finished = True
+        data = self.to_dict()
+        path = None
+        if write:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            path = os.path.join(LOG_DIR, f"metrics_{self.name}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        print(self.summary(data))
+        if path:
+            print(f"📁 指标文件: {path}")
+        return path
+
+
+# ==============================
+# 模块级接口
+# ==============================
+_run = None
+_run_lock = threading.Lock()
+
+def start_run(name=None):
+    """开始一次运行（已有未结束的运行则直接返回它）"""
+    global _run
+    with _run_lock:
+        if _run is None or _run.finished:
+            name = name or os.path.splitext(os.path.basename(sys.argv[0] or "run"))[0] or "run"
+            _run = RunMetrics(name)
+        return _run
+
+def reset_run(name):
+    """子进程中丢弃从父进程继承的运行数据，重新开始一次（只用于 drain 回传，不写文件）"""
+    global _run
+    with _run_lock:
+        _run = RunMetrics(name)
+        _run.finished = True  # 不参与 atexit 写文件
+        return _run
+
+def current():
+    # finish_run 之后（如超时后仍在收尾的线程）的记录落到已结束的运行里直接丢弃，不再新建运行
+    return _run if _run is not None else start_run()
+
+def stage(name):
+    return current().stage(name)
+
+def add_stage_time(name, seconds, items=0, calls=1):
+    current().add_stage_time(name, seconds, items, calls)
+
+def incr(name, n=1):
+    current().incr(name, n)
+
+def observe(name, value):
+    current().observe(name, value)
+
+def host_error(url, reason):
+    current().host_error(url, reason)
+
+def cache(name, hit):
+    current().cache(name, hit)
+
+def drain():
+    return current().drain()
+
+def merge(state):
+    current().merge(state)
+
+def finish_run(write=True):
+    if _run is not None:
+        return _run.finish(write)
+    return None
+
+@atexit.register
+def _finish_at_exit():
+    if _run is not None and not _run.finished:
+        _run.finish()
@@ -0,0 +1,187 @@
+"""
+频道图标优化
+
+png/ 下的原始图标很多偏大，还有不少内容完全相同、只是文件名不同的副本。本脚本：
+    1. 按文件内容 sha256 去重，每份内容只处理一次（按 文件大小 + mtime 缓存哈希，未变的文件不重读）
+    2. 为每份内容生成缩小并重新压缩的变体（VARIANTS，只缩小不放大；转 256 色调色板），
+       存进按内容寻址的 png/opt/<哈希>_<变体>.png
+    3. 写出清单 png/opt/manifest.json：频道名 -> 内容哈希 -> 各变体文件
+已不被任何图标引用的变体文件会被清理。csv_to_m3u 读取清单，tvg-logo 指向优化后的变体。
+
+清单格式:
+    {"version": 1,
+     "variants": {"sm": [128, 128], "md": [256, 256]},
+     "channels": {"CCTV1": "<哈希>", ...},
+     "blobs": {"<哈希>": {"bytes": 原始字节数, "sm": "png/opt/<哈希>_sm.png", "md": ...}, ...},
+     "files": {"CCTV1.png": [字节数, mtime_ns, "<哈希>"], ...}}
+"""
+import os
+import io
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import metrics
+import profiling
+
+# ==============================
+# 配置区
+# ==============================
+ICON_DIR = "png"
+STORE_DIR = os.path.join(ICON_DIR, "opt")
+MANIFEST_FILE = os.path.join(STORE_DIR, "manifest.json")
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+VARIANTS = {"sm": (128, 128), "md": (256, 256)}   # 变体名 -> 最大宽高
+PALETTE_COLORS = 256
+HASH_LEN = 16
+VERSION = 1
+WORKERS = os.cpu_count() or 1
+
+
+# ==============================
+# 工具函数
+# ==============================
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()[:HASH_LEN]
+
+def variant_path(digest, variant):
+    return os.path.join(STORE_DIR, f"{digest}_{variant}.png")
+
+def encode_png(img):
+    """重新压缩为 256 色调色板 PNG（带透明度）；机顶盒上的小图标肉眼看不出差别，体积约为真彩色的 1/3"""
+    img = img.quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+    out = io.BytesIO()
+    img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+def build_variants(src_path, digest):
+    """生成一份内容的所有变体；在子进程中运行，返回 {变体名: 路径}"""
+    with open(src_path, "rb") as f:
+        raw = f.read()
+    with Image.open(io.BytesIO(raw)) as img:
+        img.load()
+        is_png = img.format == "PNG"
+        # 调色板 / 灰度图先转 RGBA，缩放时才能用 LANCZOS 插值
+        rgba = img.convert("RGBA")
+        files = {}
+        for variant, box in VARIANTS.items():
+            resized = rgba.copy()
+            shrink = resized.width > box[0] or resized.height > box[1]
+            if shrink:
+                resized.thumbnail(box, Image.Resampling.LANCZOS)
+            data = encode_png(resized)
+            if not shrink and is_png and len(raw) <= len(data):
+                data = raw  # 原图已经足够小，重新压缩反而更大时保留原文件
+            path = variant_path(digest, variant)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+            files[variant] = path.replace(os.sep, "/")
+    return files
+
+def load_manifest():
+    if os.path.exists(MANIFEST_FILE):
+        try:
+            with open(MANIFEST_FILE, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == VERSION and manifest.get("variants") == {k: list(v) for k, v in VARIANTS.items()}:
+                return manifest
+            print("⚠️ 图标清单版本或变体配置已变，全部重新生成")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 图标清单不可用，全部重新生成: {e}")
+    return {"version": VERSION, "variants": {k: list(v) for k, v in VARIANTS.items()},
+            "channels": {}, "blobs": {}, "files": {}}
+
+def save_manifest(manifest):
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+# ==============================
+# 主程序
+# ==============================
+def main():
+    os.makedirs(STORE_DIR, exist_ok=True)
+    manifest = load_manifest()
+    old_files, old_blobs = manifest["files"], manifest["blobs"]
+
+    # 扫描图标并按内容去重
+    files, channels, sources = {}, {}, {}
+    with metrics.stage("hash") as st:
+        for name in sorted(os.listdir(ICON_DIR)):
+            path = os.path.join(ICON_DIR, name)
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in IMAGE_EXTS or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            cached = old_files.get(name)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                digest = cached[2]
+                metrics.cache("icon_hash", True)
+            else:
+                digest = file_hash(path)
+                metrics.cache("icon_hash", False)
+            files[name] = [stat.st_size, stat.st_mtime_ns, digest]
+            # 同名不同扩展名时 .png 优先
+            if stem not in channels or ext.lower() == ".png":
+                channels[stem] = digest
+            sources.setdefault(digest, path)
+            st.add()
+    print(f"🖼️ 图标 {len(files)} 个，去重后 {len(sources)} 份内容")
+    metrics.incr("icons_duplicate", len(files) - len(sources))
+
+    # 生成缺失的变体
+    blobs, todo = {}, []
+    for digest, path in sources.items():
+        prev = old_blobs.get(digest)
+        if prev and all(os.path.exists(prev.get(v, "")) for v in VARIANTS):
+            blobs[digest] = prev
+        else:
+            todo.append((digest, path))
+    print(f"⚙️ 需要生成 {len(todo)} 份内容的变体（{', '.join(VARIANTS)}）")
+    with metrics.stage("resize") as st, ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        futures = [(digest, path, executor.submit(build_variants, path, digest)) for digest, path in todo]
+        for digest, path, future in futures:
+            try:
+                entry = future.result()
+            except Exception as e:
+                # 损坏或无法识别的图片：不进清单，csv_to_m3u 回退到原图
+                metrics.incr("icons_failed")
+                print(f"⚠️ 无法处理 {path}: {e}")
+                continue
+            entry["bytes"] = os.path.getsize(path)
+            blobs[digest] = entry
+            st.add()
+    channels = {name: digest for name, digest in channels.items() if digest in blobs}
+
+    # 清理不再引用的变体文件
+    keep = {os.path.normpath(p) for entry in blobs.values() for v, p in entry.items() if v in VARIANTS}
+    removed = 0
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        if name.endswith(".png") and os.path.normpath(path) not in keep:
+            os.remove(path)
+            removed += 1
+
+    manifest.update(channels=channels, blobs=blobs, files=files)
+    save_manifest(manifest)
+
+    original = sum(size for size, _, _ in files.values())
+    for variant in VARIANTS:
+        total = sum(os.path.getsize(entry[variant]) for entry in blobs.values())
+        metrics.incr(f"icon_bytes_{variant}", total)
+        print(f"📦 变体 {variant}: {total / 1024:.0f} KB（原图合计 {original / 1024:.0f} KB）")
+    metrics.incr("icon_bytes_original", original)
+    print(f"✅ 图标优化完成，清单 {MANIFEST_FILE}，清理旧文件 {removed} 个")
+
+if __name__ == "__main__":
+    metrics.start_run("optimize_icons")
+    profiling.run(main, "optimize_icons")
+    metrics.finish_run()
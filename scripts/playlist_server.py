@@ -0,0 +1,378 @@
+"""
+本地播放列表服务器
+
+机顶盒原来直接拉取 total.m3u / dxl.m3u / sjmz.m3u 原文件。这里用 aiohttp 提供：
+    /<播放列表>.m3u           生成的播放列表（PLAYLISTS）
+    /png/<路径>               频道图标（含 optimize_icons.py 生成的 png/opt/）
+响应特性：
+    预压缩     文件加载时即生成 gzip（以及装了 brotli 时的 br）版本，按 Accept-Encoding 选择
+    ETag       内容 sha256（强校验），各编码版本加后缀区分；If-None-Match 命中返回 304
+    内存缓存   每个文件最多每 CHECK_INTERVAL 秒 stat 一次，mtime/大小变化时后台线程重新加载
+    过滤       ?group=香港频道&name=翡翠台&max_sources=2（group/name 可重复或逗号分隔），
+               由加载时建好的 分组 -> 频道 -> 源 索引生成，结果按 (文件版本, 参数) 缓存 FILTER_CACHE_SIZE 份
+
+用法:
+    python scripts/playlist_server.py --port 8080
+    python scripts/playlist_server.py --port 8080 --logo-base http://192.168.1.2:8080
+    curl -H 'Accept-Encoding: gzip' 'http://127.0.0.1:8080/total.m3u?group=香港频道&max_sources=2'
+压测见 scripts/bench_playlist_server.py。
+"""
+import os
+import re
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from aiohttp import web
+import metrics
+import profiling
+
+try:
+    import brotli
+except ImportError:   # brotli 为可选依赖，没有时只提供 gzip
+    brotli = None
+
+# ==============================
+# 配置区
+# ==============================
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+PLAYLIST_DIR = "output"
+ICON_DIR = "png"
+PLAYLISTS = ("total.m3u", "dxl.m3u", "sjmz.m3u")
+ICON_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+M3U_TYPE = "audio/x-mpegurl; charset=utf-8"
+
+CHECK_INTERVAL = 1.0        # 同一文件两次 stat 的最小间隔（秒）
+MIN_COMPRESS = 512          # 小于该字节数不压缩
+GZIP_LEVEL = 9              # 静态文件只压一次，用最高压缩率
+BROTLI_QUALITY = 11
+FILTER_GZIP_LEVEL = 6       # 过滤结果按需生成，压缩率让位于首次响应速度
+FILTER_BROTLI_QUALITY = 5
+FILTER_CACHE_SIZE = 256
+ENCODING_PREFERENCE = ("br", "gzip")
+
+TVG_NAME_RE = re.compile(r'tvg-name="([^"]*)"')
+GROUP_RE = re.compile(r'group-title="([^"]*)"')
+LOGO_RE = re.compile(r'tvg-logo="(?!https?://)/?([^"]*)"')
+
+
+# ==============================
+# 响应内容
+# ==============================
+class Asset:
+    """一份响应内容及其预压缩版本；ETag 为内容哈希，各编码版本加后缀（强 ETag 要求逐字节相同）"""
+    def __init__(self, body, ctype, compress=True, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+        self.ctype = ctype
+        self.tag = hashlib.sha256(body).hexdigest()[:20]
+        self.bodies = {"identity": body}
+        if compress and len(body) >= MIN_COMPRESS:
+            self.bodies["gzip"] = gzip.compress(body, gzip_level, mtime=0)
+            if brotli is not None:
+                self.bodies["br"] = brotli.compress(body, quality=brotli_quality)
+
+    def etag(self, encoding):
+        return f'"{self.tag}"' if encoding == "identity" else f'"{self.tag}-{encoding}"'
+
+    @property
+    def size(self):
+        return sum(len(b) for b in self.bodies.values())
+
+
+def negotiate(accept_encoding, available):
+    """按 Accept-Encoding（含 q 值）选择编码，没有可用压缩版本时返回 identity"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding] = q
+    wildcard = accepted.get("*", 0.0)
+    for coding in ENCODING_PREFERENCE:
+        if coding in available and accepted.get(coding, wildcard) > 0:
+            return coding
+    return "identity"
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 比较（RFC 9110 规定用弱比较，忽略 W/ 前缀）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+# ==============================
+# 播放列表索引
+# ==============================
+class PlaylistIndex:
+    """按 分组 -> 频道 -> 源 组织的播放列表，保持原文件顺序"""
+    def __init__(self, text, logo_base=None):
+        lines = text.splitlines()
+        self.header = lines[0] if lines and lines[0].startswith("#EXTM3U") else "#EXTM3U"
+        self.channels = OrderedDict()   # (分组, 频道名) -> [源文本块]
+        pending = []
+        for line in lines[1:] if lines and lines[0].startswith("#EXTM3U") else lines:
+            line = line.strip()
+            if not line:
+                continue
+            if logo_base and line.startswith("#EXTINF"):
+                line = LOGO_RE.sub(lambda m: f'tvg-logo="{logo_base}/{m.group(1)}"', line)
+            pending.append(line)
+            if line.startswith("#"):
+                continue
+            extinf = next((l for l in pending if l.startswith("#EXTINF")), "")
+            m = TVG_NAME_RE.search(extinf)
+            name = m.group(1) if m else extinf.rpartition(",")[2].strip()
+            m = GROUP_RE.search(extinf)
+            group = m.group(1) if m else ""
+            self.channels.setdefault((group, name), []).append("\n".join(pending))
+            pending = []
+        self.groups = {}
+        for group, name in self.channels:
+            self.groups.setdefault(group, []).append(name)
+
+    def render(self, groups=None, names=None, max_sources=None):
+        out = [self.header]
+        for (group, name), sources in self.channels.items():
+            if groups and group not in groups:
+                continue
+            if names and name not in names:
+                continue
+            out.extend(sources[:max_sources] if max_sources else sources)
+        return ("\n".join(out) + "\n").encode("utf-8")
+
+
+# ==============================
+# 文件缓存
+# ==============================
+class CachedFile:
+    __slots__ = ("key", "checked", "asset", "index")
+
+    def __init__(self, key, asset, index):
+        self.key = key
+        self.checked = time.monotonic()
+        self.asset = asset
+        self.index = index
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class FileCache:
+    """路径 -> CachedFile；加载（读取 + 压缩 + 建索引）在线程池中进行，同一文件并发请求只加载一次"""
+    def __init__(self, check_interval=CHECK_INTERVAL, logo_base=None):
+        self.check_interval = check_interval
+        self.logo_base = logo_base
+        self.entries = {}
+        self._loading = {}
+
+    def _load(self, path, playlist):
+        key = _stat_key(path)
+        with open(path, "rb") as f:
+            body = f.read()
+        index = None
+        if playlist:
+            index = PlaylistIndex(body.decode("utf-8", "replace"), self.logo_base)
+            if self.logo_base:
+                body = index.render()
+            asset = Asset(body, M3U_TYPE)
+        else:
+            ext = os.path.splitext(path)[1].lower()
+            asset = Asset(body, ICON_TYPES.get(ext, "application/octet-stream"), compress=False)
+        return CachedFile(key, asset, index)
+
+    async def get(self, path, playlist=False):
+        """返回 CachedFile，文件不存在返回 None"""
+        entry = self.entries.get(path)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked < self.check_interval:
+            metrics.cache("file", True)
+            return entry
+        try:
+            key = _stat_key(path)
+        except OSError:
+            self.entries.pop(path, None)
+            return None
+        if entry is not None and entry.key == key:
+            entry.checked = now
+            metrics.cache("file", True)
+            return entry
+        metrics.cache("file", False)
+        task = self._loading.get(path)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = self._loading[path] = loop.run_in_executor(None, self._load, path, playlist)
+            task.add_done_callback(lambda _: self._loading.pop(path, None))
+        try:
+            entry = await task
+        except OSError:
+            return None
+        if entry is not self.entries.get(path):
+            self.entries[path] = entry
+            if entry.index is not None:
+                print(f"🔄 已加载 {path}: {len(entry.index.channels)} 个频道，"
+                      f"{' / '.join(f'{enc} {len(b) // 1024} KB' for enc, b in entry.asset.bodies.items())}")
+        return entry
+
+
+class FilterCache:
+    """(文件, 内容版本, 过滤参数) -> Asset，LRU"""
+    def __init__(self, size=FILTER_CACHE_SIZE):
+        self.size = size
+        self._items = OrderedDict()
+
+    def get(self, key):
+        asset = self._items.get(key)
+        if asset is not None:
+            self._items.move_to_end(key)
+        metrics.cache("filter", asset is not None)
+        return asset
+
+    def put(self, key, asset):
+        self._items[key] = asset
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+
+# ==============================
+# 请求处理
+# ==============================
+def respond(request, asset):
+    encoding = negotiate(request.headers.get("Accept-Encoding", ""), asset.bodies)
+    etag = asset.etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if len(asset.bodies) > 1:
+        headers["Vary"] = "Accept-Encoding"
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return web.Response(status=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    metrics.incr(f"encoding_{encoding}")
+    headers["Content-Type"] = asset.ctype
+    return web.Response(body=asset.bodies[encoding], headers=headers)
+
+def _multi(query, key):
+    values = []
+    for value in query.getall(key, []):
+        values.extend(v.strip() for v in value.split(",") if v.strip())
+    return frozenset(values)
+
+def parse_filter(query):
+    """返回 (分组集合, 频道名集合, 每频道最多源数)；参数非法抛 HTTPBadRequest"""
+    max_sources = query.get("max_sources")
+    if max_sources is not None:
+        try:
+            max_sources = int(max_sources)
+        except ValueError:
+            max_sources = 0
+        if max_sources < 1:
+            raise web.HTTPBadRequest(text="max_sources 必须是正整数\n")
+    return _multi(query, "group"), _multi(query, "name"), max_sources
+
+async def handle_playlist(request):
+    app = request.app
+    filename = request.match_info["name"] + ".m3u"
+    if filename not in app["playlists"]:
+        raise web.HTTPNotFound()
+    path = os.path.join(app["playlist_dir"], filename)
+    entry = await app["files"].get(path, playlist=True)
+    if entry is None:
+        raise web.HTTPNotFound()
+    groups, names, max_sources = parse_filter(request.query)
+    if not (groups or names or max_sources):
+        return respond(request, entry.asset)
+    key = (path, entry.asset.tag, groups, names, max_sources)
+    asset = app["filtered"].get(key)
+    if asset is None:
+        def build():
+            return Asset(entry.index.render(groups, names, max_sources), M3U_TYPE,
+                         gzip_level=FILTER_GZIP_LEVEL, brotli_quality=FILTER_BROTLI_QUALITY)
+        asset = await asyncio.get_running_loop().run_in_executor(None, build)
+        app["filtered"].put(key, asset)
+    return respond(request, asset)
+
+async def handle_icon(request):
+    app = request.app
+    rel = os.path.normpath(request.match_info["path"])
+    if rel.startswith("..") or os.path.isabs(rel) or os.path.splitext(rel)[1].lower() not in ICON_TYPES:
+        raise web.HTTPNotFound()
+    entry = await app["files"].get(os.path.join(app["icon_dir"], rel))
+    if entry is None:
+        raise web.HTTPNotFound()
+    return respond(request, entry.asset)
+
+async def handle_index(request):
+    """可用的播放列表及其分组（供机顶盒端配置过滤参数）"""
+    result = {}
+    for filename in request.app["playlists"]:
+        entry = await request.app["files"].get(os.path.join(request.app["playlist_dir"], filename), playlist=True)
+        if entry is not None:
+            result[filename] = {group: len(names) for group, names in entry.index.groups.items()}
+    return web.json_response(result, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+@web.middleware
+async def timing_middleware(request, handler):
+    start = time.perf_counter()
+    try:
+        response = await handler(request)
+        metrics.incr(f"http_{response.status}")
+        return response
+    except web.HTTPException as e:
+        metrics.incr(f"http_{e.status}")
+        raise
+    finally:
+        metrics.observe("request", time.perf_counter() - start)
+
+
+def make_app(playlist_dir=PLAYLIST_DIR, icon_dir=ICON_DIR, playlists=PLAYLISTS, logo_base=None,
+             check_interval=CHECK_INTERVAL):
+    app = web.Application(middlewares=[timing_middleware])
+    app["playlist_dir"] = playlist_dir
+    app["icon_dir"] = icon_dir
+    app["playlists"] = tuple(playlists)
+    app["files"] = FileCache(check_interval, logo_base.rstrip("/") if logo_base else None)
+    app["filtered"] = FilterCache()
+    app.router.add_get("/", handle_index)
+    app.router.add_get("/{name:[^/]+}.m3u", handle_playlist)
+    app.router.add_get(f"/{os.path.basename(icon_dir)}/{{path:.+}}", handle_icon)
+    return app
+
+
+# ==============================
+# 主程序
+# ==============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地播放列表服务器")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--playlist-dir", default=PLAYLIST_DIR)
+    parser.add_argument("--icon-dir", default=ICON_DIR)
+    parser.add_argument("--playlists", default=",".join(PLAYLISTS), help="可访问的播放列表文件名，逗号分隔")
+    parser.add_argument("--logo-base", default=None,
+                        help="把相对路径的 tvg-logo 改写为 <logo-base>/png/...（部分播放器不解析相对路径）")
+    parser.add_argument("--check-interval", type=float, default=CHECK_INTERVAL, help="文件变化检查间隔（秒）")
+    args = parser.parse_args(argv)
+
+    playlists = [p for p in args.playlists.split(",") if p]
+    app = make_app(args.playlist_dir, args.icon_dir, playlists, args.logo_base, args.check_interval)
+    print(f"📡 播放列表服务器: http://{args.host}:{args.port}/ （{', '.join(playlists)}，"
+          f"压缩: gzip{' + br' if brotli is not None else '，未安装 brotli'}）")
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+if __name__ == "__main__":
+    metrics.start_run("playlist_server")
+    profiling.run(main, "playlist_server")
+    metrics.finish_run()
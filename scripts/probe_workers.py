@@ -0,0 +1,308 @@
+"""
+多进程异步流检测
+
+每个工作进程运行一个 asyncio 事件循环（aiohttp 共享连接池 + 异步 ffprobe 子进程），
+父进程通过共享任务队列按块分发 (编号, 条目)，工作进程把结果攒批发回。
+所有输出（working.m3u / working.csv / 日志 / 进度日志）仍由父进程写，工作进程只做网络与解析。
+跳转缓存在工作进程中只读（启动时加载），学习由父进程根据结果完成。
+
+用法（test_adaptive_async_batch.py --workers N 内部使用）：
+    pool = WorkerPool(workers=4, concurrency=50, timeout=15, headers=HEADERS, redirect_path=CACHE_FILE)
+    pool.start()
+    skipped, unprobed = pool.run(entries, on_result, on_batch, skip=..., deadline=...)
+    pool.close()
+"""
+import json
+import time
+import queue
+import asyncio
+import multiprocessing
+import aiohttp
+import metrics
+from redirect_cache import RedirectCache, CACHED_TARGET_TIMEOUT
+from container_sniff import judge, sniff, SNIFF_MORE, SNIFF_BYTES, SNIFF_CHUNK, STREAM_CONTENT_TYPES
+
+# ==============================
+# 配置区
+# ==============================
+CHUNK_SIZE = 50            # 每次分发给工作进程的条数
+RESULT_BATCH = 100         # 工作进程攒够多少条结果发回一次
+RESULT_INTERVAL = 0.5      # 不足一批时的定时发回间隔（秒）
+PROGRESS_EVERY = 200       # 父进程每收到多少条结果回调一次 on_batch
+JOIN_TIMEOUT = 5
+
+
+# ==============================
+# 工作进程：异步检测
+# ==============================
+async def quick_check(session, url, timeout):
+    start = time.time()
+    try:
+        async with session.head(url, allow_redirects=True,
+                                timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+            elapsed = round(time.time() - start, 3)
+            ctype = r.headers.get("content-type", "").lower()
+            ok = r.status < 400 and any(v in ctype for v in STREAM_CONTENT_TYPES)
+            metrics.observe("quick_check", elapsed)
+            if r.status >= 400:
+                metrics.host_error(url, f"HTTP_{r.status}")
+            elif not ok:
+                metrics.host_error(url, "BAD_CONTENT_TYPE")
+            return ok, elapsed, str(r.url)
+    except Exception as e:
+        elapsed = round(time.time() - start, 3)
+        metrics.observe("quick_check", elapsed)
+        metrics.host_error(url, type(e).__name__)
+        return False, elapsed, url
+
+async def sniff_check(session, url, timeout):
+    """与 test_adaptive_async_batch.sniff_check 相同：ok 为 None 表示需要 ffprobe"""
+    start = time.time()
+    final_url = url
+    try:
+        # 直播流读不完，只限制单次读取超时，总时长由下面的循环控制
+        async with session.get(url, allow_redirects=True,
+                               timeout=aiohttp.ClientTimeout(connect=timeout, sock_read=timeout)) as r:
+            final_url = str(r.url)
+            if r.status >= 400:
+                ok, reason = None, f"HTTP_{r.status}"
+            else:
+                data = bytearray()
+                async for chunk in r.content.iter_chunked(SNIFF_CHUNK):
+                    data += chunk
+                    if (sniff(data)[0] != SNIFF_MORE or len(data) >= SNIFF_BYTES
+                            or time.time() - start > timeout):
+                        break
+                ok, container, codec, reason = judge(data)
+                if ok:
+                    metrics.incr(f"codec_{container}_{codec}")
+    except Exception as e:
+        ok, reason = None, type(e).__name__
+    elapsed = round(time.time() - start, 3)
+    metrics.observe("sniff", elapsed)
+    metrics.incr("sniff_" + {True: "ok", False: "failed", None: "inconclusive"}[ok])
+    if reason:
+        metrics.host_error(url, reason)
+    return ok, elapsed, final_url
+
+async def ffprobe_check(url, timeout):
+    start = time.time()
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=codec_name",
+            "-of", "json", url,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        data = json.loads(stdout or b"{}")
+        ok = "streams" in data and len(data["streams"]) > 0
+    except Exception:
+        ok = False
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    elapsed = round(time.time() - start, 3)
+    metrics.observe("ffprobe", elapsed)
+    metrics.incr("ffprobe_spawns")
+    if not ok:
+        metrics.host_error(url, "FFPROBE_FAILED")
+    return ok, elapsed, url
+
+async def test_stream(session, entry, timeout, redirects=None):
+    """与 test_adaptive_async_batch.test_stream 返回值相同，外加异常信息（无异常为 None）"""
+    title, url, original_name, logo = entry
+    url = url.strip()
+    try:
+        target = redirects.resolve(url) if redirects is not None else None
+        ok = False
+        if target:
+            ok, elapsed, final_url = await quick_check(session, target, min(timeout, CACHED_TARGET_TIMEOUT))
+            if not ok:
+                metrics.incr("redirect_fallback")
+        if not ok:
+            ok, elapsed, final_url = await quick_check(session, url, timeout)
+        if not ok:
+            ok, elapsed, final_url = await sniff_check(session, url, timeout)
+            if ok is None:
+                ok, elapsed, final_url = await ffprobe_check(url, timeout)
+        return (ok, elapsed, final_url, title, original_name, logo), None
+    except Exception as e:
+        return (False, 0, url, title, original_name, logo), f"{type(e).__name__}: {e}"
+
+async def _worker_loop(task_q, result_q, concurrency, timeout, headers, redirects):
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(concurrency)
+    out = []
+    tasks = set()
+
+    def flush():
+        nonlocal out
+        if out:
+            result_q.put(("results", out, metrics.drain()))
+            out = []
+
+    async def ticker():
+        # 结果不足一批时也定时发回，父进程据此推进进度和截止判断
+        while True:
+            await asyncio.sleep(RESULT_INTERVAL)
+            flush()
+
+    async def probe(task_id, entry):
+        try:
+            result, error = await test_stream(session, entry, timeout, redirects)
+            out.append((task_id, result, error))
+            if len(out) >= RESULT_BATCH:
+                flush()
+        finally:
+            sem.release()
+
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    flusher = asyncio.create_task(ticker())
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        while True:
+            # 队列是阻塞的，放到线程里等，不占事件循环
+            chunk = await loop.run_in_executor(None, task_q.get)
+            if chunk is None:
+                break
+            for task_id, entry in chunk:
+                await sem.acquire()
+                task = asyncio.create_task(probe(task_id, entry))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    flusher.cancel()
+    flush()
+
+def worker_main(worker_id, task_q, result_q, concurrency, timeout, headers, redirect_path=None):
+    """工作进程入口（模块级函数，spawn 启动方式下也可 pickle）"""
+    metrics.reset_run(f"probe_worker{worker_id}")
+    redirects = RedirectCache(redirect_path).load() if redirect_path else None
+    try:
+        asyncio.run(_worker_loop(task_q, result_q, concurrency, timeout, headers, redirects))
+    finally:
+        result_q.put(("done", worker_id, metrics.drain()))
+
+
+# ==============================
+# 父进程：分发与收集
+# ==============================
+class WorkerPool:
+    def __init__(self, workers, concurrency, timeout, headers=None, redirect_path=None):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.redirect_path = redirect_path
+        self._ctx = multiprocessing.get_context()
+        self._task_q = None
+        self._result_q = None
+        self._procs = []
+        self._next_id = 0
+
+    def start(self):
+        self._task_q = self._ctx.Queue()
+        self._result_q = self._ctx.Queue()
+        self._procs = [
+            self._ctx.Process(target=worker_main, daemon=True,
+                              args=(i, self._task_q, self._result_q,
+                                    self.concurrency, self.timeout, self.headers,
+                                    self.redirect_path))
+            for i in range(self.workers)
+        ]
+        for p in self._procs:
+            p.start()
+        print(f"🧵 启动 {self.workers} 个检测进程，每进程并发 {self.concurrency}")
+
+    def run(self, entries, on_result, on_batch=None, skip=None, deadline=None, on_error=None):
+        """
+        检测 entries，接口同 test_adaptive_async_batch.probe_entries：
+        on_result(entry, result) 在父进程回调；skip(entry) 为真的条目不再分发；
+        deadline 到达后停止并返回；on_error(entry, message) 处理工作进程中的异常
+        返回 (被跳过的条目, 未检测的条目)
+        """
+        skipped, unprobed = [], []
+        in_flight = {}
+        limit = self.workers * (self.concurrency + CHUNK_SIZE)
+        pos = 0
+        since_batch = 0
+
+        while pos < len(entries) or in_flight:
+            # 补充任务：在途条目不超过各进程并发 + 一块预取
+            while pos < len(entries) and len(in_flight) < limit:
+                chunk = []
+                for entry in entries[pos:pos + CHUNK_SIZE]:
+                    if skip and skip(entry):
+                        skipped.append(entry)
+                        continue
+                    in_flight[self._next_id] = entry
+                    chunk.append((self._next_id, entry))
+                    self._next_id += 1
+                pos += CHUNK_SIZE
+                if chunk:
+                    self._task_q.put(chunk)
+
+            if not in_flight:
+                break
+            wait = RESULT_INTERVAL * 2
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+            try:
+                msg = self._result_q.get(timeout=wait)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self._procs):
+                    print("❌ 检测进程全部退出，剩余条目未检测")
+                    break
+                continue
+
+            kind, payload, state = msg
+            metrics.merge(state)
+            if kind != "results":
+                continue
+            for task_id, result, error in payload:
+                entry = in_flight.pop(task_id, None)
+                if entry is None:
+                    continue  # 上一轮截止后迟到的结果
+                if error and on_error:
+                    on_error(entry, error)
+                on_result(entry, result)
+                since_batch += 1
+            if on_batch and since_batch >= PROGRESS_EVERY:
+                on_batch(since_batch)
+                since_batch = 0
+
+        if on_batch and since_batch:
+            on_batch(since_batch)
+        unprobed.extend(in_flight.values())
+        unprobed.extend(entries[pos:])
+        return skipped, unprobed
+
+    def close(self, terminate=False):
+        """正常结束时等工作进程收尾；terminate=True（截止时间已到）直接结束"""
+        if not self._procs:
+            return
+        if terminate:
+            for p in self._procs:
+                p.terminate()
+        else:
+            for _ in self._procs:
+                self._task_q.put(None)
+            alive = len(self._procs)
+            while alive:
+                try:
+                    kind, _, state = self._result_q.get(timeout=JOIN_TIMEOUT + self.timeout * 2)
+                except queue.Empty:
+                    break
+                metrics.merge(state)
+                alive -= kind == "done"
+        for p in self._procs:
+            p.join(JOIN_TIMEOUT)
+            if p.is_alive():
+                p.terminate()
+        self._procs = []
+        self._task_q.close()
+        self._result_q.close()
@@ -0,0 +1,113 @@
+"""
+可选性能剖析：cProfile / tracemalloc
+
+所有脚本入口统一用 profiling.run(main, name) 调用 main，开关二选一：
+    命令行:   --profile  --trace-memory   （会从 sys.argv 中移除，不影响脚本自身参数）
+    环境变量: IPTV_PROFILE=1  IPTV_TRACE_MEMORY=1
+输出到 output/log/profile/：
+    <name>-<时间>.prof          cProfile 原始数据（snakeviz / pstats 可读）
+    <name>-<时间>.txt           按累计耗时和自身耗时排序的前 N 个函数
+    <name>-<时间>-memory.txt    tracemalloc 内存分配前 N 位（按行，附最大几项的调用栈）
+开启 --trace-memory 时，metrics.stage 会同时记录每个阶段的内存增量和峰值。
+注意：cProfile 只统计主线程，线程池中的探测耗时请看 metrics 直方图。
+"""
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import tracemalloc
+
+# ==============================
+# 配置区
+# ==============================
+PROFILE_DIR = os.path.join("output", "log", "profile")
+TOP_N = int(os.environ.get("IPTV_PROFILE_TOP", 40))
+TRACE_FRAMES = 10
+TRACEBACK_TOP = 5
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+def parse_flags(argv=None):
+    """取出剖析开关，返回 (profile, trace_memory)，并把开关从 argv 中删除"""
+    argv = sys.argv if argv is None else argv
+    profile = _env_flag("IPTV_PROFILE")
+    trace_memory = _env_flag("IPTV_TRACE_MEMORY")
+    if "--profile" in argv:
+        profile = True
+        argv.remove("--profile")
+    if "--trace-memory" in argv:
+        trace_memory = True
+        argv.remove("--trace-memory")
+    return profile, trace_memory
+
+
+def _report_path(name, stamp, suffix):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{name}-{stamp}{suffix}")
+
+def write_profile(profiler, name, stamp):
+    prof_path = _report_path(name, stamp, ".prof")
+    profiler.dump_stats(prof_path)
+    buf = io.StringIO()
+    stats = pstats.Stats(profiler, stream=buf).strip_dirs()
+    buf.write(f"# {name} 按累计耗时\n")
+    stats.sort_stats("cumulative").print_stats(TOP_N)
+    buf.write(f"\n# {name} 按自身耗时\n")
+    stats.sort_stats("tottime").print_stats(TOP_N)
+    txt_path = _report_path(name, stamp, ".txt")
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(buf.getvalue())
+    print(f"🔬 cProfile: {prof_path} / {txt_path}")
+
+def write_memory_report(snapshot, name, stamp):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    current, peak = tracemalloc.get_traced_memory()
+    path = _report_path(name, stamp, "-memory.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# {name} 内存: 当前 {current / 1024:.1f} KiB, 峰值 {peak / 1024:.1f} KiB\n\n")
+        f.write(f"# 按行统计前 {TOP_N} 位\n")
+        for stat in snapshot.statistics("lineno")[:TOP_N]:
+            f.write(f"{stat}\n")
+        f.write(f"\n# 前 {TRACEBACK_TOP} 位调用栈\n")
+        for stat in snapshot.statistics("traceback")[:TRACEBACK_TOP]:
+            f.write(f"\n{stat.count} 块, {stat.size / 1024:.1f} KiB\n")
+            for line in stat.traceback.format():
+                f.write(f"{line}\n")
+    print(f"🧠 tracemalloc: {path} (峰值 {peak / 1024 / 1024:.1f} MiB)")
+
+
+# ==============================
+# 入口包装
+# ==============================
+def run(main, name=None, *args, **kwargs):
+    """按开关包装执行 main(*args, **kwargs)，返回 main 的返回值"""
+    name = name or os.path.splitext(os.path.basename(sys.argv[0] or "run"))[0]
+    profile, trace_memory = parse_flags()
+    if not profile and not trace_memory:
+        return main(*args, **kwargs)
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    profiler = cProfile.Profile() if profile else None
+    if trace_memory:
+        tracemalloc.start(TRACE_FRAMES)
+    if profiler:
+        profiler.enable()
+    try:
+        return main(*args, **kwargs)
+    finally:
+        if profiler:
+            profiler.disable()
+        # 先取内存快照，避免把写剖析报告本身的分配算进去
+        snapshot = tracemalloc.take_snapshot() if trace_memory else None
+        if profiler:
+            write_profile(profiler, name, stamp)
+        if snapshot:
+            write_memory_report(snapshot, name, stamp)
+            tracemalloc.stop()
@@ -0,0 +1,180 @@
+"""
+跳转链缓存
+
+记录 "源 URL -> 最终 URL"（quick_check 跟随 302 后的 r.url），下次检测直接请求最终地址，
+失败再回退到完整跳转链。两类缓存：
+    URL 缓存    单条 URL 的最终地址，按主机 TTL 过期
+    前缀规则    同一源前缀的多条 URL 都以相同方式改写（如 http://a/live/x -> http://edge.b/cdn/live/x），
+                命中 PREFIX_MIN_HITS 次后生效，未见过的 URL 也可直接改写
+主机 TTL 自适应：同一 URL 再次解析到相同目标则该主机 TTL 翻倍，目标变化（如带 token 的边缘节点）则减半。
+前缀规则纠错：规则改写出的地址检测失败时命中次数减半（低于 PREFIX_MIN_HITS 即停用），
+完整跳转链得到的目标与规则不符时直接删除规则。缓存目标用 CACHED_TARGET_TIMEOUT 短超时探测，
+缓存失效时最多多花这几秒。
+
+学习只在父进程进行（learn 用检测结果里的最终 URL），检测线程/进程只调用 resolve。
+缓存保存在 output/middle/redirect_cache.json。
+"""
+import os
+import json
+import time
+import threading
+from urllib.parse import urlparse
+import metrics
+
+# ==============================
+# 配置区
+# ==============================
+CACHE_FILE = os.path.join("output", "middle", "redirect_cache.json")
+DEFAULT_TTL = 6 * 3600
+MIN_TTL = 600
+MAX_TTL = 7 * 86400
+PREFIX_MIN_HITS = 3
+CACHED_TARGET_TIMEOUT = 3.0   # 探测缓存目标的超时（秒），失败再走完整跳转链
+VERSION = 1
+
+
+def _host(url):
+    return (urlparse(url).hostname or "").lower()
+
+def _prefix_split(url):
+    """URL 中可作为前缀边界的位置：主机之后的每个 '/'"""
+    start = url.find("://")
+    start = start + 3 if start >= 0 else 0
+    pos = url.find("/", start)
+    while pos >= 0:
+        yield pos
+        pos = url.find("/", pos + 1)
+
+def derive_prefix_rule(src, dst):
+    """
+    src/dst 在 '/' 边界上有相同的后缀时返回 (源前缀, 目标前缀)，否则 None
+    例: http://a/live/x.m3u8 -> http://edge.b/cdn/live/x.m3u8  得 ("http://a", "http://edge.b/cdn")
+    """
+    best = None
+    for pos in _prefix_split(src):
+        suffix = src[pos:]
+        if dst.endswith(suffix) and len(dst) > len(suffix):
+            best = (src[:pos], dst[:-len(suffix)])
+            break  # 第一个边界即最长公共后缀
+    if best is None or best[0] == best[1]:
+        return None
+    return best
+
+
+class RedirectCache:
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.urls = {}        # url -> [最终 url, 过期时间]
+        self.prefixes = {}    # 源前缀 -> [目标前缀, 命中次数, 过期时间]
+        self.host_ttl = {}    # host -> 秒
+        self._lock = threading.Lock()
+
+    # ---------- 持久化 ----------
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 跳转缓存不可用，重新学习: {e}")
+            return self
+        if data.get("version") != VERSION:
+            return self
+        now = time.time()
+        self.urls = {u: v for u, v in data.get("urls", {}).items() if v[1] > now}
+        self.prefixes = {p: v for p, v in data.get("prefixes", {}).items() if v[2] > now}
+        self.host_ttl = data.get("host_ttl", {})
+        return self
+
+    def save(self):
+        now = time.time()
+        with self._lock:
+            data = {
+                "version": VERSION,
+                "urls": {u: v for u, v in self.urls.items() if v[1] > now},
+                "prefixes": {p: v for p, v in self.prefixes.items() if v[2] > now},
+                "host_ttl": self.host_ttl,
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        print(f"🔀 跳转缓存: {len(data['urls'])} 条 URL，{len(data['prefixes'])} 条前缀规则 → {self.path}")
+
+    def update(self, other):
+        """并入另一份缓存（分片按主机划分，键不会冲突）"""
+        with self._lock:
+            self.urls.update(other.urls)
+            self.prefixes.update(other.prefixes)
+            self.host_ttl.update(other.host_ttl)
+
+    # ---------- 查询 ----------
+    def _prefix_rule(self, url, now):
+        """命中的有效前缀规则 (源前缀, 规则, 分界位置)，没有返回 None"""
+        for pos in _prefix_split(url):
+            rule = self.prefixes.get(url[:pos])
+            if rule is not None and rule[1] >= PREFIX_MIN_HITS and rule[2] > now:
+                return url[:pos], rule, pos
+        return None
+
+    def resolve(self, url):
+        """返回缓存的最终地址，没有或已过期返回 None"""
+        now = time.time()
+        entry = self.urls.get(url)
+        if entry is not None and entry[1] > now:
+            metrics.cache("redirect", True)
+            return entry[0]
+        found = self._prefix_rule(url, now)
+        if found is not None:
+            _, rule, pos = found
+            metrics.cache("redirect_prefix", True)
+            return rule[0] + url[pos:]
+        metrics.cache("redirect", False)
+        return None
+
+    # ---------- 学习（父进程） ----------
+    def ttl(self, host):
+        return self.host_ttl.get(host, DEFAULT_TTL)
+
+    def learn(self, url, final_url, ok):
+        """用一次检测结果更新缓存：失败或无跳转时删除该 URL 的缓存"""
+        with self._lock:
+            previous = self.urls.pop(url, None)
+            if previous is None or previous[1] <= time.time():
+                # 这次检测用的是前缀规则改写的地址
+                self._check_prefix_rule(url, final_url, ok)
+            if not ok or not final_url or final_url == url:
+                return
+            host = _host(url)
+            ttl = self.ttl(host)
+            if previous is not None:
+                ttl = min(MAX_TTL, ttl * 2) if previous[0] == final_url else max(MIN_TTL, ttl // 2)
+                self.host_ttl[host] = ttl
+            expires = time.time() + ttl
+            self.urls[url] = [final_url, expires]
+
+            rule = derive_prefix_rule(url, final_url)
+            if rule is not None:
+                src, dst = rule
+                known = self.prefixes.get(src)
+                if known is not None and known[0] == dst:
+                    known[1] += 1
+                    known[2] = expires
+                else:
+                    # 新规则或目标变化：重新计数
+                    self.prefixes[src] = [dst, 1, expires]
+
+    def _check_prefix_rule(self, url, final_url, ok):
+        """该 URL 由前缀规则改写过时，按检测结果纠正规则（调用方持锁）"""
+        found = self._prefix_rule(url, time.time())
+        if found is None:
+            return
+        src, rule, pos = found
+        if not ok:
+            rule[1] //= 2
+            metrics.incr("redirect_prefix_demoted")
+        elif final_url != rule[0] + url[pos:]:
+            del self.prefixes[src]
+            metrics.incr("redirect_prefix_dropped")
@@ -1,13 +1,32 @@
 import os
 import csv
+import mmap
+import glob
 import time
 import json
+import argparse
+import re
+import zlib
+import unicodedata
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from collections import defaultdict
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from array import array
+from collections import defaultdict, deque
 from statistics import mean
 import multiprocessing
 import subprocess
+from channel_table import StringPool, MERGE_CATEGORICAL
+from channel_snapshot import load_table, save_table, read_csv_table
+from log_sink import LogSink, structured_path
+from filter_rules import load_rules
+from container_sniff import judge, sniff, SNIFF_MORE, SNIFF_BYTES, SNIFF_CHUNK, STREAM_CONTENT_TYPES
+from redirect_cache import RedirectCache, CACHE_FILE as REDIRECT_CACHE_FILE, CACHED_TARGET_TIMEOUT
+from availability import AvailabilityStore, LOG_FILE as AVAILABILITY_LOG, DEAD_DAYS
+from deep_probe import (run_deep_probe, format_deep, parse_deep, DEEP_COLUMNS,
+                        DEEP_SECONDS, DEEP_CONCURRENCY, DEEP_BANDWIDTH)
+import metrics
+import profiling
 
 # ==============================
 # 配置区
@@ -22,14 +41,37 @@ os.makedirs(LOG_DIR, exist_ok=True)
 CSV_FILE = os.path.join(OUTPUT_DIR, "merge_total.csv")  # 输入 CSV 文件
 OUTPUT_M3U = os.path.join(OUTPUT_DIR, "working.m3u")
 WORKING_CSV = os.path.join(OUTPUT_DIR, "working.csv")
-PROGRESS_FILE = os.path.join(MIDDLE_DIR, "progress.json")
+PROGRESS_FILE = os.path.join(MIDDLE_DIR, "progress.jsonl")
 SKIPPED_FILE = os.path.join(LOG_DIR, "skipped.log")
 SUSPECT_FILE = os.path.join(LOG_DIR, "suspect.log")
+# 优先检测的频道名来源（extract_channels / csv_to_m3u 最终发布的频道）
+PRIORITY_GLOBS = [
+    os.path.join("input", "network", "find", "*.csv"),
+    os.path.join("input", "network", "manual", "*.csv"),
+]
 
-TIMEOUT = 15
+# 分片模式（--shard i/N）的部分结果，格式同 working.csv，由 --merge-shards 合并
+SHARD_FILE_TEMPLATE = os.path.join(MIDDLE_DIR, "shard_{i}of{n}.csv")
+SHARD_FILE_RE = re.compile(r"^shard_(\d+)of(\d+)\.csv$")
+
+PAIR_COLUMNS = ("standard_name", "url", "original_name", "logo")
+BASE_WORKING_COLUMNS = ("standard_name", "", "url", "source", "original_name", "logo", "检测时间")
+# 深度检测列（未开启 --deep 时为空）；源地址为跳转前的 URL，csv_to_m3u 按它查可用性历史
+SOURCE_URL_COLUMN = "源地址"
+WORKING_COLUMNS = BASE_WORKING_COLUMNS + DEEP_COLUMNS + (SOURCE_URL_COLUMN,)
+WORKING_CATEGORICAL = ("", "source", "logo")
+
+TIMEOUT = float(os.environ.get("IPTV_TIMEOUT", 15))
+# 指定线程数时跳过联网测速（离线基准测试用）
+FORCE_THREADS = int(os.environ.get("IPTV_THREADS", 0))
 BASE_THREADS = 50
 MAX_THREADS = 200
 BATCH_SIZE = 200
+# 配额模式每波按缺口的倍数取候选源（预留失败余量，减少波数）
+QUOTA_OVERSAMPLE = 2
+# 时间预算中预留给收尾的秒数：已开始的检测最多依次经过
+# 缓存目标 quick_check（短超时）、原地址 quick_check、sniff_check、ffprobe_check 四步
+FLUSH_RESERVE = 3 * TIMEOUT + min(TIMEOUT, CACHED_TARGET_TIMEOUT)
 DEBUG = True
 
 HEADERS = {
@@ -38,48 +80,84 @@ HEADERS = {
                   "Chrome/120.0 Safari/537.36",
 }
 
-LOW_RES_KEYWORDS = ["vga", "480p", "576p"]
-BLOCK_KEYWORDS = ["espanol"]
-WHITELIST_PATTERNS = [".ctv", ".sdserver", ".sdn.", ".sda.", ".sdstream", "sdhd", "hdsd"]
-
 # ==============================
 # 工具函数
 # ==============================
-def log_skip(reason, title, url):
-    with open(SKIPPED_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{reason} -> {title}\n{url}\n")
+# 失败/过滤/可疑源日志，由 open_logs() 打开，单线程成批写出
+LOGS = LogSink()
+# 跳转链缓存，main() 中加载；检测线程只读，父进程按结果学习
+REDIRECTS = RedirectCache()
+# URL 历史可用性，main() 中加载，父进程按结果记录
+HISTORY = AvailabilityStore()
 
-def log_suspect(reason, url):
-    with open(SUSPECT_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{reason} -> {url}\n")
+def open_logs():
+    LOGS.open("skip", SKIPPED_FILE, lambda r: f"{r['reason']} -> {r['title']}\n{r['url']}\n")
+    LOGS.open("suspect", SUSPECT_FILE, lambda r: f"{r['reason']} -> {r['url']}\n")
 
-def is_allowed(title, url):
-    text = f"{title} {url}".lower()
-    if any(w in text for w in WHITELIST_PATTERNS):
-        return True
-    if any(kw in text for kw in LOW_RES_KEYWORDS):
-        log_skip("LOW_RES", title, url)
-        return False
-    if any(kw in text for kw in BLOCK_KEYWORDS):
-        log_skip("BLOCK_KEYWORD", title, url)
+def log_skip(reason, title, url, elapsed=None, stage=None):
+    LOGS.emit("skip", reason=reason, title=title, url=url, elapsed=elapsed, stage=stage)
+
+def log_suspect(reason, url, title=None, elapsed=None, stage=None):
+    LOGS.emit("suspect", reason=reason, title=title, url=url, elapsed=elapsed, stage=stage)
+
+def is_allowed(rules, title, url):
+    """filter_rules 兜底过滤（merge 阶段已按同一规则过滤，这里只拦截其他来源的 CSV）"""
+    reason = rules.check(title, url)
+    if reason:
+        log_skip(reason, title, url, stage="filter")
         return False
     return True
 
-def quick_check(url):
+def quick_check(url, timeout=TIMEOUT):
     start = time.time()
     try:
-        r = requests.head(url, headers=HEADERS, timeout=TIMEOUT, allow_redirects=True)
+        r = requests.head(url, headers=HEADERS, timeout=timeout, allow_redirects=True)
         elapsed = round(time.time() - start, 3)
         ctype = r.headers.get("content-type", "").lower()
-        ok = r.status_code < 400 and any(v in ctype for v in [
-            "video/", "mpegurl", "x-mpegurl",
-            "application/vnd.apple.mpegurl",
-            "application/x-mpegurl",
-            "application/octet-stream"
-        ])
+        ok = r.status_code < 400 and any(v in ctype for v in STREAM_CONTENT_TYPES)
+        metrics.observe("quick_check", elapsed)
+        if r.status_code >= 400:
+            metrics.host_error(url, f"HTTP_{r.status_code}")
+        elif not ok:
+            metrics.host_error(url, "BAD_CONTENT_TYPE")
         return ok, elapsed, r.url
-    except Exception:
-        return False, round(time.time() - start, 3), url
+    except Exception as e:
+        elapsed = round(time.time() - start, 3)
+        metrics.observe("quick_check", elapsed)
+        metrics.host_error(url, type(e).__name__)
+        return False, elapsed, url
+
+def sniff_check(url):
+    """
+    读取流开头几百 KB，纯 Python 解析 TS/FLV/MP4 容器头
+    返回 (ok, elapsed, final_url)；只有内容确认不是媒体时 ok 为 False，
+    无法判断或请求失败（4xx、超时等）时为 None，交给 ffprobe
+    """
+    start = time.time()
+    final_url = url
+    try:
+        with requests.get(url, headers=HEADERS, timeout=TIMEOUT, stream=True) as r:
+            final_url = r.url
+            if r.status_code >= 400:
+                ok, reason = None, f"HTTP_{r.status_code}"
+            else:
+                data = bytearray()
+                for chunk in r.iter_content(SNIFF_CHUNK):
+                    data += chunk
+                    if (sniff(data)[0] != SNIFF_MORE or len(data) >= SNIFF_BYTES
+                            or time.time() - start > TIMEOUT):
+                        break
+                ok, container, codec, reason = judge(data)
+                if ok:
+                    metrics.incr(f"codec_{container}_{codec}")
+    except Exception as e:
+        ok, reason = None, type(e).__name__
+    elapsed = round(time.time() - start, 3)
+    metrics.observe("sniff", elapsed)
+    metrics.incr("sniff_" + {True: "ok", False: "failed", None: "inconclusive"}[ok])
+    if reason:
+        metrics.host_error(url, reason)
+    return ok, elapsed, final_url
 
 def ffprobe_check(url):
     start = time.time()
@@ -96,18 +174,33 @@ def ffprobe_check(url):
     except Exception:
         ok = False
     elapsed = round(time.time() - start, 3)
+    metrics.observe("ffprobe", elapsed)
+    metrics.incr("ffprobe_spawns")
+    if not ok:
+        metrics.host_error(url, "FFPROBE_FAILED")
     return ok, elapsed, url
 
 def test_stream(entry):
     title, url, original_name, logo = entry
     url = url.strip()
     try:
-        ok, elapsed, final_url = quick_check(url)
+        # 先直接请求缓存的最终地址，失败再走完整跳转链
+        target = REDIRECTS.resolve(url)
+        ok = False
+        if target:
+            ok, elapsed, final_url = quick_check(target, min(TIMEOUT, CACHED_TARGET_TIMEOUT))
+            if not ok:
+                metrics.incr("redirect_fallback")
+        if not ok:
+            ok, elapsed, final_url = quick_check(url)
         if not ok:
-            ok, elapsed, final_url = ffprobe_check(url)
+            # HEAD 判断不了的裸流先自己解析容器，只有无法判断时才起 ffprobe
+            ok, elapsed, final_url = sniff_check(url)
+            if ok is None:
+                ok, elapsed, final_url = ffprobe_check(url)
         return (ok, elapsed, final_url, title, original_name, logo)
     except Exception as e:
-        log_skip("EXCEPTION", title, url)
+        log_skip("EXCEPTION", title, url, stage="probe")
         if DEBUG:
             print(f"❌ EXCEPTION {title} -> {url} | {e}")
         return (False, 0, url, title, original_name, logo)
@@ -136,110 +229,676 @@ def detect_optimal_threads():
 def extract_name(title):
     return title.split(",")[-1].strip() if "," in title else title.strip()
 
-def write_working_csv(all_working):
-    with open(WORKING_CSV, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.writer(f)
-        writer.writerow(["standard_name", "", "url", "source", "original_name", "logo", "检测时间"])
-        for ok, elapsed, url, title, original_name, logo in all_working:
-            if ok:
-                writer.writerow([title, "", url, "网络源", original_name, logo, elapsed])
-    print(f"📁 生成 working.csv: {WORKING_CSV}")
+class WorkingWriter:
+    """
+    流式写 working.m3u / working.csv：可用结果到达即追加到临时文件，
+    M3U 所需的分组排序只在内存保留紧凑键（分组编号、耗时、正文偏移、长度），
+    commit() 时按键重排写出，再用 os.replace 原子替换，中途崩溃不会留下缺失或半截的文件
+    m3u_path 为 None 时只写 CSV（分片结果）
+    """
+    def __init__(self, csv_path=WORKING_CSV, m3u_path=OUTPUT_M3U, keep_empty=False):
+        self.csv_path = csv_path
+        self.m3u_path = m3u_path
+        self.keep_empty = keep_empty
+        self.count = 0
+        self._csv_f = open(csv_path + ".tmp", "w", newline="", encoding="utf-8-sig")
+        self._csv = csv.writer(self._csv_f)
+        self._csv.writerow(WORKING_COLUMNS)
+        self._body = open(m3u_path + ".body.tmp", "w+b") if m3u_path else None
+        self._groups = StringPool()
+        self._group_codes = array("I")
+        self._elapsed = array("d")
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._pos = 0
+
+    def add(self, result, source_url=None):
+        """source_url 为检测前的原始 URL（跳转前），缺省同 url"""
+        ok, elapsed, url, title, original_name, logo = result
+        if not ok:
+            return
+        self._csv.writerow((title, "", url, "网络源", original_name, logo, str(elapsed))
+                           + format_deep(None) + (source_url or url,))
+        if self._body:
+            chunk = f"#EXTINF:-1,{title}\n{url}\n".encode("utf-8")
+            self._body.write(chunk)
+            self._group_codes.append(self._groups.code(extract_name(title).lower()))
+            self._elapsed.append(elapsed)
+            self._offsets.append(self._pos)
+            self._lengths.append(len(chunk))
+            self._pos += len(chunk)
+        self.count += 1
+
+    def _m3u_order(self):
+        """按分组名、组内耗时排序（稳定排序，耗时相同保持到达顺序）"""
+        names = self._groups.values
+        rank = array("I", bytes(4 * len(names)))
+        for r, code in enumerate(sorted(range(len(names)), key=names.__getitem__)):
+            rank[code] = r
+        codes, elapsed = self._group_codes, self._elapsed
+        return sorted(range(self.count), key=lambda i: (rank[codes[i]], elapsed[i]))
+
+    def _fill_deep(self, deep):
+        """把深度检测结果（url -> (吞吐, 码率, 卡顿)）填进临时 CSV 的深度检测列"""
+        csv_tmp = self.csv_path + ".tmp"
+        deep_tmp = self.csv_path + ".deep.tmp"
+        n_base = len(BASE_WORKING_COLUMNS)
+        with open(csv_tmp, encoding="utf-8-sig", newline="") as src, \
+                open(deep_tmp, "w", newline="", encoding="utf-8-sig") as dst:
+            reader, out = csv.reader(src), csv.writer(dst)
+            out.writerow(next(reader))
+            for row in reader:
+                out.writerow(row[:n_base] + list(format_deep(deep.get(row[2]))) + row[n_base + len(DEEP_COLUMNS):])
+        os.replace(deep_tmp, csv_tmp)
+
+    def commit(self, deep=None):
+        """
+        写出并原子替换；没有可用流且非 keep_empty 时丢弃临时文件、保留旧输出，返回是否写出
+        deep 为深度检测结果时一并写入 working.csv
+        """
+        self._csv_f.close()
+        if not self.count and not self.keep_empty:
+            self.discard()
+            return False
+        if deep:
+            self._fill_deep(deep)
+        if self._body:
+            self._body.flush()
+            m3u_tmp = self.m3u_path + ".tmp"
+            with open(m3u_tmp, "wb") as f:
+                f.write(b"#EXTM3U\n")
+                if self.count:
+                    with mmap.mmap(self._body.fileno(), 0, access=mmap.ACCESS_READ) as body:
+                        offsets, lengths = self._offsets, self._lengths
+                        for i in self._m3u_order():
+                            f.write(body[offsets[i]:offsets[i] + lengths[i]])
+            self._body.close()
+            os.remove(self._body.name)
+            os.replace(m3u_tmp, self.m3u_path)
+            print(f"📁 写入完成: {self.m3u_path}")
+        os.replace(self.csv_path + ".tmp", self.csv_path)
+        # 快照在提交后由 CSV 重新读出生成，检测期间不在内存中累积整表
+        if self.count:
+            save_table(read_csv_table(self.csv_path, WORKING_CATEGORICAL), self.csv_path)
+        print(f"📁 生成 working.csv: {self.csv_path}")
+        return True
+
+    def discard(self):
+        for f in (self._csv_f, self._body):
+            if f is not None and not f.closed:
+                f.close()
+        for path in (self.csv_path + ".tmp", self._body.name if self._body else None):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+def iter_working_csv(path, deep=None, sources=None):
+    """
+    逐行读取 working.csv 格式文件，产出与检测结果相同的元组
+    deep 为 dict 时顺便收集深度检测列（url -> (吞吐, 码率, 卡顿)）；兼容没有深度检测列的旧文件
+    sources 为 dict 时收集 url -> 源地址（旧文件没有该列，不收集）
+    """
+    n_base = len(BASE_WORKING_COLUMNS)
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if tuple(header or ())[:n_base] != BASE_WORKING_COLUMNS:
+            raise ValueError(f"{path} 列名不符: {header}")
+        for row in reader:
+            title, _, url, _, original_name, logo, elapsed = row[:n_base]
+            if deep is not None and len(row) >= n_base + len(DEEP_COLUMNS):
+                result = parse_deep(row[n_base:n_base + len(DEEP_COLUMNS)])
+                if result is not None:
+                    deep[url] = result
+            if sources is not None and len(row) >= len(WORKING_COLUMNS):
+                sources[url] = row[len(WORKING_COLUMNS) - 1]
+            yield (True, float(elapsed), url, title, original_name, logo)
+
 
 # ==============================
-# 主逻辑
+# 分片
 # ==============================
-if __name__ == "__main__":
-    # 清空日志
+def parse_shard(spec):
+    """'i/N'（i 从 1 开始）-> (i, N)"""
+    try:
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N: {spec}")
+    if n < 1 or not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"分片序号超出范围: {spec}")
+    return i, n
+
+def shard_of(url, n):
+    """按 主机:端口 稳定哈希分片（0..n-1），同一连接池的 URL 总在同一分片"""
+    parsed = urlparse(url)
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    host = (parsed.hostname or "") + (f":{port}" if port else "")
+    return zlib.crc32(host.encode("utf-8")) % n
+
+def shard_file(i, n):
+    return SHARD_FILE_TEMPLATE.format(i=i, n=n)
+
+def merge_shards():
+    """合并 output/middle/shard_*of*.csv 为 working.m3u / working.csv，并拼接各分片日志"""
+    found = {}
+    for name in os.listdir(MIDDLE_DIR):
+        m = SHARD_FILE_RE.match(name)
+        if m:
+            found.setdefault(int(m.group(2)), []).append(int(m.group(1)))
+    if not found:
+        raise SystemExit(f"❌ {MIDDLE_DIR} 中没有分片结果")
+    if len(found) > 1:
+        raise SystemExit(f"❌ 存在不同分片数的结果: {sorted(found)}，请先清理")
+    n, present = next(iter(found.items()))
+    missing = sorted(set(range(1, n + 1)) - set(present))
+    if missing:
+        print(f"⚠️ 缺少分片 {missing}（共 {n} 片），仅合并已有结果")
+
+    writer = WorkingWriter()
+    deep, sources = {}, {}
+    with metrics.stage("merge_shards") as st:
+        for i in sorted(present):
+            before = writer.count
+            for result in iter_working_csv(shard_file(i, n), deep, sources):
+                writer.add(result, sources.get(result[2]))
+            print(f"🧩 分片 {i}/{n}: {writer.count - before} 条可用流")
+        st.add(writer.count)
+
     for log_file in [SKIPPED_FILE, SUSPECT_FILE]:
-        if os.path.exists(log_file):
-            os.remove(log_file)
-
-    # 读取 CSV 并确认列名
-    pairs = []
-    with open(CSV_FILE, encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames
+        for path in (log_file, structured_path(log_file)):
+            base, ext = os.path.splitext(path)
+            with open(path, "w", encoding="utf-8") as out:
+                for i in sorted(present):
+                    part_log = f"{base}_shard{i}of{n}{ext}"
+                    if os.path.exists(part_log):
+                        with open(part_log, encoding="utf-8") as f:
+                            out.write(f.read())
+
+    # 各分片学到的跳转按主机划分，直接并入共享缓存
+    redirects = RedirectCache().load()
+    base, ext = os.path.splitext(REDIRECT_CACHE_FILE)
+    for i in sorted(present):
+        part = f"{base}_shard{i}of{n}{ext}"
+        if os.path.exists(part):
+            redirects.update(RedirectCache(part).load())
+    redirects.save()
+
+    # 各分片的可用性结果日志并入共享历史
+    history = AvailabilityStore().load()
+    base, ext = os.path.splitext(AVAILABILITY_LOG)
+    for i in sorted(present):
+        part = f"{base}_shard{i}of{n}{ext}"
+        if os.path.exists(part):
+            history.absorb(part)
+    history.close()
+
+    with metrics.stage("write_outputs") as st:
+        if not writer.commit(deep):
+            print("⚠️ 没有可用流，working.m3u 和 working.csv 未更新")
+        st.add(writer.count)
+    print(f"\n✅ 合并完成，{len(present)}/{n} 个分片，共 {writer.count} 条可用流")
+
+# ==============================
+# 进度日志（断点续测）
+# ==============================
+def journal_run_id(csv_path=CSV_FILE):
+    """进度日志的运行标识：日期（UTC）+ 输入 CSV 内容的 crc32；输入变了或隔天即视为新一轮"""
+    crc = 0
+    try:
+        with open(csv_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                crc = zlib.crc32(chunk, crc)
+    except OSError:
+        pass
+    return f"{time.strftime('%Y-%m-%d', time.gmtime())}:{crc:08x}"
+
+
+class ProgressJournal:
+    """
+    每条检测结果追加一行 JSON（url/ok/elapsed/final_url），中断后重跑时
+    已测过的 URL 直接复用结果，与检测顺序、波次无关
+    首行为 {"run": 运行标识}，与本次不符（昨天的或输入已变）的日志直接删除，不复用旧结论
+    """
+    def __init__(self, path, run_id=None):
+        self.path = path
+        self.run_id = run_id
+        self._f = None
+
+    def load(self):
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, encoding="utf-8") as f:
+            try:
+                stamp = json.loads(f.readline()).get("run")
+            except (ValueError, AttributeError):
+                stamp = None
+            if stamp != self.run_id:
+                print(f"🗑️ 进度日志属于其他运行（{stamp}），丢弃")
+                metrics.incr("journal_expired")
+            else:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        done[rec["url"]] = (rec["ok"], rec["elapsed"], rec["final_url"])
+                    except (ValueError, KeyError):
+                        continue  # 中断时写了半行
+        if stamp != self.run_id:
+            os.remove(self.path)
+        return done
+
+    def add(self, url, ok, elapsed, final_url):
+        if self._f is None:
+            fresh = not os.path.exists(self.path)
+            self._f = open(self.path, "a", encoding="utf-8")
+            if fresh:
+                self._f.write(json.dumps({"run": self.run_id}) + "\n")
+        self._f.write(json.dumps({"url": url, "ok": ok, "elapsed": elapsed, "final_url": final_url},
+                                 ensure_ascii=False) + "\n")
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def finish(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ==============================
+# 检测调度
+# ==============================
+def probe_entries(entries, threads, on_result, on_batch=None, skip=None, deadline=None, pool=None):
+    """
+    分批并发检测 entries，on_result(entry, result) 在主线程按完成顺序回调
+    skip(entry) 为真的条目不再检测（提交前判断；已提交未开始的会被取消）
+    deadline（time.monotonic() 时刻）到达后取消未完成的检测，立即返回
+    pool（probe_workers.WorkerPool）不为空时交给多进程异步检测，否则用线程池
+    返回 (被跳过的条目, 因截止时间未检测的条目)
+    """
+    if pool is not None:
+        return pool.run(entries, on_result, on_batch, skip=skip, deadline=deadline,
+                        on_error=lambda e, msg: log_skip("EXCEPTION", e[0], e[1], stage="probe"))
+    skipped, unprobed = [], []
+    for batch_start in range(0, len(entries), BATCH_SIZE):
+        if deadline is not None and time.monotonic() >= deadline:
+            unprobed.extend(entries[batch_start:])
+            break
+        batch = entries[batch_start:batch_start + BATCH_SIZE]
+        if skip:
+            skipped.extend(e for e in batch if skip(e))
+            batch = [e for e in batch if not skip(e)]
+        executor = ThreadPoolExecutor(max_workers=threads)
+        futures = {executor.submit(test_stream, entry): entry for entry in batch}
+        pending = set(futures)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        timed_out = False
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                pending.discard(future)
+                entry = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    result = future.result()
+                except Exception:
+                    metrics.host_error(entry[1], "EXCEPTION")
+                    log_skip("EXCEPTION", entry[0], entry[1], stage="probe")
+                    result = (False, 0, entry[1], entry[0], entry[2], entry[3])
+                on_result(entry, result)
+                if skip and skip(entry):
+                    for f, e in futures.items():
+                        if e[0] == entry[0] and f.cancel():
+                            skipped.append(e)
+        except FuturesTimeout:
+            # 已开始的请求无法中断，结果直接丢弃（线程在超时后自行结束）
+            timed_out = True
+            lost = [f for f in pending if not f.cancelled()]  # 配额取消的已计入 skipped
+            for f in lost:
+                f.cancel()
+            unprobed.extend(futures[f] for f in lost)
+        finally:
+            executor.shutdown(wait=not timed_out, cancel_futures=True)
+        if on_batch:
+            on_batch(len(batch))
+        if timed_out:
+            unprobed.extend(entries[batch_start + BATCH_SIZE:])
+            break
+    return skipped, unprobed
+
+def normalize_name(text):
+    """与 extract_channels.normalize_text 相同的规则（不含繁简转换）"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return "".join(
+        c for c in text
+        if not (c.isspace() or unicodedata.category(c).startswith(("P", "S")))
+    ).lower()
+
+def load_priority_names():
+    """find/*.csv、manual/*.csv 第一列的频道名（最终发布到 total/dxl/sjmz 的频道）"""
+    names = set()
+    for pattern in PRIORITY_GLOBS:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                for row in csv.reader(f):
+                    if row and normalize_name(row[0]):
+                        names.add(normalize_name(row[0]))
+    return names
+
+def priority_tiers(entries, priority_names):
+    """每条返回 0（名称包含任一优先频道名）或 1（长尾）；按频道名缓存"""
+    cache = {}
+    tiers = []
+    for entry in entries:
+        tier = cache.get(entry[0])
+        if tier is None:
+            norm = normalize_name(entry[0])
+            tier = cache[entry[0]] = 0 if any(p in norm for p in priority_names) else 1
+        tiers.append(tier)
+    return tiers
+
+def load_latency_history():
+    """上一轮 working.csv 中的 url -> 检测耗时，作为本轮排序依据"""
+    if not os.path.exists(WORKING_CSV) and not os.path.exists(os.path.splitext(WORKING_CSV)[0] + ".snap"):
+        return {}
+    try:
+        table = load_table(WORKING_CSV, categorical=WORKING_CATEGORICAL)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 读取历史 working.csv 失败: {e}")
+        return {}
+    with table:
+        if "url" not in table.columns or "检测时间" not in table.columns:
+            return {}
+        history = {}
+        for url, elapsed in zip(table.column("url"), table.column("检测时间")):
+            try:
+                history[url] = float(elapsed)
+            except ValueError:
+                continue
+    return history
+
+def health_rank(url, history):
+    """历史可用率高的在前；可用率相同时上轮可用的按耗时升序在前，未知的在后"""
+    elapsed = history.get(url)
+    return (HISTORY.rank_key(url),) + ((0, elapsed) if elapsed is not None else (1, 0.0))
+
+def run_quota(entries, quota, threads, history, done, record, on_batch=None, deadline=None, pool=None):
+    """
+    配额模式：按 standard_name 分组、组内按历史健康度排序，分波检测；
+    某频道已有 quota 条可用源后，剩余 URL 不再检测（记为 QUOTA_DEFERRED）
+    每波内频道按 entries 中首次出现的顺序排列（优先频道在前）；返回因截止时间未检测的条目
+    """
+    ok_count = defaultdict(int)
+    queues = {}
+    for entry in entries:
+        queues.setdefault(entry[0], []).append(entry)
+    for name, group in queues.items():
+        group.sort(key=lambda e: health_rank(e[1], history))
+        remaining = []
+        for entry in group:
+            prev = done.get(entry[1])
+            if prev is None:
+                remaining.append(entry)
+            elif prev[0]:
+                ok_count[name] += 1
+        queues[name] = deque(remaining)
+
+    def on_result(entry, result):
+        if result[0]:
+            ok_count[entry[0]] += 1
+        record(entry, result)
+
+    satisfied = lambda e: ok_count[e[0]] >= quota
+    deferred, unprobed = [], []
+    wave = 0
+    while not unprobed:
+        batch = []
+        for name, queue in queues.items():
+            deficit = quota - ok_count[name]
+            take = deficit * QUOTA_OVERSAMPLE if deficit > 0 else 0
+            while queue and take > 0:
+                batch.append(queue.popleft())
+                take -= 1
+        if not batch:
+            break
+        wave += 1
+        print(f"🌊 第 {wave} 波：检测 {len(batch)} 条（{sum(1 for q in queues.values() if q)} 个频道仍有候选源）")
+        with metrics.stage(f"wave{wave}") as st:
+            skipped, unprobed = probe_entries(batch, threads, on_result, on_batch,
+                                              skip=satisfied, deadline=deadline, pool=pool)
+            deferred.extend(skipped)
+            st.add(len(batch))
+
+    for queue in queues.values():
+        (unprobed if unprobed else deferred).extend(queue)
+    for entry in deferred:
+        log_skip("QUOTA_DEFERRED", entry[0], entry[1], stage="quota")
+    metrics.incr("quota_deferred", len(deferred))
+    print(f"🎯 配额模式：每频道 {quota} 条，{wave} 波，跳过 {len(deferred)} 条冗余源")
+    return unprobed
+
+
+# ==============================
+# 主逻辑
+# ==============================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="IPTV 流可用性检测")
+    parser.add_argument("--quota", type=int, default=int(os.environ.get("IPTV_QUOTA", 0)),
+                        help="每个频道找到 K 条可用源后停止检测该频道（0 = 全部检测）")
+    parser.add_argument("--time-budget", type=float, default=float(os.environ.get("IPTV_TIME_BUDGET", 0)),
+                        help="总时间预算（秒），到时停止检测并写出已有结果（0 = 不限）")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                        help="只检测按主机哈希分到第 i 片（共 N 片）的 URL，结果写入分片文件")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="合并各分片结果为 working.m3u / working.csv 后退出")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("IPTV_WORKERS", 0)),
+                        help="检测进程数，每进程一个异步事件循环（0 = 单进程线程池）")
+    parser.add_argument("--dead-days", type=int, default=DEAD_DAYS,
+                        help="历史上连续失败至少 N 天的 URL 跳过检测（默认开启，%(default)s 天，可用 IPTV_DEAD_DAYS 调整；定期复查；0 = 不跳过）")
+    parser.add_argument("--deep", type=float, default=DEEP_SECONDS, metavar="SECONDS",
+                        help="对可用流再下载约 SECONDS 秒内容，测吞吐/码率/卡顿（0 = 不做深度检测）")
+    parser.add_argument("--deep-concurrency", type=int, default=DEEP_CONCURRENCY,
+                        help="深度检测并发数")
+    parser.add_argument("--deep-bandwidth", type=float, default=DEEP_BANDWIDTH, metavar="MBPS",
+                        help="深度检测总带宽上限 Mbit/s（0 = 不限）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global PROGRESS_FILE, SKIPPED_FILE, SUSPECT_FILE
+    args = parse_args(argv)
+    if args.merge_shards:
+        return merge_shards()
+    if args.shard:
+        # 分片各自使用独立的进度与日志文件，本地多进程同目录运行也互不干扰
+        suffix = "_shard{}of{}".format(*args.shard)
+        PROGRESS_FILE, SKIPPED_FILE, SUSPECT_FILE = (
+            "{}{}{}".format(base, suffix, ext) for base, ext in
+            map(os.path.splitext, (PROGRESS_FILE, SKIPPED_FILE, SUSPECT_FILE)))
+        metrics.current().name += suffix
+        # 读取共享缓存，学习结果写到分片自己的文件，合并时再汇总
+        base, ext = os.path.splitext(REDIRECT_CACHE_FILE)
+        REDIRECTS.load().path = f"{base}{suffix}{ext}"
+        base, ext = os.path.splitext(AVAILABILITY_LOG)
+        HISTORY.load().log_path = f"{base}{suffix}{ext}"
+    else:
+        REDIRECTS.load()
+        HISTORY.load()
+    deadline = None
+    if args.time_budget > 0:
+        deadline = time.monotonic() + max(0.0, args.time_budget - FLUSH_RESERVE)
+
+    # 清空并打开日志
+    open_logs()
+
+    # 读取 CSV（或更新的快照）并确认列名
+    with metrics.stage("load_csv") as st:
+        source_table = load_table(CSV_FILE, categorical=MERGE_CATEGORICAL)
+        st.add(len(source_table))
+    # take() 拷贝出需要的行，之后即可释放快照映射
+    with source_table:
+        fieldnames = list(source_table.columns)
         print("CSV 字段:", fieldnames)
-        required_cols = ["standard_name", "url", "original_name", "logo"]
-        for col in required_cols:
+        for col in PAIR_COLUMNS:
             if col not in fieldnames:
                 raise ValueError(f"CSV 文件缺少 required 列: '{col}'")
-
-        for row in reader:
-            title = row.get("standard_name", "").strip()
-            url = row.get("url", "").strip()
-            original_name = row.get("original_name", "").strip()
-            logo = row.get("logo", "").strip()
-            if title and url:
-                pairs.append((title, url, original_name, logo))
+        selected = source_table.select(PAIR_COLUMNS)
+        pairs = selected.take(selected.where("url", bool, selected.where("standard_name", bool)))
 
     # 过滤
-    filtered_pairs = [p for p in pairs if is_allowed(p[0], p[1])]
+    with metrics.stage("filter") as st:
+        rules = load_rules()
+        filtered_pairs = pairs.filter(lambda p: is_allowed(rules, p["standard_name"], p["url"]))
+        st.add(len(pairs))
+    rules.report("检测前过滤规则命中")
+    metrics.incr("filtered_out", len(pairs) - len(filtered_pairs))
     print(f"🚫 跳过源: {len(pairs)-len(filtered_pairs)} 条")
 
-    total = len(filtered_pairs)
-    threads = detect_optimal_threads()
+    if args.shard:
+        shard_index, shard_count = args.shard
+        urls = filtered_pairs.column("url")
+        filtered_pairs = filtered_pairs.take(
+            [i for i in range(len(filtered_pairs)) if shard_of(urls[i], shard_count) == shard_index - 1])
+        print(f"🧩 分片 {shard_index}/{shard_count}: {len(filtered_pairs)} 条")
+
+    entries = [filtered_pairs.record(i) for i in range(len(filtered_pairs))]
+
+    # 历史上长期失效的 URL 不再每轮检测（每 RECHECK_DAYS 天复查一次）
+    if args.dead_days > 0:
+        with metrics.stage("history_skip") as st:
+            alive = []
+            for entry in entries:
+                if HISTORY.is_chronic_dead(entry[1].strip(), args.dead_days):
+                    log_skip("CHRONIC_DEAD", entry[0], entry[1], stage="history")
+                else:
+                    alive.append(entry)
+            st.add(len(entries))
+        metrics.incr("chronic_dead_skipped", len(entries) - len(alive))
+        print(f"🪦 长期失效跳过: {len(entries) - len(alive)} 条（连续失败 ≥ {args.dead_days} 天）")
+        entries = alive
+    total = len(entries)
+
+    # 优先检测会发布出去的频道，其余长尾在后；同一层内历史可用率高的先测（稳定排序）
+    with metrics.stage("prioritize") as st:
+        priority_names = load_priority_names()
+        tiers = priority_tiers(entries, priority_names)
+        order = sorted(range(total), key=lambda i: (tiers[i], HISTORY.rank_key(entries[i][1].strip())))
+        entries = [entries[i] for i in order]
+        st.add(total)
+    n_priority = tiers.count(0)
+    metrics.incr("priority_entries", n_priority)
+    print(f"⭐ 优先频道名 {len(priority_names)} 个，匹配 {n_priority} 条，长尾 {total - n_priority} 条")
+    history = load_latency_history() if args.quota else {}
+    with metrics.stage("detect_threads"):
+        threads = FORCE_THREADS or detect_optimal_threads()
     print(f"⚙️ 动态线程数：{threads}")
     print(f"🚀 开始检测 {total} 条流，每批 {BATCH_SIZE} 条")
 
-    all_working = []
+    if args.shard:
+        # 分片只写部分结果（空结果也写表头，便于合并时确认分片已完成）
+        writer = WorkingWriter(shard_file(*args.shard), m3u_path=None, keep_empty=True)
+    else:
+        writer = WorkingWriter()
     start_time = time.time()
-    done_index = 0
+    journal = ProgressJournal(PROGRESS_FILE, journal_run_id())
+    done = journal.load()
+    progress = {"done": 0}
+    working_urls = []   # 可用流（深度检测候选，按检测顺序即优先级顺序）
 
-    if os.path.exists(PROGRESS_FILE):
-        try:
-            done_index = json.load(open(PROGRESS_FILE,encoding="utf-8")).get("done",0)
-            print(f"🔄 恢复进度，从第 {done_index} 条继续")
-        except:
-            pass
+    # 恢复上次中断前的结果
+    if done:
+        for entry in entries:
+            prev = done.get(entry[1])
+            if prev is not None:
+                progress["done"] += 1
+                if prev[0]:
+                    writer.add((True, prev[1], prev[2], entry[0], entry[2], entry[3]), entry[1].strip())
+                    working_urls.append(prev[2])
+        print(f"🔄 恢复进度，已完成 {progress['done']} 条")
 
-    for batch_start in range(done_index, total, BATCH_SIZE):
-        batch = filtered_pairs[batch_start:batch_start+BATCH_SIZE]
-        with ThreadPoolExecutor(max_workers=threads) as executor:
-            futures = {executor.submit(test_stream, entry): entry for entry in batch}
-            for future in as_completed(futures):
-                entry = futures[future]
-                try:
-                    ok, elapsed, final_url, title, original_name, logo = future.result()
-                    if ok:
-                        all_working.append((ok, elapsed, final_url, title, original_name, logo))
-                        if DEBUG:
-                            print(f"✅ {extract_name(title)} ({elapsed}s)")
-                    else:
-                        log_skip("FAILED_CHECK", title, entry[1])
-                except Exception as e:
-                    log_skip("EXCEPTION", entry[0], entry[1])
-        json.dump({"done": min(batch_start + BATCH_SIZE, total)}, open(PROGRESS_FILE, "w", encoding="utf-8"))
-        print(f"🧮 本批完成：{len(all_working)}/{min(batch_start + BATCH_SIZE, total)} 可用流 | 已完成 {min(batch_start + BATCH_SIZE, total)}/{total}")
-
-    if os.path.exists(PROGRESS_FILE):
-        os.remove(PROGRESS_FILE)
-
-    if all_working:
-        # 写 M3U
-        grouped = defaultdict(list)
-        for ok, elapsed, url, title, original_name, logo in all_working:
-            name = extract_name(title).lower()
-            grouped[name].append((title, url, elapsed, original_name, logo))
-
-        if os.path.exists(OUTPUT_M3U):
-            os.remove(OUTPUT_M3U)
-
-        with open(OUTPUT_M3U, "w", encoding="utf-8") as f:
-            f.write("#EXTM3U\n")
-            for name in sorted(grouped.keys()):
-                group_sorted = sorted(grouped[name], key=lambda x: x[2])
-                for title, url, _, _, _ in group_sorted:
-                    f.write(f"#EXTINF:-1,{title}\n{url}\n")
-        print(f"📁 写入完成: {OUTPUT_M3U}")
-
-        # 写 working.csv
-        write_working_csv(all_working)
+    def record(entry, result):
+        ok, elapsed, final_url, title, original_name, logo = result
+        journal.add(entry[1], ok, elapsed, final_url)
+        url = entry[1].strip()
+        REDIRECTS.learn(url, final_url, ok)
+        HISTORY.record(url, ok, elapsed)
+        progress["done"] += 1
+        if ok:
+            writer.add(result, url)
+            working_urls.append(final_url)
+            metrics.incr("probe_ok")
+            if DEBUG:
+                print(f"✅ {extract_name(title)} ({elapsed}s)")
+        else:
+            metrics.incr("probe_failed")
+            log_skip("FAILED_CHECK", title, entry[1], elapsed, stage="probe")
+
+    def on_batch(n):
+        journal.flush()
+        HISTORY.flush()
+        probe_stage.add(n)
+        print(f"🧮 本批完成：{writer.count}/{progress['done']} 可用流 | 已完成 {progress['done']}/{total}")
+
+    pool = None
+    if args.workers > 0:
+        # aiohttp 只在多进程模式需要，线程模式与 --merge-shards 不依赖它
+        from probe_workers import WorkerPool
+        # 总并发不变，平均分给各进程
+        pool = WorkerPool(args.workers, -(-threads // args.workers), TIMEOUT, HEADERS, REDIRECT_CACHE_FILE)
+        pool.start()
+    unprobed = None
+    try:
+        with metrics.stage("probe") as probe_stage:
+            if args.quota > 0:
+                unprobed = run_quota(entries, args.quota, threads, history, done, record, on_batch,
+                                     deadline, pool)
+            else:
+                _, unprobed = probe_entries([e for e in entries if e[1] not in done], threads, record,
+                                            on_batch, deadline=deadline, pool=pool)
+    finally:
+        if pool is not None:
+            # 出错或截止时间已到时不再等在途检测
+            pool.close(terminate=unprobed is None or bool(unprobed))
 
+    REDIRECTS.save()
+    if args.shard:
+        # 分片只写自己的结果日志，由 --merge-shards 并入并按需压缩
+        HISTORY.flush()
     else:
-        print("⚠️ 没有可用流，working.m3u 和 working.csv 未更新")
+        HISTORY.close()
+
+    if unprobed:
+        # 预算用完：保留进度日志以便续测，照常写出已检测到的可用流
+        journal.close()
+        metrics.incr("deadline_unprobed", len(unprobed))
+        print(f"⏰ 时间预算用完，剩余 {len(unprobed)} 条未检测（已保留进度，可续测）")
+    else:
+        journal.finish()
+
+    deep = None
+    if args.deep > 0 and not unprobed and working_urls:
+        deep = run_deep_probe(working_urls, args.deep, args.deep_concurrency, args.deep_bandwidth,
+                              timeout=TIMEOUT, headers=HEADERS, deadline=deadline)
+
+    with metrics.stage("write_outputs") as st:
+        if not writer.commit(deep):
+            print("⚠️ 没有可用流，working.m3u 和 working.csv 未更新")
+        st.add(writer.count)
 
     elapsed_total = round(time.time() - start_time, 2)
-    print(f"\n✅ 检测完成，共 {len(all_working)} 条可用流，用时 {elapsed_total} 秒")
+    print(f"\n✅ 检测完成，共 {writer.count} 条可用流，用时 {elapsed_total} 秒")
+    LOGS.close()
     print(f"⚠️ 失败或过滤源日志: {SKIPPED_FILE}")
-    print(f"🕵️ 可疑误杀源日志: {SUSPECT_FILE}")
\ No newline at end of file
+    print(f"🕵️ 可疑误杀源日志: {SUSPECT_FILE}")
+
+if __name__ == "__main__":
+    metrics.start_run("test_adaptive_async_batch")
+    profiling.run(main, "test_adaptive_async_batch")
+    metrics.finish_run()